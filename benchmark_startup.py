@@ -0,0 +1,106 @@
+"""
+This script measures how long the application takes to start and how much memory
+a freshly started worker holds, so that changes to what is imported at startup
+can be compared.
+
+Each measurement runs in a new interpreter that creates the application, as a
+gunicorn worker does. The script reports the time to import and create the
+application, the number of modules loaded, the resident memory of the process,
+and the packages whose imports took longest according to 'python -X importtime'.
+
+Run it with the same environment as the application, e.g.
+
+    uv run benchmark_startup.py --runs 5 --output startup.json
+"""
+
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+
+STARTUP_CODE = """
+import json, resource, sys, time
+start = time.perf_counter()
+from wlu_chatbot import create_app
+create_app()
+seconds = time.perf_counter() - start
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rss_mb = rss / 1024 ** (2 if sys.platform == "darwin" else 1)
+print(json.dumps({"seconds": seconds, "modules": len(sys.modules), "rss_mb": rss_mb}))
+"""
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure_startup() -> dict[str, float]:
+    """Starts the application in a new interpreter and measures it."""
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_CODE],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_packages(count: int) -> list[tuple[str, float]]:
+    """Lists the packages whose imports take longest, including the packages that they import in turn."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    totals: dict[str, float] = {}
+    # Imports are printed after the imports that they make, so reading the
+    # lines backwards visits every module before the modules that it imports.
+    importers: list[tuple[int, str]] = []
+    for line in reversed(result.stderr.splitlines()):
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        depth = len(match.group(3))
+        package = match.group(4).split(".")[0]
+        while importers and importers[-1][0] >= depth:
+            importers.pop()
+        if not importers or importers[-1][1] != package:
+            totals[package] = totals.get(package, 0) + int(match.group(2)) / 1000
+        importers.append((depth, package))
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+def main():
+    """
+    Measure the startup and print, and optionally save, the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="the number of startups to measure")
+    parser.add_argument("--top", type=int, default=15, help="the number of slowest packages to list")
+    parser.add_argument("--output", help="a file in which to save the results as JSON")
+    args = parser.parse_args()
+
+    runs = [measure_startup() for _ in range(args.runs)]
+    results = {
+        "seconds": statistics.median(run["seconds"] for run in runs),
+        "modules": runs[-1]["modules"],
+        "rss_mb": statistics.median(run["rss_mb"] for run in runs),
+        "slowest_packages_ms": dict(slowest_packages(args.top)),
+    }
+
+    print(f"Startup time (median of {args.runs}): {results['seconds']:.3f} s")
+    print(f"Modules loaded: {results['modules']}")
+    print(f"Worker memory (median peak RSS): {results['rss_mb']:.1f} MB")
+    print("Slowest packages to import:")
+    for name, ms in results["slowest_packages_ms"].items():
+        print(f"  {ms:9.1f} ms  {name}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,17 @@
+import time
+
+from flask import g
 from flask.testing import FlaskClient
 def authenticate_as(client: FlaskClient, email: str):
+    # The app fixture's application context, and so g, is shared by every
+    # request in a test, so the user loaded by a previous request must be forgotten.
+    g.pop("_login_user", None)
     with client.session_transaction() as sess:
-        sess["_user_id"] = email
\ No newline at end of file
+        sess["_user_id"] = email
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
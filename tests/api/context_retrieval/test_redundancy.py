@@ -0,0 +1,51 @@
+from wlu_chatbot.api.context_retrieval.retrieved_segment import RetrievedSegment
+from wlu_chatbot.api.context_retrieval.redundancy import merge_adjacent, remove_near_duplicates, select_diverse
+
+
+def segment(id: int, text: str, document_id: int = 1) -> RetrievedSegment:
+    return RetrievedSegment(id=id, text=text, document_name="notes", document_id=document_id)
+
+
+def test_merge_keeps_rank_of_most_relevant_part():
+    merged = merge_adjacent([
+        segment(5, "C. D. E."),
+        segment(9, "X. Y."),
+        segment(4, "A. B. C. D."),
+    ])
+
+    assert [s.id for s in merged] == [5, 9]
+    assert merged[0].merged_ids == [4]
+    assert merged[0].text == "A. B. C. D. E."
+
+
+def test_merge_closes_gaps_between_segments():
+    merged = merge_adjacent([segment(1, "one two"), segment(3, "four five"), segment(2, "two three four")])
+
+    assert len(merged) == 1
+    assert sorted(merged[0].segment_ids) == [1, 2, 3]
+    assert merged[0].text == "one two three four five"
+
+
+def test_segments_of_different_documents_are_not_merged():
+    merged = merge_adjacent([segment(1, "one", document_id=1), segment(2, "two", document_id=2)])
+
+    assert len(merged) == 2
+
+
+def test_near_duplicates_are_removed():
+    text = "the mean of a sample estimates the mean of the population"
+    kept = remove_near_duplicates([
+        segment(1, text),
+        segment(7, text.upper() + " well"),
+        segment(9, "the median is robust to outliers in the sample"),
+    ])
+
+    assert [s.id for s in kept] == [1, 9]
+
+
+def test_diverse_selection_skips_redundant_candidates():
+    prompt = [1.0, 0.0]
+    candidates = [[1.0, 0.1], [1.0, 0.11], [0.7, -0.7]]
+
+    assert select_diverse(prompt, candidates, 2, relevance_weight=1.0) == [0, 1]
+    assert select_diverse(prompt, candidates, 2, relevance_weight=0.5) == [0, 2]
@@ -0,0 +1,271 @@
+import io
+import sys
+import threading
+from concurrent.futures import Future
+import pytest
+import sqlalchemy
+
+from flask import Flask
+from sqlalchemy.orm import Session
+
+from wlu_chatbot.config import RetrievalMode
+from wlu_chatbot.db.models import get_engine, Document, Segment, Embedding, Conversation, Message, MessageType, bump_documents_version, COMPACT_EMBEDDING_DIMENSIONS
+from wlu_chatbot.api.context_retrieval.retriever import Retriever, RetrievalCache, RetrievedSegment, adaptive_k, get_pending_preparations
+from wlu_chatbot.api.hashing import hash_bytes
+from wlu_chatbot.api.embedding import embedding as embedding_module
+from tests.conftest import MockCourse
+
+
+def add_document(course_id: int, texts: list[str]):
+    with Session(get_engine()) as sess:
+        document = Document(name="notes", file_hash=hash_bytes(io.BytesIO("|".join(texts).encode())), file_extension="txt", course_id=course_id)
+        sess.add(document)
+        sess.flush()
+        for text in texts:
+            segment = Segment(text=text, document_id=document.id)
+            sess.add(segment)
+            sess.flush()
+            sess.add(Embedding(vector=[0.1, 0.2, 0.3, 0.4, 0.5] * 20, segment_id=segment.id))
+        bump_documents_version(sess, course_id)
+        sess.commit()
+
+
+def test_retrieval_cache_evicts_least_recently_used():
+    cache = RetrievalCache(max_size=2)
+    cache.put((1, 0, "a", 3), [RetrievedSegment(id=1, text="a", document_name="d", document_id=1)])
+    cache.put((1, 0, "b", 3), [RetrievedSegment(id=2, text="b", document_name="d", document_id=1)])
+    assert cache.get((1, 0, "a", 3)) is not None
+    cache.put((1, 0, "c", 3), [RetrievedSegment(id=3, text="c", document_name="d", document_id=1)])
+
+    assert cache.get((1, 0, "b", 3)) is None
+    assert cache.get((1, 0, "a", 3)) is not None
+    assert len(cache) == 2
+
+
+def test_repeated_retrieval_is_cached(app: Flask, mock_course: MockCourse, monkeypatch):
+    add_document(mock_course.course_id, ["first", "second"])
+
+    embeddings = 0
+    def counting_embed_text(text: str):
+        nonlocal embeddings
+        embeddings += 1
+        return [0.1, 0.2, 0.3, 0.4, 0.5] * 20
+    monkeypatch.setattr(sys.modules[Retriever.__module__], "embed_text", counting_embed_text)
+
+    retriever = Retriever()
+    first = retriever.get_segments_for("what is first?", mock_course.course_id, num_segments=2)
+    second = retriever.get_segments_for("what is first?", mock_course.course_id, num_segments=2)
+
+    assert [s.id for s in first] == [s.id for s in second]
+    assert embeddings == 1
+
+
+def test_document_change_invalidates_cached_retrieval(app: Flask, mock_course: MockCourse):
+    add_document(mock_course.course_id, ["first"])
+
+    retriever = Retriever()
+    assert len(retriever.get_segments_for("what?", mock_course.course_id, num_segments=5)) == 1
+
+    add_document(mock_course.course_id, ["second", "third"])
+    segments = retriever.get_segments_for("what?", mock_course.course_id, num_segments=5)
+    assert sorted(i for s in segments for i in s.segment_ids) == [1, 2, 3]
+
+
+def test_hybrid_retrieval_finds_exact_terms(app: Flask, mock_course: MockCourse):
+    app.config["RETRIEVAL_MODE"] = RetrievalMode.HYBRID
+    add_document(mock_course.course_id, [
+        "The datapath moves values between registers.",
+        "LDR loads a word from memory using a base register and an offset.",
+        "The condition codes are set by most instructions.",
+    ])
+
+    segments = Retriever().get_segments_for("What does LDR do?", mock_course.course_id, num_segments=1)
+
+    assert len(segments) == 1
+    assert segments[0].text.startswith("LDR")
+
+
+def test_adjacent_segments_are_merged(app: Flask, mock_course: MockCourse):
+    add_document(mock_course.course_id, [
+        "Sampling error is random. It shrinks as samples grow. Bias does not shrink.",
+        "It shrinks as samples grow. Bias does not shrink. Larger samples cost more.",
+    ])
+
+    segments = Retriever().get_segments_for("what?", mock_course.course_id, num_segments=2)
+
+    assert len(segments) == 1
+    assert sorted(segments[0].segment_ids) == [1, 2]
+    assert segments[0].text == "Sampling error is random. It shrinks as samples grow. Bias does not shrink. Larger samples cost more."
+
+
+def test_merging_can_be_disabled(app: Flask, mock_course: MockCourse):
+    app.config["RETRIEVAL_MERGE_SEGMENTS"] = False
+    add_document(mock_course.course_id, ["first part", "second part"])
+
+    segments = Retriever().get_segments_for("what?", mock_course.course_id, num_segments=2)
+
+    assert len(segments) == 2
+
+
+def test_diversified_retrieval_returns_requested_number_of_segments(app: Flask, mock_course: MockCourse):
+    app.config["RETRIEVAL_MMR_LAMBDA"] = 0.5
+    for text in ["first", "second", "third", "fourth"]:
+        add_document(mock_course.course_id, [text])
+
+    segments = Retriever().get_segments_for("what?", mock_course.course_id, num_segments=2)
+
+    assert len(segments) == 2
+
+
+def test_compact_retrieval_ranks_shortlist_by_full_embeddings(app: Flask, mock_course: MockCourse):
+    app.config["COMPACT_EMBEDDINGS"] = True
+    compact = [0.0] * (COMPACT_EMBEDDING_DIMENSIONS - 1)
+    with Session(get_engine()) as sess:
+        document = Document(name="notes", file_hash="hash", file_extension="txt", course_id=mock_course.course_id)
+        sess.add(document)
+        sess.flush()
+        # The compact embeddings cannot tell these apart, but the full embeddings can.
+        for text, vector in [("far", [1.0, *compact, -1.0]), ("near", [1.0, *compact, 1.0]), ("other", [0.0, *compact, 0.0])]:
+            segment = Segment(text=text, document_id=document.id)
+            sess.add(segment)
+            sess.flush()
+            sess.add(Embedding(vector=vector, segment_id=segment.id))
+        sess.commit()
+
+    segments = Retriever().get_segments_for("q", mock_course.course_id, num_segments=1, prompt_embedding=[1.0, *compact, 1.0])
+
+    assert [s.text for s in segments] == ["near"]
+
+
+def test_compact_retrieval_searches_the_index(app: Flask, mock_course: MockCourse):
+    retriever = Retriever()
+    statement = retriever._vector_statement(mock_course.course_id, 2, [1.0] * COMPACT_EMBEDDING_DIMENSIONS, compact=True)
+    with Session(get_engine()) as sess:
+        retriever._allow_compact_search(sess, force=True)
+        sess.execute(sqlalchemy.text("SET LOCAL enable_seqscan = off"))
+        plan = "\n".join(sess.execute(sqlalchemy.text("EXPLAIN " + str(statement.compile(compile_kwargs={"literal_binds": True})))).scalars())
+
+    assert "ix_embeddings_compact_vector" in plan
+
+
+def add_segments_with_vectors(course_id: int, vectors: dict[str, list[float]]):
+    with Session(get_engine()) as sess:
+        for text, vector in vectors.items():
+            # Separate documents, so that the segments are not merged.
+            document = Document(name=text, file_hash=text, file_extension="txt", course_id=course_id)
+            sess.add(document)
+            sess.flush()
+            segment = Segment(text=text, document_id=document.id)
+            sess.add(segment)
+            sess.flush()
+            sess.add(Embedding(vector=vector, segment_id=segment.id))
+        bump_documents_version(sess, course_id)
+        sess.commit()
+
+
+def test_segments_beyond_max_distance_are_left_out(app: Flask, mock_course: MockCourse):
+    app.config["RETRIEVAL_MAX_DISTANCE"] = 0.5
+    add_segments_with_vectors(mock_course.course_id, {"near": [1.0, 0.1], "far": [0.0, 1.0]})
+
+    segments = Retriever().get_segments_for("q", mock_course.course_id, num_segments=2, prompt_embedding=[1.0, 0.0])
+
+    assert [s.text for s in segments] == ["near"]
+    assert segments[0].distance == pytest.approx(0.1, abs=1e-3)
+
+
+def test_adaptive_k_stops_at_largest_gap(app: Flask, mock_course: MockCourse):
+    app.config["RETRIEVAL_ADAPTIVE_K"] = True
+    add_segments_with_vectors(mock_course.course_id, {
+        "a": [1.0, 0.0], "b": [1.0, 0.1], "c": [1.0, 0.2], "d": [1.0, 2.0], "e": [1.0, 2.1],
+    })
+
+    segments = Retriever().get_segments_for("q", mock_course.course_id, num_segments=5, prompt_embedding=[1.0, 0.0])
+
+    assert [s.text for s in segments] == ["a", "b", "c"]
+
+
+def test_adaptive_k_keeps_evenly_spaced_segments():
+    assert adaptive_k([0.1, 0.2, 0.3, 0.4]) == 4
+    assert adaptive_k([0.1, 0.11, 0.9, 0.91]) == 2
+
+
+def test_retrieval_for_many_prompts_matches_single_retrieval(app: Flask, mock_course: MockCourse, monkeypatch):
+    add_segments_with_vectors(mock_course.course_id, {"x": [1.0, 0.0], "y": [0.0, 1.0], "xy": [0.7, 0.7]})
+    embeddings = {"about x": [1.0, 0.1], "about y": [0.1, 1.0], "about xy": [0.65, 0.6]}
+
+    batches = []
+    def batch_embed_texts(texts: list[str]):
+        batches.append(list(texts))
+        return [embeddings[t] for t in texts]
+    monkeypatch.setattr(sys.modules[Retriever.__module__], "embed_texts", batch_embed_texts)
+
+    retriever = Retriever()
+    single = retriever.get_segments_for("about y", mock_course.course_id, num_segments=2, prompt_embedding=embeddings["about y"])
+    many = retriever.get_segments_for_many(list(embeddings), mock_course.course_id, num_segments=2)
+
+    assert [[s.text for s in segments] for segments in many] == [["x", "xy"], ["y", "xy"], ["xy", "x"]]
+    assert many[1] == single
+    assert batches == [["about x", "about xy"]]
+
+
+class FakeOllama:
+    """Embeds texts like Ollama, whose single-text endpoint does not scale embeddings to unit length."""
+
+    vectors = {"about x": [3.0, 0.4], "about y": [0.3, 4.0]}
+
+    def call(self, request):
+        return request(self)
+
+    def embeddings(self, model: str, prompt: str, **kwargs):
+        return {"embedding": self.vectors[prompt]}
+
+    def embed(self, model: str, input: list[str], **kwargs):
+        norms = [sum(x * x for x in self.vectors[text]) ** 0.5 for text in input]
+        return {"embeddings": [[x / norm for x in self.vectors[text]] for text, norm in zip(input, norms)]}
+
+
+def test_single_and_batch_retrieval_find_the_same_segments(app: Flask, mock_course: MockCourse, monkeypatch):
+    app.config["RETRIEVAL_MAX_DISTANCE"] = 0.6
+    add_segments_with_vectors(mock_course.course_id, {"x": [1.0, 0.0], "y": [0.0, 1.0], "xy": [0.6, 0.8]})
+    monkeypatch.setattr(embedding_module, "get_embedding_client", lambda: FakeOllama())
+
+    single = [Retriever().get_segments_for(prompt, mock_course.course_id, num_segments=2) for prompt in FakeOllama.vectors]
+    app.extensions.pop("retrieval_cache")
+    many = Retriever().get_segments_for_many(list(FakeOllama.vectors), mock_course.course_id, num_segments=2)
+
+    assert [[s.text for s in segments] for segments in single] == [["x"], ["y", "xy"]]
+    assert many == single
+
+
+def test_prepared_segments_wait_for_a_running_preparation(app: Flask, mock_course: MockCourse):
+    add_document(mock_course.course_id, ["The mean is the average."])
+    with Session(get_engine()) as sess:
+        conv = Conversation(course_id=mock_course.course_id, initiated_by=mock_course.student_email)
+        sess.add(conv)
+        sess.flush()
+        message = Message(conversation_id=conv.id, body="What is a mean?", written_by=mock_course.student_email, type=MessageType.STUDENT_MESSAGE)
+        sess.add(message)
+        sess.commit()
+        message_id = message.id
+
+    retriever = Retriever()
+    started = threading.Event()
+    future: Future[None] = Future()
+    get_pending_preparations()[message_id] = future
+
+    def prepare():
+        started.wait()
+        with app.app_context():
+            retriever.prepare_for_message(message_id, "What is a mean?", mock_course.course_id, 3)
+        future.set_result(None)
+
+    thread = threading.Thread(target=prepare)
+    thread.start()
+    assert retriever.get_prepared_segments(message_id, mock_course.course_id, 3) is None
+
+    started.set()
+    prepared = retriever.get_prepared_segments(message_id, mock_course.course_id, 3, timeout=10)
+    thread.join()
+
+    assert prepared is not None
+    assert [s.text for s in prepared.segments] == ["The mean is the average."]
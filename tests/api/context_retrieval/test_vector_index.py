@@ -0,0 +1,141 @@
+import io
+from pathlib import Path
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from sqlalchemy.orm import Session
+
+from wlu_chatbot.config import RetrievalBackend
+from wlu_chatbot.db.models import get_engine, Document, Segment, Embedding, bump_documents_version
+from wlu_chatbot.api.context_retrieval.retriever import Retriever
+from wlu_chatbot.api.context_retrieval.vector_index import VectorIndex, get_vector_index
+from tests.conftest import MockCourse
+
+
+def add_document(course_id: int, name: str, vectors: list[list[float]]) -> tuple[int, int, list[int]]:
+    with Session(get_engine()) as sess:
+        document = Document(name=name, file_hash=name, file_extension="txt", course_id=course_id)
+        sess.add(document)
+        sess.flush()
+        segment_ids = []
+        for i, vector in enumerate(vectors):
+            segment = Segment(text=f"{name} {i}", document_id=document.id)
+            sess.add(segment)
+            sess.flush()
+            sess.add(Embedding(vector=vector, segment_id=segment.id))
+            segment_ids.append(segment.id)
+        version = bump_documents_version(sess, course_id)
+        sess.commit()
+        return document.id, version, segment_ids
+
+
+def ids(results: list[tuple[int, float]]) -> list[int]:
+    return [segment_id for segment_id, _ in results]
+
+
+def test_numpy_backend_ranks_like_postgres(app: Flask, mock_course: MockCourse):
+    add_document(mock_course.course_id, "a", [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    add_document(mock_course.course_id, "b", [[0.0, 0.0, 2.0], [0.9, 0.1, 0.0]])
+    prompt = [1.0, 0.2, 0.0]
+
+    app.config["RETRIEVAL_MERGE_SEGMENTS"] = False
+    postgres = Retriever().get_segments_for("q", mock_course.course_id, num_segments=3, prompt_embedding=prompt)
+    app.config["RETRIEVAL_BACKEND"] = RetrievalBackend.NUMPY
+    app.extensions.pop("retrieval_cache")
+    numpy = Retriever().get_segments_for("q", mock_course.course_id, num_segments=3, prompt_embedding=prompt)
+
+    assert [s.id for s in numpy] == [s.id for s in postgres]
+    assert [s.document_name for s in numpy] == [s.document_name for s in postgres]
+    # Postgres stores the embeddings at half precision.
+    assert [s.distance for s in numpy] == pytest.approx([s.distance for s in postgres], rel=1e-3)
+
+
+def test_index_is_updated_incrementally(app: Flask, mock_course: MockCourse):
+    index = get_vector_index()
+    course_id = mock_course.course_id
+    first_id, version, first_segments = add_document(course_id, "a", [[1.0, 0.0], [0.0, 1.0]])
+    assert ids(index.search(course_id, version, [1.0, 0.0], 5)) == [first_segments[0], first_segments[1]]
+
+    second_id, version, second_segments = add_document(course_id, "b", [[0.9, 0.0]])
+    index.add_document(course_id, version, second_id, second_segments, [[0.9, 0.0]])
+    assert ids(index.search(course_id, version, [1.0, 0.0], 2)) == [first_segments[0], second_segments[0]]
+
+    with Session(get_engine()) as sess:
+        sess.delete(sess.get(Document, first_id))
+        version = bump_documents_version(sess, course_id)
+        sess.commit()
+    index.remove_document(course_id, version, first_id)
+    assert ids(index.search(course_id, version, [1.0, 0.0], 5)) == second_segments
+
+    # Another process sharing the files sees the latest generation.
+    other = VectorIndex(Path(app.config["FILE_STORAGE_PATH"]) / "_vector_index")
+    assert ids(other.search(course_id, version, [1.0, 0.0], 5)) == second_segments
+
+
+def test_stale_index_is_rebuilt(app: Flask, mock_course: MockCourse):
+    index = get_vector_index()
+    course_id = mock_course.course_id
+    _, version, first_segments = add_document(course_id, "a", [[1.0, 0.0]])
+    assert ids(index.search(course_id, version, [1.0, 0.0], 5)) == first_segments
+
+    # The index is not told about this document.
+    _, version, second_segments = add_document(course_id, "b", [[0.0, 1.0]])
+    assert ids(index.search(course_id, version, [0.0, 1.0], 5)) == second_segments + first_segments
+
+
+def test_document_routes_update_index(app: Flask, client: FlaskClient, mock_course: MockCourse):
+    app.config["RETRIEVAL_BACKEND"] = RetrievalBackend.NUMPY
+    with client.session_transaction() as session:
+        session["_user_id"] = mock_course.instructor_email
+    course_id = mock_course.course_id
+    index = get_vector_index()
+    _, version, existing_segments = add_document(course_id, "a", [[0.1, 0.2, 0.3, 0.4, 0.5] * 20])
+    assert ids(index.search(course_id, version, [0.1, 0.2, 0.3, 0.4, 0.5] * 20, 5)) == existing_segments
+
+    data = {"file": (io.BytesIO(b"Sample means vary."), "notes.txt"), "course_id": course_id, "name": "notes"}
+    client.post("/documents", data=data, content_type="multipart/form-data", headers={"Referer": "/"})
+    with Session(get_engine()) as sess:
+        document = sess.query(Document).filter_by(name="notes").one()
+        uploaded_segments = [s.id for s in document.segments]
+        version = document.course.documents_version
+        document_id = document.id
+    assert sorted(ids(index.search(course_id, version, [0.1, 0.2, 0.3, 0.4, 0.5] * 20, 5))) == existing_segments + uploaded_segments
+
+    assert client.delete(f"/document/{document_id}").status_code == 204
+    assert ids(index.search(course_id, version + 1, [0.1, 0.2, 0.3, 0.4, 0.5] * 20, 5)) == existing_segments
+
+
+def test_course_without_documents_has_an_empty_index(app: Flask, mock_course: MockCourse):
+    index = get_vector_index()
+    course_id = mock_course.course_id
+
+    assert index.search(course_id, 0, [1.0, 0.0], 5) == []
+
+    document_id, version, _ = add_document(course_id, "empty", [])
+    index.add_document(course_id, version, document_id, [], [])
+    assert index.search(course_id, version, [1.0, 0.0], 5) == []
+
+    second_id, version, second_segments = add_document(course_id, "b", [[1.0, 0.0]])
+    index.add_document(course_id, version, second_id, second_segments, [[1.0, 0.0]])
+    third_id, version, _ = add_document(course_id, "also empty", [])
+    index.add_document(course_id, version, third_id, [], [])
+    assert ids(index.search(course_id, version, [1.0, 0.0], 5)) == second_segments
+
+
+def test_last_document_is_deleted_without_a_built_index(app: Flask, client: FlaskClient, mock_course: MockCourse):
+    with client.session_transaction() as session:
+        session["_user_id"] = mock_course.instructor_email
+    course_id = mock_course.course_id
+    data = {"file": (io.BytesIO(b"Sample means vary."), "notes.txt"), "course_id": course_id, "name": "notes"}
+    client.post("/documents", data=data, content_type="multipart/form-data", headers={"Referer": "/"})
+    with Session(get_engine()) as sess:
+        document = sess.query(Document).filter_by(name="notes").one()
+        document_id, path, version = document.id, document.full_file_path, document.course.documents_version
+
+    stored = Path(app.config["FILE_STORAGE_PATH"]) / path
+    assert stored.exists()
+    app.config["RETRIEVAL_BACKEND"] = RetrievalBackend.NUMPY
+    assert client.delete(f"/document/{document_id}").status_code == 204
+    assert not stored.exists()
+    assert get_vector_index().search(course_id, version + 1, [1.0, 0.0], 5) == []
@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+from flask import Flask
+
+from wlu_chatbot.api.language_model import get_admission_controller
+from wlu_chatbot.api.language_model.admission import AdmissionController, OverloadedError, Priority
+from tests import wait_until
+
+
+def _queue(controller: AdmissionController, priority: Priority, admitted: list[Priority], errors: list[Priority]) -> threading.Thread:
+    def run():
+        try:
+            with controller.admit(priority):
+                admitted.append(priority)
+        except OverloadedError:
+            errors.append(priority)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_most_urgent_request_is_admitted_first():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, max_wait_seconds=5)
+    admitted: list[Priority] = []
+    errors: list[Priority] = []
+
+    with controller.admit(Priority.INTERACTIVE):
+        threads = [_queue(controller, Priority.REPORT, admitted, errors)]
+        wait_until(lambda: controller.metrics().queued["REPORT"] == 1)
+        threads.append(_queue(controller, Priority.TITLE, admitted, errors))
+        threads.append(_queue(controller, Priority.INTERACTIVE, admitted, errors))
+        wait_until(lambda: sum(controller.metrics().queued.values()) == 3)
+        assert controller.metrics().in_flight == 1
+
+    for thread in threads:
+        thread.join()
+
+    assert admitted == [Priority.INTERACTIVE, Priority.TITLE, Priority.REPORT]
+    assert errors == []
+    metrics = controller.metrics()
+    assert metrics.admitted == 4
+    assert metrics.in_flight == 0
+
+
+def test_full_queue_refuses_or_sheds_less_urgent_requests():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait_seconds=5)
+    admitted: list[Priority] = []
+    errors: list[Priority] = []
+
+    with controller.admit(Priority.INTERACTIVE):
+        report = _queue(controller, Priority.REPORT, admitted, errors)
+        wait_until(lambda: controller.metrics().queued["REPORT"] == 1)
+
+        assert controller.is_full(Priority.REPORT)
+        assert not controller.is_full(Priority.INTERACTIVE)
+        with pytest.raises(OverloadedError):
+            with controller.admit(Priority.REPORT):
+                pass
+
+        interactive = _queue(controller, Priority.INTERACTIVE, admitted, errors)
+        report.join()
+        assert errors == [Priority.REPORT]
+
+    interactive.join()
+    assert admitted == [Priority.INTERACTIVE]
+    metrics = controller.metrics()
+    assert metrics.rejected == 1
+    assert metrics.shed == 1
+
+
+def test_request_that_waits_too_long_is_refused():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait_seconds=0.05)
+
+    with controller.admit(Priority.INTERACTIVE):
+        with pytest.raises(OverloadedError):
+            with controller.admit(Priority.INTERACTIVE):
+                pass
+
+    assert controller.metrics().timed_out == 1
+    assert controller.metrics().queued["INTERACTIVE"] == 0
+    with controller.admit(Priority.INTERACTIVE):
+        assert controller.metrics().in_flight == 1
+
+
+def test_requests_go_down_the_model_ladder_when_less_urgent_or_under_load():
+    controller = AdmissionController(max_concurrent=2, max_queue=4, max_wait_seconds=5, downgrade_queue_depth=1, downgrade_p95_seconds=60)
+
+    assert controller.rung(Priority.INTERACTIVE) == 0
+    assert controller.rung(Priority.TITLE) == 1
+
+    with controller.admit(Priority.INTERACTIVE), controller.admit(Priority.INTERACTIVE):
+        admitted: list[Priority] = []
+        report = _queue(controller, Priority.REPORT, admitted, [])
+        wait_until(lambda: controller.metrics().queued["REPORT"] == 1)
+        assert controller.rung(Priority.INTERACTIVE) == 1
+        assert controller.rung(Priority.SUMMARY) == 2
+        assert controller.metrics().downgrading
+    report.join()
+
+    assert controller.rung(Priority.INTERACTIVE) == 0
+    controller.downgrade_p95_seconds = 0
+    assert controller.rung(Priority.INTERACTIVE) == 1
+
+
+def test_limits_are_divided_among_server_workers(app: Flask):
+    app.config["SERVER_WORKERS"] = 3
+    app.config["LLM_MAX_CONCURRENCY"] = 4
+    app.config["LLM_MAX_QUEUE"] = 32
+    app.config["LLM_DOWNGRADE_QUEUE_DEPTH"] = 8
+
+    controller = get_admission_controller()
+
+    assert controller.max_concurrent == 2
+    assert controller.max_queue == 11
+    assert controller.downgrade_queue_depth == 3
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+
+from wlu_chatbot.api.language_model import gemini
+from wlu_chatbot.api.language_model.gemini import CACHE_MIN_TOKENS, Gemini
+from wlu_chatbot.api.language_model.response import ContentDict, TokenEstimator
+
+LONG_INSTRUCTION = "Answer like a statistics tutor. " * CACHE_MIN_TOKENS
+
+models: list["FakeModel"] = []
+"""The models that answered, in order."""
+
+
+class FakeModel:
+    def __init__(self, name: str, system_instruction: str | None = None, cached: SimpleNamespace | None = None):
+        self.name = name
+        self.system_instruction = system_instruction
+        self.cached = cached
+
+    @classmethod
+    def from_cached_content(cls, cached: SimpleNamespace):
+        return cls(cached.model, cached=cached)
+
+    def generate_content(self, turns: list[ContentDict], generation_config: dict):
+        models.append(self)
+        return SimpleNamespace(text="An answer.", usage_metadata=SimpleNamespace(prompt_token_count=100))
+
+
+def _gemini(monkeypatch: pytest.MonkeyPatch, create) -> Gemini:
+    models.clear()
+    monkeypatch.setattr(gemini, "genai", SimpleNamespace(configure=lambda api_key: None, GenerativeModel=FakeModel))
+    monkeypatch.setattr(gemini, "caching", SimpleNamespace(CachedContent=SimpleNamespace(create=create)))
+    client = Gemini(key="key", cache_instructions=True)
+    client.token_estimator = TokenEstimator()
+    return client
+
+
+def _ask(client: Gemini, instruction: str, question: str):
+    client.get_response([
+        ContentDict(role="system", parts=[{"text": instruction}]),
+        ContentDict(role="user", parts=[{"text": question}]),
+    ])
+
+
+def test_long_instruction_is_cached_once_for_every_turn(monkeypatch: pytest.MonkeyPatch):
+    created: list[str] = []
+
+    def create(model: str, system_instruction: str, ttl):
+        created.append(system_instruction)
+        return SimpleNamespace(model=model)
+
+    client = _gemini(monkeypatch, create)
+
+    _ask(client, LONG_INSTRUCTION, "What is a mean?")
+    _ask(client, LONG_INSTRUCTION, "And a median?")
+    _ask(client, "Answer briefly.", "What is a mode?")
+
+    assert created == [LONG_INSTRUCTION]
+    first, second, short = models
+    assert first is second
+    assert first.cached is not None and first.system_instruction is None
+    assert short.cached is None and short.system_instruction == "Answer briefly."
+
+
+def test_instruction_is_sent_along_when_it_cannot_be_cached(monkeypatch: pytest.MonkeyPatch):
+    def create(model: str, system_instruction: str, ttl):
+        raise RuntimeError("Caching is not available.")
+
+    client = _gemini(monkeypatch, create)
+
+    _ask(client, LONG_INSTRUCTION, "What is a mean?")
+
+    [model] = models
+    assert model.cached is None
+    assert model.system_instruction == LONG_INSTRUCTION
@@ -0,0 +1,79 @@
+import pytest
+from flask import Flask
+from sqlalchemy.orm import Session
+
+from wlu_chatbot.api import message_embeddings
+from wlu_chatbot.api.embedding import embedding as embedding_module
+from wlu_chatbot.api.message_embeddings import embed_message, get_message_embeddings
+from wlu_chatbot.db.models import get_engine, Conversation, Message, MessageType, MessageEmbedding
+from tests.conftest import MockCourse
+
+
+def add_messages(mock_course: MockCourse, count: int) -> list[int]:
+    with Session(get_engine()) as sess:
+        conv = Conversation(course_id=mock_course.course_id, initiated_by=mock_course.student_email)
+        sess.add(conv)
+        sess.flush()
+        messages = [
+            Message(conversation_id=conv.id, body=f"question {i}", written_by=mock_course.student_email, type=MessageType.STUDENT_MESSAGE)
+            for i in range(count)
+        ]
+        sess.add_all(messages)
+        sess.commit()
+        return [message.id for message in messages]
+
+
+def store_meanwhile(message_id: int, vector: list[float]):
+    """Stores an embedding as a concurrent request for the same message would."""
+    with Session(get_engine()) as sess:
+        sess.add(MessageEmbedding(message_id=message_id, vector=vector))
+        sess.commit()
+
+
+def test_embedding_stored_meanwhile_is_kept(app: Flask, mock_course: MockCourse, monkeypatch: pytest.MonkeyPatch):
+    [message_id] = add_messages(mock_course, 1)
+
+    def embed_text(text: str):
+        store_meanwhile(message_id, [1.0, 0.0])
+        return [0.0, 1.0]
+    monkeypatch.setattr(message_embeddings, "embed_text", embed_text)
+
+    assert embed_message(message_id, "question 0") == [1.0, 0.0]
+    with Session(get_engine()) as sess:
+        assert sess.query(MessageEmbedding).count() == 1
+
+
+def test_batch_keeps_embeddings_stored_meanwhile(app: Flask, mock_course: MockCourse, monkeypatch: pytest.MonkeyPatch):
+    first, second = add_messages(mock_course, 2)
+
+    def embed_texts(texts: list[str]):
+        store_meanwhile(first, [1.0, 0.0])
+        return [[0.0, 1.0] for _ in texts]
+    monkeypatch.setattr(message_embeddings, "embed_texts", embed_texts)
+
+    embeddings = get_message_embeddings([(first, "question 0"), (second, "question 1")])
+
+    assert embeddings == [[1.0, 0.0], [0.0, 1.0]]
+
+
+class FakeOllama:
+    """Embeds texts like Ollama, whose single-text endpoint does not scale embeddings to unit length."""
+
+    def call(self, request):
+        return request(self)
+
+    def embeddings(self, model: str, prompt: str, **kwargs):
+        return {"embedding": [3.0, 4.0]}
+
+    def embed(self, model: str, input: list[str], **kwargs):
+        return {"embeddings": [[0.6, 0.8] for _ in input]}
+
+
+def test_single_and_batch_embeddings_are_stored_at_the_same_scale(app: Flask, mock_course: MockCourse, monkeypatch: pytest.MonkeyPatch):
+    first, second = add_messages(mock_course, 2)
+    monkeypatch.setattr(embedding_module, "get_embedding_client", lambda: FakeOllama())
+
+    single = embed_message(first, "question 0")
+    [batch] = get_message_embeddings([(second, "question 1")])
+
+    assert single == batch == pytest.approx([0.6, 0.8])
@@ -0,0 +1,21 @@
+from wlu_chatbot.api.language_model.ollama import ContextSizer, context_bucket
+
+
+def test_context_bucket_doubles_up_to_the_context_window():
+    assert context_bucket(100, 8192) == 2048
+    assert context_bucket(2049, 8192) == 4096
+    assert context_bucket(5000, 8192) == 8192
+    assert context_bucket(50_000, 8192) == 8192
+    assert context_bucket(5000, 6000) == 6000
+
+
+def test_context_starts_at_an_answer_and_only_grows():
+    sizer = ContextSizer(context_window=8192)
+
+    assert sizer.current_size("large") == 4096
+    assert sizer.size_for("large", 500) == 4096
+    assert sizer.size_for("large", 5000) == 8192
+    assert sizer.size_for("small", 500) == 4096
+    assert [sizer.size_for("large", 500) for _ in range(25)] == [8192] * 25
+    assert sizer.current_size("large") == 8192
+    assert ContextSizer(context_window=2048).size_for("large", 500) == 2048
@@ -0,0 +1,76 @@
+import ollama
+import pytest
+
+from wlu_chatbot.api.ollama_pool import OllamaPool
+
+
+class FakeClient:
+    def __init__(self, url: str):
+        self.url = url
+        self.down = False
+        self.calls = 0
+
+    def list(self):
+        if self.down:
+            raise ConnectionError("down")
+        return []
+
+    def chat(self):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("down")
+        return self.url
+
+
+def _pool(**kwargs) -> tuple[OllamaPool, dict[str, FakeClient]]:
+    clients: dict[str, FakeClient] = {}
+
+    def create(url: str):
+        clients[url] = FakeClient(url)
+        return clients[url]
+
+    return OllamaPool(["a", "b"], client_factory=create, **kwargs), clients
+
+
+def test_requests_go_to_the_host_with_fewest_outstanding():
+    pool, _ = _pool()
+
+    assert sorted(pool.call(lambda c: c.chat()) for _ in range(4)) == ["a", "a", "b", "b"]
+
+    # While a request is outstanding on one host, the next goes to the other.
+    outer, inner = pool.call(lambda c: (c.chat(), pool.call(lambda d: d.chat())))
+    assert outer != inner
+
+
+def test_failing_host_is_retried_elsewhere_ejected_and_restored():
+    pool, clients = _pool(max_failures=2, ejection_seconds=0)
+    clients["a"].down = True
+
+    assert all(pool.call(lambda c: c.chat()) == "b" for _ in range(6))
+    assert clients["a"].calls == 2
+
+    clients["a"].down = False
+    assert pool.check_health() == 2
+    assert sorted(pool.call(lambda c: c.chat()) for _ in range(2)) == ["a", "b"]
+
+
+def test_errors_of_the_request_are_not_retried():
+    pool, clients = _pool()
+
+    def bad_request(client):
+        client.chat()
+        raise ollama.ResponseError("model not found", 404)
+
+    with pytest.raises(ollama.ResponseError):
+        pool.call(bad_request)
+    assert clients["a"].calls + clients["b"].calls == 1
+
+
+def test_error_is_raised_when_every_host_fails():
+    pool, clients = _pool()
+    clients["a"].down = True
+    clients["b"].down = True
+
+    with pytest.raises(ConnectionError):
+        pool.call(lambda c: c.chat())
+    assert clients["a"].calls == clients["b"].calls == 1
@@ -0,0 +1,104 @@
+from datetime import datetime
+
+import ollama
+import pytest
+from flask import Flask
+
+from wlu_chatbot.api.language_model import get_language_model_client
+from wlu_chatbot.api.language_model.response import ContentDict
+from wlu_chatbot.api.ollama_warm_up import is_warm_time, start_heartbeat, warm_up_models
+from wlu_chatbot.config import LLMMode
+from wlu_chatbot.web_helpers.conversation import MAX_RESPONSE_TOKENS, SYSTEM_PROMPT
+
+
+def test_warm_hours():
+    assert is_warm_time("08:00-22:00", datetime(2025, 6, 2, 8, 0))
+    assert not is_warm_time("08:00-22:00", datetime(2025, 6, 2, 22, 0))
+    assert is_warm_time("20:00-02:00", datetime(2025, 6, 2, 1, 30))
+    assert not is_warm_time("20:00-02:00", datetime(2025, 6, 2, 12, 0))
+    assert is_warm_time("always", datetime(2025, 6, 2, 3, 0))
+    assert not is_warm_time("never", datetime(2025, 6, 2, 12, 0))
+    with pytest.raises(ValueError):
+        is_warm_time("mornings", datetime(2025, 6, 2, 12, 0))
+
+
+def test_warm_up_loads_chat_and_embedding_models_on_every_host(app: Flask, monkeypatch: pytest.MonkeyPatch):
+    loaded: list[tuple[str, str, str]] = []
+
+    class FakeClient:
+        def __init__(self, host: str, timeout: float):
+            self.host = host
+
+        def generate(self, model: str, keep_alive: str, options: dict[str, int]):
+            if self.host == "http://down:11434":
+                raise ConnectionError("down")
+            loaded.append((self.host, model, keep_alive))
+
+        def embed(self, model: str, input: str, keep_alive: str):
+            loaded.append((self.host, model, keep_alive))
+
+    monkeypatch.setattr(ollama, "Client", FakeClient)
+
+    with app.app_context():
+        assert warm_up_models() == 0
+        assert start_heartbeat(app) is None
+
+        app.config["LLM_MODE"] = LLMMode.OLLAMA
+        app.config["OLLAMA_URL"] = ["http://a:11434", "http://down:11434"]
+        app.config["OLLAMA_MODELS"] = ["large", "small"]
+        app.config["OLLAMA_EMBEDDING_URL"] = ["http://e:11434"]
+        app.config["OLLAMA_KEEP_ALIVE"] = "1h"
+        assert warm_up_models() == 3
+
+    assert loaded == [
+        ("http://a:11434", "large", "1h"),
+        ("http://a:11434", "small", "1h"),
+        ("http://e:11434", "nomic-embed-text", "1h"),
+    ]
+
+
+def test_heartbeat_loads_models_with_the_context_of_answers(app: Flask, monkeypatch: pytest.MonkeyPatch):
+    loads: list[int] = []
+    answers: list[int] = []
+
+    class FakeClient:
+        def __init__(self, host: str, timeout: float | None = None):
+            pass
+
+        def generate(self, model: str, keep_alive: str, options: dict[str, int]):
+            loads.append(options["num_ctx"])
+
+        def chat(self, model: str, messages: list[ollama.Message], options: dict[str, int], stream: bool, keep_alive: str):
+            answers.append(options["num_ctx"])
+            return ollama.ChatResponse(model=model, message=ollama.Message(role="assistant", content="An answer."))
+
+        def list(self):
+            return []
+
+    monkeypatch.setattr(ollama, "Client", FakeClient)
+    app.config["LLM_MODE"] = LLMMode.OLLAMA
+    app.config["OLLAMA_URL"] = ["http://a:11434"]
+    app.config["OLLAMA_MODELS"] = ["large"]
+    app.config["OLLAMA_EMBEDDING_URL"] = []
+
+    def answer(question: str):
+        get_language_model_client().get_response(
+            [
+                ContentDict(role="system", parts=[{"text": SYSTEM_PROMPT.format(subject="statistics")}]),
+                ContentDict(role="user", parts=[{"text": question}]),
+            ],
+            max_tokens=MAX_RESPONSE_TOKENS,
+        )
+
+    warm_up_models()
+    answer("What is a mean?")
+    warm_up_models()
+    # A long question grows the context, which the heartbeat then keeps loaded.
+    answer("What is a mean? " * 1000)
+    warm_up_models()
+    # Smaller requests keep the larger context, rather than reloading the model.
+    get_language_model_client().get_response([ContentDict(role="user", parts=[{"text": "A title?"}])], max_tokens=30)
+    warm_up_models()
+
+    assert loads == [answers[0], answers[0], answers[1], answers[1]]
+    assert answers[0] < answers[1] == answers[2]
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from wlu_chatbot.api.language_model.admission import OverloadedError
+from wlu_chatbot.api.language_model.response import ContentDict, LanguageModelClient, ModelResponse
+from wlu_chatbot.api.language_model.routing import RoutingClient
+
+CONTENTS: list[ContentDict] = [{"role": "user", "parts": [{"text": "hello"}]}]
+
+
+class FakeBackend(LanguageModelClient):
+    def __init__(self, name: str, context_window: int = 8192):
+        self.name = name
+        self.context_window = context_window
+        self.down = False
+        self.calls = 0
+
+    def get_response(self, contents: list[ContentDict], max_tokens: int = 3000, rung: int = 0) -> ModelResponse:
+        self.calls += 1
+        if self.down:
+            raise RuntimeError("rate limited")
+        return ModelResponse(content={"role": "model", "parts": [{"text": self.name}]})
+
+
+def test_requests_fail_over_and_circuit_opens():
+    primary, fallback = FakeBackend("primary"), FakeBackend("fallback", context_window=4096)
+    router = RoutingClient([("primary", primary), ("fallback", fallback)], failure_threshold=2, open_seconds=60)
+    assert router.context_window == 4096
+
+    assert router.get_response(CONTENTS).get_text() == "primary"
+
+    primary.down = True
+    for _ in range(4):
+        assert router.get_response(CONTENTS).get_text() == "fallback"
+    # The primary is skipped once its circuit has opened.
+    assert primary.calls == 3
+    assert [m.state for m in router.metrics()] == ["open", "closed"]
+
+    fallback.down = True
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            router.get_response(CONTENTS)
+    with pytest.raises(OverloadedError):
+        router.get_response(CONTENTS)
+
+
+def test_half_open_backend_is_restored_by_a_trial_request():
+    primary, fallback = FakeBackend("primary"), FakeBackend("fallback")
+    router = RoutingClient([("primary", primary), ("fallback", fallback)], failure_threshold=1, open_seconds=0)
+
+    primary.down = True
+    assert router.get_response(CONTENTS).get_text() == "fallback"
+    assert router.metrics()[0].state == "half_open"
+
+    primary.down = False
+    assert router.get_response(CONTENTS).get_text() == "primary"
+    assert router.metrics()[0].state == "closed"
+
+
+def test_latency_routing_favours_the_faster_backend():
+    slow, fast = FakeBackend("slow"), FakeBackend("fast")
+    router = RoutingClient([("slow", slow), ("fast", fast)], latency_routing=True, rng=random.Random(0))
+    router.backends[0].outcomes.extend([(2.0, True)] * 10)
+    router.backends[1].outcomes.extend([(0.2, True)] * 10)
+
+    answers = [router.get_response(CONTENTS).get_text() for _ in range(200)]
+
+    assert 150 < answers.count("fast") < 200
+    assert answers.count("slow") > 0
@@ -0,0 +1,52 @@
+import numpy as np
+
+from wlu_chatbot.api.topic_clustering import default_num_topics, find_topics, mini_batch_k_means
+
+
+def test_k_means_separates_clusters():
+    rng = np.random.default_rng(1)
+    centers = np.eye(3, dtype=np.float32)
+    vectors = np.repeat(centers, 50, axis=0) + rng.normal(0, 0.05, (150, 3)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    centroids, labels = mini_batch_k_means(vectors, 3, batch_size=32)
+
+    assert centroids.shape == (3, 3)
+    for group in range(3):
+        assert len(set(labels[group * 50 : (group + 1) * 50])) == 1
+    assert len(set(labels)) == 3
+
+
+def test_k_means_with_more_clusters_than_vectors():
+    vectors = np.eye(2, dtype=np.float32)
+
+    centroids, labels = mini_batch_k_means(vectors, 5)
+
+    assert len(centroids) == 2
+    assert sorted(labels) == [0, 1]
+
+
+def test_find_topics_counts_messages():
+    embeddings = [[1.0, 0.0], [0.9, 0.1], [0.95, 0.05], [0.0, 1.0], [0.1, 1.0]]
+    later = [False, True, True, False, False]
+    redirected = [False, False, True, True, True]
+
+    topics = find_topics(embeddings, later, redirected, num_topics=2)
+
+    assert [t.count for t in topics] == [3, 2]
+    assert (topics[0].earlier_count, topics[0].later_count) == (1, 2)
+    assert topics[0].redirected_count == 1
+    assert topics[0].representative == 2
+    assert (topics[1].earlier_count, topics[1].later_count) == (2, 0)
+    assert topics[1].redirected_count == 2
+    assert topics[1].representative in (3, 4)
+
+
+def test_find_topics_without_messages():
+    assert find_topics([], [], []) == []
+
+
+def test_number_of_topics_is_bounded():
+    assert default_num_topics(1) == 1
+    assert default_num_topics(50) == 5
+    assert default_num_topics(100_000) == 12
@@ -49,6 +49,7 @@ def app():
         yield app
         base.metadata.drop_all(get_engine())
         get_storage_service().recursive_delete(PurePath(""))
+        get_engine().dispose()
 
 @pytest.fixture
 def client(app: Flask):
@@ -1,11 +1,13 @@
 import shlex
-from sqlalchemy import select, inspect
+import pytest
+from sqlalchemy import select, inspect, text
+from pgvector.sqlalchemy import HALFVEC
 from sqlalchemy.orm import Session
 from sqlalchemy.engine import Connection
 
 from flask import Flask
 
-from wlu_chatbot.db.models import base, get_engine, User, Course, ParticipatesIn
+from wlu_chatbot.db.models import base, get_engine, COMPACT_EMBEDDING_DIMENSIONS, User, Course, ParticipatesIn, Document, Segment, Embedding, Conversation, Message, MessageType, MessageEmbedding, DailyCourseUsage, DailyStudentActivity
 from wlu_chatbot.db.cli import main, initialize, mock
 
 
@@ -81,4 +83,145 @@ def test_create_participates_in(app: Flask):
     part_ins = sess.query(ParticipatesIn).where().all()
     assert len(part_ins) == 1
     assert part_ins[0].course_id == course_id
-    assert part_ins[0].email == "test009@westliberty.edu"
\ No newline at end of file
+    assert part_ins[0].email == "test009@westliberty.edu"
+def test_update_course_answer_cache(app: Flask):
+  with Session(get_engine()) as sess:
+    course = Course(name="Statistics")
+    sess.add(course)
+    sess.commit()
+    course_id = course.id
+
+  main(shlex.split(f"update course {course_id} --answer-cache enabled"))
+  with Session(get_engine()) as sess:
+    assert sess.get(Course, course_id).answer_cache_enabled
+
+  main(shlex.split(f"update course {course_id} --answer-cache disabled"))
+  with Session(get_engine()) as sess:
+    assert not sess.get(Course, course_id).answer_cache_enabled
+
+
+def add_embedded_document(course_name: str, vectors: list[list[float]]) -> int:
+  with Session(get_engine()) as sess:
+    course = Course(name=course_name)
+    sess.add(course)
+    sess.flush()
+    document = Document(name="notes", file_hash="hash", file_extension="txt", course_id=course.id)
+    sess.add(document)
+    sess.flush()
+    for vector in vectors:
+      segment = Segment(text="text", document_id=document.id)
+      sess.add(segment)
+      sess.flush()
+      sess.add(Embedding(vector=vector, segment_id=segment.id))
+    sess.commit()
+    return course.id
+
+
+def test_compact_embeddings(app: Flask):
+  add_embedded_document("Statistics", [[3.0, 4.0, 12.0], [0.0, 2.0, 1.0]])
+  # The schema of a database created before embeddings were stored at half precision.
+  with get_engine().begin() as conn:
+    conn.execute(text("DROP INDEX ix_embeddings_compact_vector"))
+    conn.execute(text("ALTER TABLE embeddings ALTER COLUMN vector TYPE vector USING vector::vector"))
+    conn.execute(text("ALTER TABLE embeddings ADD COLUMN compact_vector vector"))
+
+  main(shlex.split("compact-embeddings"))
+  inspector = inspect(get_engine())
+  columns = {c["name"]: c["type"] for c in inspector.get_columns("embeddings")}
+  assert "compact_vector" not in columns
+  assert isinstance(columns["vector"], HALFVEC)
+  assert "ix_embeddings_compact_vector" in [i["name"] for i in inspector.get_indexes("embeddings")]
+  with Session(get_engine()) as sess:
+    vectors = [list(e.vector) for e in sess.query(Embedding).order_by(Embedding.id)]
+    assert vectors == [[3.0, 4.0, 12.0], [0.0, 2.0, 1.0]]
+
+  # Converting a database again changes nothing.
+  main(shlex.split("compact-embeddings"))
+
+
+def test_measure_recall(capsys, app: Flask):
+  dimensions = COMPACT_EMBEDDING_DIMENSIONS + 1
+  add_embedded_document("Statistics", [[1.0 if i == j else 0.0 for i in range(dimensions)] for j in range(3)])
+
+  main(shlex.split("measure-recall --queries 3 --num-segments 1"))
+  output = capsys.readouterr().out
+  assert "Recall@1 of the compact search over 3 queries: 1.000" in output
+  assert "bytes at half precision (50% smaller)" in output
+
+
+def test_normalize_embeddings(capsys, app: Flask):
+  add_embedded_document("Statistics", [[3.0, 4.0], [0.6, 0.8]])
+  with Session(get_engine()) as sess:
+    course = sess.query(Course).one()
+    user = User(email="student@westliberty.edu")
+    user.set_password("password")
+    sess.add(user)
+    conv = Conversation(course_id=course.id, initiated_by="student@westliberty.edu")
+    sess.add(conv)
+    sess.flush()
+    message = Message(conversation_id=conv.id, body="What?", written_by="student@westliberty.edu", type=MessageType.STUDENT_MESSAGE)
+    sess.add(message)
+    sess.flush()
+    sess.add(MessageEmbedding(message_id=message.id, vector=[0.0, 2.0]))
+    sess.commit()
+
+  main(shlex.split("normalize-embeddings"))
+  assert "Rescaled 1 segment embeddings and 1 message embeddings to unit length." in capsys.readouterr().out
+  with Session(get_engine()) as sess:
+    vectors = [list(e.vector) for e in sess.query(Embedding).order_by(Embedding.id)]
+    assert vectors == [pytest.approx([0.6, 0.8], abs=1e-3)] * 2
+    assert list(sess.query(MessageEmbedding).one().vector) == [0.0, 1.0]
+
+
+def test_embed_messages(capsys, app: Flask):
+  with Session(get_engine()) as sess:
+    course = Course(name="Statistics")
+    user = User(email="student@westliberty.edu")
+    user.set_password("password")
+    sess.add_all([course, user])
+    sess.flush()
+    conv = Conversation(course_id=course.id, initiated_by="student@westliberty.edu")
+    sess.add(conv)
+    sess.flush()
+    for body, type_ in [("What is a mean?", MessageType.STUDENT_MESSAGE), ("The average.", MessageType.BOT_MESSAGE), ("And a median?", MessageType.STUDENT_MESSAGE), ("The middle.", MessageType.BOT_MESSAGE), ("And a mode?", MessageType.STUDENT_MESSAGE)]:
+      sess.add(Message(conversation_id=conv.id, body=body, type=type_, written_by="student@westliberty.edu"))
+    sess.flush()
+    first_id = sess.query(Message).order_by(Message.id).first().id
+    sess.add(MessageEmbedding(message_id=first_id, vector=[1.0] * 100))
+    sess.commit()
+
+  main(shlex.split("embed-messages --batch-size 1"))
+  assert "Embedded 2 student messages." in capsys.readouterr().out
+
+  with Session(get_engine()) as sess:
+    assert sess.query(MessageEmbedding).count() == 3
+    assert list(sess.get(MessageEmbedding, first_id).vector) == [1.0] * 100
+
+  main(shlex.split("embed-messages"))
+  assert "Embedded 0 student messages." in capsys.readouterr().out
+
+
+def test_rebuild_analytics(capsys, app: Flask):
+  with Session(get_engine()) as sess:
+    course = Course(name="Statistics")
+    user = User(email="student@westliberty.edu")
+    user.set_password("password")
+    sess.add_all([course, user])
+    sess.flush()
+    course_id = course.id
+    conv = Conversation(course_id=course_id, initiated_by="student@westliberty.edu")
+    sess.add(conv)
+    sess.flush()
+    for body, type_ in [("What is a mean?", MessageType.STUDENT_MESSAGE), ("The average.", MessageType.BOT_MESSAGE), ("And a median?", MessageType.STUDENT_MESSAGE)]:
+      sess.add(Message(conversation_id=conv.id, body=body, type=type_, written_by="student@westliberty.edu"))
+    sess.commit()
+
+  main(shlex.split(f"rebuild-analytics --course-id {course_id}"))
+  assert "Daily usage recounted." in capsys.readouterr().out
+
+  with Session(get_engine()) as sess:
+    usage = sess.query(DailyCourseUsage).one()
+    assert (usage.student_messages, usage.bot_messages, usage.conversations, usage.redirects) == (2, 1, 1, 0)
+    activity = sess.query(DailyStudentActivity).one()
+    assert activity.email == "student@westliberty.edu"
+    assert activity.student_messages == 2
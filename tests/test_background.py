@@ -0,0 +1,45 @@
+import threading
+
+from flask import Flask
+
+from wlu_chatbot.api.language_model import get_admission_controller, Priority
+from wlu_chatbot.background import BACKGROUND_THREADS, INTERACTIVE_THREADS, run_in_background, run_interactively
+from . import wait_until
+
+
+def test_interactive_work_does_not_wait_behind_background_work(app: Flask):
+    app.testing = False
+    release = threading.Event()
+    try:
+        blocked = [run_in_background(release.wait) for _ in range(BACKGROUND_THREADS + 1)]
+
+        answered = run_interactively(lambda: None)
+
+        answered.result(timeout=5)
+        assert not any(future.done() for future in blocked)
+    finally:
+        release.set()
+    for future in blocked:
+        future.result(timeout=5)
+
+
+def test_every_answer_that_the_model_may_queue_reaches_the_queue(app: Flask):
+    app.testing = False
+    app.config["LLM_MAX_CONCURRENCY"] = 1
+    app.config["LLM_MAX_QUEUE"] = INTERACTIVE_THREADS
+    controller = get_admission_controller()
+    release = threading.Event()
+
+    def answer():
+        with controller.admit(Priority.INTERACTIVE):
+            release.wait()
+
+    try:
+        answers = [run_interactively(answer) for _ in range(1 + INTERACTIVE_THREADS)]
+
+        wait_until(lambda: controller.metrics().queued["INTERACTIVE"] == INTERACTIVE_THREADS)
+        assert controller.is_full(Priority.INTERACTIVE)
+    finally:
+        release.set()
+    for future in answers:
+        future.result(timeout=5)
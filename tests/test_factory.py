@@ -1,5 +1,22 @@
+import subprocess
+import sys
+
 from wlu_chatbot import create_app
 
 def test_config():
     assert not create_app().testing
-    assert create_app({'TESTING': True}).testing
\ No newline at end of file
+    assert create_app({'TESTING': True}).testing
+
+def test_debug_is_off_by_default():
+    assert not create_app().debug
+
+
+def test_optional_backends_are_not_imported_at_startup():
+    code = (
+        "import sys\n"
+        "from wlu_chatbot import create_app\n"
+        "create_app()\n"
+        "print(sorted(m for m in ('google.generativeai', 'ollama', 'pydub', 'speech_recognition', 'pypdf') if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
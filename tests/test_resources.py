@@ -0,0 +1,24 @@
+import os
+
+import pytest
+from flask import Flask
+
+from wlu_chatbot import resources
+from wlu_chatbot.db.models import get_engine
+from wlu_chatbot.resources import get_resource
+
+
+def test_resource_is_shared_within_a_process(app: Flask):
+    assert get_resource("thing", object) is get_resource("thing", object)
+    assert get_engine() is get_engine()
+
+
+def test_resource_is_created_again_after_a_fork(app: Flask, monkeypatch: pytest.MonkeyPatch):
+    parent_thing = get_resource("thing", object)
+
+    child_pid = os.getpid() + 1
+    monkeypatch.setattr(resources.os, "getpid", lambda: child_pid)
+    child_thing = get_resource("thing", object)
+
+    assert child_thing is not parent_thing
+    assert get_resource("thing", object) is child_thing
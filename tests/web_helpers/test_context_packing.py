@@ -0,0 +1,52 @@
+from wlu_chatbot.api.language_model.response import TestingClient, ContentDict
+from wlu_chatbot.api.context_retrieval.retriever import RetrievedSegment
+from wlu_chatbot.web_helpers.context_packing import pack_context
+
+
+def segment(id: int, words: int) -> RetrievedSegment:
+    return RetrievedSegment(id=id, text=" ".join(["word"] * words), document_name="notes", document_id=1)
+
+
+def message(role: str, words: int) -> ContentDict:
+    return ContentDict(role=role, parts=[{"text": " ".join(["word"] * words)}])
+
+
+def test_everything_fits_within_a_large_budget():
+    segments = [segment(1, 10), segment(2, 10)]
+    history = [message("user", 10), message("model", 10)]
+
+    packed = pack_context(TestingClient(), 10_000, segments, history)
+
+    assert packed.segments == segments
+    assert packed.history == history
+    assert packed.dropped_segment_ids == []
+    assert packed.dropped_history == 0
+
+
+def test_lowest_ranked_segments_are_dropped_first():
+    segments = [segment(1, 200), segment(2, 200), segment(3, 200)]
+
+    packed = pack_context(TestingClient(), 540, segments, [])
+
+    assert [s.id for s in packed.segments] == [1, 2]
+    assert packed.dropped_segment_ids == [3]
+    assert packed.tokens <= 540
+
+
+def test_segment_that_partially_fits_is_truncated():
+    segments = [segment(1, 200), segment(2, 200)]
+
+    packed = pack_context(TestingClient(), 400, segments, [])
+
+    assert [s.id for s in packed.segments] == [1, 2]
+    assert packed.truncated_segment_ids == [2]
+    assert len(packed.segments[1].text) < len(segments[1].text)
+
+
+def test_oldest_history_is_dropped_and_history_stays_contiguous():
+    history = [message("user", 400), message("model", 10), message("user", 10), message("model", 10)]
+
+    packed = pack_context(TestingClient(), 100, [], history)
+
+    assert packed.history == history[1:]
+    assert packed.dropped_history == 1
@@ -1,3 +1,8 @@
+import io
+import sys
+import threading
+
+import pytest
 from flask import Flask
 from flask.testing import FlaskClient
 from sqlalchemy.orm import Session
@@ -5,16 +10,32 @@ from wlu_chatbot.db.models import (
     get_engine,
     Conversation,
     Message,
+    Course,
+    CachedAnswer,
+    PreparedRetrieval,
+    Reference,
+    MessageEmbedding,
     )
+from wlu_chatbot.api.context_retrieval.retriever import Retriever, get_pending_preparations
+from wlu_chatbot.api import message_embeddings
+from wlu_chatbot.api.language_model import get_admission_controller, get_language_model_client, OverloadedError, Priority
+from wlu_chatbot.api.language_model.response import ContentDict, ModelResponse, TestingClient, split_system_instruction
+from wlu_chatbot.config import LLMMode
+from wlu_chatbot.web_interface import conversation_routes
+from wlu_chatbot.web_helpers import ai_responses, conversation
 from ..conftest import MockCourse
-from .. import authenticate_as
+from .. import authenticate_as, wait_until
 
-def test_generate_ai_response(mock_course: MockCourse, app: Flask, client: FlaskClient):
+def _start_conversation(mock_course: MockCourse, title: str | None = None) -> int:
     with Session(get_engine()) as sess:
-        conv = Conversation(course_id = mock_course.course_id, initiated_by=mock_course.student_email)
+        conv = Conversation(course_id=mock_course.course_id, initiated_by=mock_course.student_email, title=title)
         sess.add(conv)
         sess.commit()
-        conv_id = conv.id
+        return conv.id
+
+
+def test_generate_ai_response(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    conv_id = _start_conversation(mock_course)
 
     authenticate_as(client, mock_course.student_email)
 
@@ -33,11 +54,7 @@ def test_generate_ai_response(mock_course: MockCourse, app: Flask, client: Flask
 
 
 def test_generate_multiple_ai_response(mock_course: MockCourse, app: Flask, client: FlaskClient):
-    with Session(get_engine()) as sess:
-        conv = Conversation(course_id = mock_course.course_id, initiated_by=mock_course.student_email)
-        sess.add(conv)
-        sess.commit()
-        conv_id = conv.id
+    conv_id = _start_conversation(mock_course)
 
     authenticate_as(client, mock_course.student_email)
 
@@ -65,11 +82,7 @@ def test_generate_multiple_ai_response(mock_course: MockCourse, app: Flask, clie
 
 
 def test_cannot_generate_successive_ai_responses(mock_course: MockCourse, app: Flask, client: FlaskClient):
-    with Session(get_engine()) as sess:
-        conv = Conversation(course_id = mock_course.course_id, initiated_by=mock_course.student_email)
-        sess.add(conv)
-        sess.commit()
-        conv_id = conv.id
+    conv_id = _start_conversation(mock_course)
 
     authenticate_as(client, mock_course.student_email)
 
@@ -86,4 +99,425 @@ def test_cannot_generate_successive_ai_responses(mock_course: MockCourse, app: F
     assert response.status_code >= 400
 
     with Session(get_engine()) as sess:
-        assert sess.query(Message).count() == 2
\ No newline at end of file
+        assert sess.query(Message).count() == 2
+
+def test_retrieval_is_prepared_when_message_is_posted(mock_course: MockCourse, app: Flask, client: FlaskClient, monkeypatch: pytest.MonkeyPatch):
+    authenticate_as(client, mock_course.instructor_email)
+    data = {"file": (io.BytesIO(b"The mean is the average."), "mean.txt"), "course_id": mock_course.course_id, "name": "mean"}
+    response = client.post("/documents", data=data, content_type="multipart/form-data", headers={"Referer": f"/courses/{mock_course.course_id}/instructor-portal"})
+    assert response.status_code < 400
+
+    conv_id = _start_conversation(mock_course)
+
+    authenticate_as(client, mock_course.student_email)
+
+    response = client.post("/messages", json={"conversation_id": conv_id, "body": "What is a mean?"})
+    assert response.status_code < 400
+
+    with Session(get_engine()) as sess:
+        prepared = sess.query(PreparedRetrieval).one()
+        assert len(prepared.segment_ids) > 0
+        assert len(prepared.segment_ids) == len(prepared.distances)
+
+        assert sess.query(MessageEmbedding).count() == 1
+    # Finished preparations are no longer waited for.
+    assert get_pending_preparations() == {}
+
+    def fail(_: str):
+        raise AssertionError("The message was embedded again.")
+
+    monkeypatch.setattr(sys.modules[Retriever.__module__], "embed_text", fail)
+    monkeypatch.setattr(message_embeddings, "embed_text", fail)
+
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.status_code < 400
+
+    with Session(get_engine()) as sess:
+        assert sess.query(Reference).count() > 0
+
+
+def _ask_first_question(client: FlaskClient, mock_course: MockCourse, body: str) -> str:
+    conv_id = _start_conversation(mock_course)
+    response = client.post("/messages", json={"conversation_id": conv_id, "body": body})
+    assert response.status_code < 400
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.status_code < 400
+    assert response.json
+    return response.json["text"]
+
+
+def test_answer_cache_is_opt_in(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    authenticate_as(client, mock_course.student_email)
+
+    first = _ask_first_question(client, mock_course, "What is a mean?")
+    second = _ask_first_question(client, mock_course, "What is the mean?")
+    assert first != second
+
+    with Session(get_engine()) as sess:
+        assert sess.query(CachedAnswer).count() == 0
+
+
+def test_answer_cache_reuses_answer_until_documents_change(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    with Session(get_engine()) as sess:
+        course = sess.get(Course, mock_course.course_id)
+        course.answer_cache_enabled = True
+        sess.commit()
+
+    authenticate_as(client, mock_course.student_email)
+
+    first = _ask_first_question(client, mock_course, "What is a mean?")
+    second = _ask_first_question(client, mock_course, "What is the mean?")
+    assert first == second
+
+    authenticate_as(client, mock_course.instructor_email)
+    data = {"file": (io.BytesIO(b"The mean is the average."), "mean.txt"), "course_id": mock_course.course_id, "name": "mean"}
+    response = client.post("/documents", data=data, content_type="multipart/form-data", headers={"Referer": f"/courses/{mock_course.course_id}/instructor-portal"})
+    assert response.status_code < 400
+
+    with Session(get_engine()) as sess:
+        assert sess.query(CachedAnswer).count() == 0
+
+    authenticate_as(client, mock_course.student_email)
+    third = _ask_first_question(client, mock_course, "What is the mean?")
+    assert third != first
+
+
+def test_title_is_generated_with_first_response(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    conv_id = _start_conversation(mock_course, title="Conversation")
+
+    authenticate_as(client, mock_course.student_email)
+
+    response = client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+    assert response.status_code < 400
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.status_code < 400
+    assert response.json
+    assert response.json["title"] != "Conversation"
+    assert not response.json["title_pending"]
+
+    with Session(get_engine()) as sess:
+        assert sess.get(Conversation, conv_id).title == response.json["title"]
+
+
+def test_response_does_not_wait_for_failed_title(mock_course: MockCourse, app: Flask, client: FlaskClient, monkeypatch: pytest.MonkeyPatch):
+    def fail(*args, **kwargs):
+        raise ConnectionError("The language model is unavailable.")
+
+    monkeypatch.setattr(conversation_routes, "generate_title", fail)
+
+    conv_id = _start_conversation(mock_course, title="Conversation")
+
+    authenticate_as(client, mock_course.student_email)
+
+    response = client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+    assert response.status_code < 400
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.status_code < 400
+    assert response.json
+    assert len(response.json["text"]) > 0
+    assert response.json["title"] == "Conversation"
+    assert response.json["title_pending"]
+
+
+def test_ai_response_job_can_be_followed(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    conv_id = _start_conversation(mock_course)
+
+    authenticate_as(client, mock_course.student_email)
+
+    response = client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+    assert response.status_code < 400
+
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.status_code == 200
+    assert response.json
+    assert response.json["status"] == "READY"
+    posted = response.json
+
+    response = client.get(posted["status_url"])
+    assert response.status_code == 200
+    assert response.json
+    assert response.json["job_id"] == posted["job_id"]
+    assert response.json["text"] == posted["text"]
+    assert response.json["message_id"] == posted["message_id"]
+
+    authenticate_as(client, mock_course.instructor_email)
+    response = client.get(posted["status_url"])
+    assert response.status_code == 403
+
+    response = client.get("/ai-response-jobs/1000")
+    assert response.status_code >= 400
+
+
+def test_failed_ai_response_job_is_reported(mock_course: MockCourse, app: Flask, client: FlaskClient, monkeypatch: pytest.MonkeyPatch):
+    def fail(*args, **kwargs):
+        raise ConnectionError("The language model is unavailable.")
+
+    conv_id = _start_conversation(mock_course)
+
+    authenticate_as(client, mock_course.student_email)
+
+    response = client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+    assert response.status_code < 400
+
+    monkeypatch.setattr(ai_responses, "generate_response", fail)
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.json
+    assert response.json["status"] == "FAILED"
+    assert response.json["text"] is None
+    failed_job_id = response.json["job_id"]
+
+    monkeypatch.undo()
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.status_code == 200
+    assert response.json
+    assert response.json["status"] == "READY"
+    assert response.json["job_id"] == failed_job_id
+
+    with Session(get_engine()) as sess:
+        assert sess.query(Message).count() == 2
+
+
+def test_ai_response_is_refused_when_the_model_is_overloaded(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    app.config["LLM_MAX_CONCURRENCY"] = 0
+    app.config["LLM_MAX_QUEUE"] = 0
+    conv_id = _start_conversation(mock_course)
+
+    authenticate_as(client, mock_course.student_email)
+
+    response = client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+    assert response.status_code < 400
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+    response = client.get("/metrics/llm")
+    assert response.status_code == 403
+
+    authenticate_as(client, mock_course.instructor_email)
+    response = client.get("/metrics/llm")
+    assert response.status_code == 200
+    assert response.json
+    assert response.json["max_concurrent"] == 0
+    assert response.json["workers"] == 1
+    assert response.json["queued"]["INTERACTIVE"] == 0
+
+
+def _hold_the_model(app: Flask, release: threading.Event) -> threading.Thread:
+    """Runs a request to the language model that lasts until it is released."""
+    def hold():
+        with app.app_context():
+            with get_admission_controller().admit(Priority.INTERACTIVE):
+                release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    wait_until(lambda: get_admission_controller().metrics().in_flight == 1)
+    return thread
+
+
+def _queue_request(app: Flask, priority: Priority, errors: list[OverloadedError]) -> threading.Thread:
+    """Sends a request to the language model that waits in the queue."""
+    def send():
+        with app.app_context():
+            try:
+                get_language_model_client(priority).get_response([ContentDict(role="user", parts=[{"text": "hello"}])])
+            except OverloadedError as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    wait_until(lambda: get_admission_controller().metrics().queued[priority.name] == 1)
+    return thread
+
+
+def _limit_the_model(app: Flask):
+    app.config["LLM_MAX_CONCURRENCY"] = 1
+    app.config["LLM_MAX_QUEUE"] = 1
+    app.extensions.pop("llm_admission", None)
+
+
+def test_ai_response_sheds_a_queued_report_when_the_queue_is_full(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    conv_id = _start_conversation(mock_course, title="Conversation")
+    authenticate_as(client, mock_course.student_email)
+    client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+    client.post(f"/conversations/{conv_id}/ai-responses")
+    client.post("/messages", json={"conversation_id": conv_id, "body": "and again?"})
+
+    _limit_the_model(app)
+    release = threading.Event()
+    errors: list[OverloadedError] = []
+    threads = [_hold_the_model(app, release), _queue_request(app, Priority.REPORT, errors)]
+    controller = get_admission_controller()
+
+    def release_once_the_answer_waits():
+        wait_until(lambda: controller.metrics().queued["INTERACTIVE"] == 1)
+        release.set()
+
+    threads.append(threading.Thread(target=release_once_the_answer_waits))
+    threads[-1].start()
+    try:
+        response = client.post(f"/conversations/{conv_id}/ai-responses")
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+
+    assert response.status_code == 200
+    assert response.json
+    assert response.json["status"] == "READY"
+    assert len(errors) == 1
+    assert controller.metrics().shed == 1
+
+
+def test_ai_response_is_refused_when_the_queue_is_full_of_answers(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    conv_id = _start_conversation(mock_course, title="Conversation")
+    authenticate_as(client, mock_course.student_email)
+    client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+
+    _limit_the_model(app)
+    release = threading.Event()
+    errors: list[OverloadedError] = []
+    threads = [_hold_the_model(app, release), _queue_request(app, Priority.INTERACTIVE, errors)]
+    try:
+        response = client.post(f"/conversations/{conv_id}/ai-responses")
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert errors == []
+
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.status_code == 200
+
+
+def test_title_is_generated_once_for_an_accepted_response(mock_course: MockCourse, app: Flask, client: FlaskClient, monkeypatch: pytest.MonkeyPatch):
+    titled: list[int] = []
+    monkeypatch.setattr(conversation_routes, "title_conversation", lambda conversation_id, message: titled.append(conversation_id))
+    conv_id = _start_conversation(mock_course, title="Conversation")
+    authenticate_as(client, mock_course.student_email)
+    client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+
+    _limit_the_model(app)
+    release = threading.Event()
+    threads = [_hold_the_model(app, release), _queue_request(app, Priority.INTERACTIVE, [])]
+    try:
+        response = client.post(f"/conversations/{conv_id}/ai-responses")
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+    assert response.status_code == 503
+    assert titled == []
+
+    # A failed response is retried with the same job, which does not title the conversation again.
+    generate_response = ai_responses.generate_response
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("The language model is unavailable.")
+
+    monkeypatch.setattr(ai_responses, "generate_response", fail)
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.json
+    assert response.json["status"] == "FAILED"
+    monkeypatch.setattr(ai_responses, "generate_response", generate_response)
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.json
+    assert response.json["status"] == "READY"
+    assert titled == [conv_id]
+
+
+def test_ai_response_is_routed_among_fallback_backends(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    app.config["LLM_FALLBACK_MODES"] = [LLMMode.TESTING]
+    conv_id = _start_conversation(mock_course)
+
+    authenticate_as(client, mock_course.student_email)
+    client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.status_code == 200
+
+    authenticate_as(client, mock_course.instructor_email)
+    response = client.get("/metrics/llm/backends")
+    assert response.status_code == 200
+    assert response.json
+    assert [backend["state"] for backend in response.json] == ["closed", "closed"]
+    assert sum(backend["requests"] for backend in response.json) >= 1
+
+
+def test_ai_response_records_the_model_and_downgrades_under_load(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    conv_id = _start_conversation(mock_course)
+
+    authenticate_as(client, mock_course.student_email)
+    client.post("/messages", json={"conversation_id": conv_id, "body": "hello"})
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.json
+    with Session(get_engine()) as sess:
+        assert sess.get(Message, response.json["message_id"]).model == "testing"
+
+    # A queue depth of zero counts as deep, so every request is downgraded.
+    app.config["LLM_DOWNGRADE_QUEUE_DEPTH"] = 0
+    app.extensions.pop("llm_admission", None)
+    client.post("/messages", json={"conversation_id": conv_id, "body": "and again?"})
+    response = client.post(f"/conversations/{conv_id}/ai-responses")
+    assert response.json
+    with Session(get_engine()) as sess:
+        assert sess.get(Message, response.json["message_id"]).model == "testing-small"
+
+
+def test_prompt_keeps_a_stable_prefix_across_turns(mock_course: MockCourse, app: Flask, client: FlaskClient, monkeypatch: pytest.MonkeyPatch):
+    app.config["COURSE_SUBJECT"] = "biology"
+    prompts: list[list[ContentDict]] = []
+    get_response = TestingClient.get_response
+
+    def record(self: TestingClient, contents: list[ContentDict], max_tokens: int = 3000, rung: int = 0):
+        prompts.append(contents)
+        return get_response(self, contents, max_tokens, rung)
+
+    monkeypatch.setattr(TestingClient, "get_response", record)
+    conv_id = _start_conversation(mock_course)
+
+    authenticate_as(client, mock_course.student_email)
+    for body in ["What is a mean?", "And a median?"]:
+        client.post("/messages", json={"conversation_id": conv_id, "body": body})
+        client.post(f"/conversations/{conv_id}/ai-responses")
+
+    first, second = [p for p in prompts if p[0]["role"] == "system"]
+    system, turns = split_system_instruction(second)
+    assert system == conversation.SYSTEM_PROMPT.format(subject="biology")
+    assert "university biology course" in system
+    # Only the last turn carries the retrieved context; the rest is the history.
+    assert first[:1] == second[:1]
+    assert turns[0]["parts"][0]["text"] == "What is a mean?"
+    assert turns[1]["role"] == "model"
+    assert "## Context" in turns[-1]["parts"][0]["text"]
+    assert "And a median?" in turns[-1]["parts"][0]["text"]
+
+
+def test_history_keeps_its_start_across_turns(mock_course: MockCourse, app: Flask, client: FlaskClient, monkeypatch: pytest.MonkeyPatch):
+    prompts: list[list[ContentDict]] = []
+
+    # The testing client's answers repeat their prompts, so they would soon be truncated.
+    def record(self: TestingClient, contents: list[ContentDict], max_tokens: int = 3000, rung: int = 0):
+        prompts.append(contents)
+        return ModelResponse(content=ContentDict(role="model", parts=[{"text": "An answer."}]), model="testing")
+
+    monkeypatch.setattr(TestingClient, "get_response", record)
+    conv_id = _start_conversation(mock_course, title="Conversation")
+
+    authenticate_as(client, mock_course.student_email)
+    for i in range(7):
+        client.post("/messages", json={"conversation_id": conv_id, "body": f"question {i}"})
+        client.post(f"/conversations/{conv_id}/ai-responses")
+
+    prompts = [p for p in prompts if p[0]["role"] == "system"]
+    assert len(prompts) == 7
+    # Until the history holds twice the fewest messages, each prompt extends the last
+    # but for its final turn, and then the history starts again further on.
+    for previous, current in zip(prompts[:5], prompts[1:6]):
+        assert current[: len(previous) - 1] == previous[:-1]
+    _, turns = split_system_instruction(prompts[6])
+    assert len(turns) == 7
+    assert turns[0]["role"] == "user"
+    assert turns[0]["parts"][0]["text"] == "question 3"
@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+
+from flask import Flask
+from flask.testing import FlaskClient
+from sqlalchemy.orm import Session
+from wlu_chatbot.db.models import (
+    get_engine,
+    Conversation,
+    Limit,
+    ParticipatesIn,
+    User,
+    )
+from wlu_chatbot.web_helpers.analytics import get_course_analytics, rebuild_daily_usage
+from ..conftest import MockCourse
+from .. import authenticate_as
+
+
+def _use_course(mock_course: MockCourse, client: FlaskClient) -> int:
+    """Sends a question, gets an AI response, is refused another question by a limit, and redirects."""
+    with Session(get_engine()) as sess:
+        conv = Conversation(course_id=mock_course.course_id, initiated_by=mock_course.student_email)
+        sess.add(conv)
+        sess.add(User(email="assistant@westliberty.edu", password_hash=""))
+        sess.add(ParticipatesIn(email="assistant@westliberty.edu", course_id=mock_course.course_id, role="assistant"))
+        sess.add(Limit(course_id=mock_course.course_id, maximum_number_of_uses=1, time_span_seconds=60))
+        sess.commit()
+        conv_id = conv.id
+
+    authenticate_as(client, mock_course.student_email)
+    assert client.post("/messages", json={"conversation_id": conv_id, "body": "hello"}).status_code < 400
+    assert client.post(f"/conversations/{conv_id}/ai-responses").status_code < 400
+    assert client.post("/messages", json={"conversation_id": conv_id, "body": "what is a loop?"}).status_code == 429
+    assert client.patch(f"/conversations/{conv_id}", json={"state": "REDIRECTED"}).status_code < 400
+    return conv_id
+
+
+def test_analytics_count_usage_as_it_happens(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    _use_course(mock_course, client)
+
+    authenticate_as(client, mock_course.instructor_email)
+    today = datetime.now(timezone.utc).date().isoformat()
+    response = client.get(f"/courses/{mock_course.course_id}/analytics", query_string={"start_date": today, "end_date": today})
+    assert response.status_code == 200
+    analytics = response.json
+    assert analytics
+    assert analytics["student_messages"] == 1
+    assert analytics["bot_messages"] == 1
+    assert analytics["redirects"] == 1
+    assert analytics["limit_hits"] == 1
+    assert analytics["active_students"] == 1
+    assert analytics["bot_messages_per_student"] == 1.0
+    assert [day["day"] for day in analytics["days"]] == [today]
+    assert analytics["days"][0]["active_students"] == 1
+
+    response = client.get(f"/courses/{mock_course.course_id}/analytics", query_string={"start_date": "yesterday"})
+    assert response.status_code == 400
+
+
+def test_students_cannot_see_analytics(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    authenticate_as(client, mock_course.student_email)
+    response = client.get(f"/courses/{mock_course.course_id}/analytics")
+    assert response.status_code >= 400
+
+
+def test_rebuild_recounts_messages_and_keeps_limit_hits(mock_course: MockCourse, app: Flask, client: FlaskClient):
+    _use_course(mock_course, client)
+    recorded = get_course_analytics(mock_course.course_id, None, None)
+
+    rebuild_daily_usage(mock_course.course_id)
+    rebuilt = get_course_analytics(mock_course.course_id, None, None)
+
+    assert rebuilt.student_messages == recorded.student_messages == 1
+    assert rebuilt.bot_messages == recorded.bot_messages
+    assert rebuilt.redirects == recorded.redirects
+    assert rebuilt.limit_hits == recorded.limit_hits == 1
+    assert rebuilt.active_students == recorded.active_students
+    # The conversation was created directly rather than posted, so only the rebuild counts it.
+    assert rebuilt.conversations == 1
+    assert rebuilt.redirect_rate == 1.0
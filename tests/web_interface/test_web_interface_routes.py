@@ -1,11 +1,15 @@
 import io
+from datetime import datetime
 from pathlib import Path
 
+import pytest
 from flask.testing import FlaskClient
 
 from ..conftest import MockCourse
 
-from wlu_chatbot.db.models import get_engine, Session, User
+from wlu_chatbot.db.models import get_engine, Session, User, ParticipatesIn, Conversation, Message, MessageType, MessageEmbedding
+from wlu_chatbot.api.language_model.response import TestingClient
+from wlu_chatbot.web_helpers import reports
 from wlu_chatbot.api.file_storage import StorageService
 
 
@@ -76,11 +80,116 @@ def test_generate_summary(client: FlaskClient, mock_course: MockCourse):
     response = client.post(
     f"/courses/{mock_course.course_id}/summaries",
     data={"start_date": "2025-06-01", "end_date": "2025-07-31"},
-    follow_redirects=True
     )
+    assert response.status_code == 200
+    assert response.json
+    assert response.json["status"] == "READY"
+
+    response = client.get(response.json["status_url"])
+    assert response.status_code == 200
+    assert response.json
+
+    response = client.get(response.json["download_url"])
     llm_summary = response.data.decode()
     assert response.status_code == 200
     assert "Interaction Report" in llm_summary
 
-    
-    
\ No newline at end of file
+
+def _add_question(mock_course: MockCourse, body: str, timestamp: datetime):
+    with Session(get_engine()) as session:
+        conv = Conversation(course_id=mock_course.course_id, initiated_by=mock_course.student_email)
+        session.add(conv)
+        session.flush()
+        session.add(Message(conversation_id=conv.id, body=body, type=MessageType.STUDENT_MESSAGE, written_by=mock_course.student_email, timestamp=timestamp))
+        session.commit()
+
+
+def test_summary_is_reused_until_messages_change(client: FlaskClient, mock_course: MockCourse, monkeypatch: pytest.MonkeyPatch):
+    calls: list[int] = []
+    generate_usage_summary = reports.generate_usage_summary
+
+    def record(*args, **kwargs):
+        calls.append(1)
+        return generate_usage_summary(*args, **kwargs)
+
+    monkeypatch.setattr(reports, "generate_usage_summary", record)
+    _add_question(mock_course, "What is a mean?", datetime(2025, 6, 2))
+
+    with client.session_transaction() as sess:
+        sess["_user_id"] = mock_course.instructor_email
+
+    data = {"start_date": "2025-06-01", "end_date": "2025-07-31"}
+    first = client.post(f"/courses/{mock_course.course_id}/summaries", data=data).json
+    second = client.post(f"/courses/{mock_course.course_id}/summaries", data=data).json
+    assert first and second
+    assert first["report_id"] == second["report_id"]
+    assert len(calls) == 1
+
+    other = client.post(f"/courses/{mock_course.course_id}/summaries", data={"start_date": "2025-06-01"}).json
+    assert other and other["report_id"] != first["report_id"]
+    assert len(calls) == 2
+
+    _add_question(mock_course, "What is a median?", datetime(2025, 6, 3))
+    third = client.post(f"/courses/{mock_course.course_id}/summaries", data=data).json
+    assert third and third["report_id"] == first["report_id"]
+    assert len(calls) == 3
+    assert "2 questions" in client.get(third["download_url"]).data.decode()
+
+
+def test_summary_of_another_course_is_not_found(client: FlaskClient, mock_course: MockCourse, mock_course2: MockCourse):
+    with Session(get_engine()) as session:
+        session.add(ParticipatesIn(email=mock_course.instructor_email, course_id=mock_course2.course_id, role="instructor"))
+        session.commit()
+
+    with client.session_transaction() as sess:
+        sess["_user_id"] = mock_course.instructor_email
+    response = client.post(f"/courses/{mock_course.course_id}/summaries", data={})
+    assert response.json
+
+    report_id = response.json["report_id"]
+    response = client.get(f"/courses/{mock_course2.course_id}/summaries/{report_id}/download")
+    assert response.status_code == 404
+
+
+def test_generate_summary_labels_one_question_per_topic(client: FlaskClient, mock_course: MockCourse, monkeypatch: pytest.MonkeyPatch):
+    with Session(get_engine()) as session:
+        conv = Conversation(course_id=mock_course.course_id, initiated_by=mock_course.student_email)
+        session.add(conv)
+        session.flush()
+        for day, body in [(2, "What is a mean?"), (3, "What is the mean?"), (20, "How do I find the mean?")]:
+            session.add(Message(conversation_id=conv.id, body=body, type=MessageType.STUDENT_MESSAGE, written_by=mock_course.student_email, timestamp=datetime(2025, 6, day)))
+            session.add(Message(conversation_id=conv.id, body="The average.", type=MessageType.BOT_MESSAGE, written_by=mock_course.student_email, timestamp=datetime(2025, 6, day, 1)))
+        session.commit()
+
+    prompts: list[str] = []
+    get_response = TestingClient.get_response
+
+    def record(self: TestingClient, contents, max_tokens: int = 3000, rung: int = 0):
+        prompts.append(contents[0]["parts"][0]["text"])
+        return get_response(self, contents, max_tokens, rung)
+
+    monkeypatch.setattr(TestingClient, "get_response", record)
+
+    with client.session_transaction() as sess:
+        sess["_user_id"] = mock_course.instructor_email
+
+    response = client.post(
+        f"/courses/{mock_course.course_id}/summaries",
+        data={"start_date": "2025-06-01", "end_date": "2025-07-31"},
+    )
+    assert response.json
+    response = client.get(response.json["download_url"])
+    summary = response.data.decode()
+    assert response.status_code == 200
+    assert "Common Topics:" in summary
+    assert "3 questions" in summary
+
+    # One topic is labelled, then the report is written from the topics.
+    assert len(prompts) == 2
+    assert "What is a mean?" in prompts[0]
+    assert "The average." not in prompts[1]
+    # Both prompts name the configured subject of the course.
+    assert all("statistics course" in prompt for prompt in prompts)
+
+    with Session(get_engine()) as session:
+        assert session.query(MessageEmbedding).count() == 3
@@ -29,7 +29,6 @@ def create_app(test_config: Mapping[str, Any] | None = None):
     """
 
     app = Flask(__name__, instance_relative_config=True)
-    app.debug = True
     app.config["PROPAGATE_EXCEPTIONS"] = True
 
     app.config.from_object(Config)
@@ -6,11 +6,13 @@ There are some utility functions for managing the wlu_chatbot application.
 Available commands:
 - db: Manage the database
 - quickstart: Initialize and run the application with mock data
+- serve: Run the application with gunicorn for production; further arguments are passed to gunicorn
 """
 
 import sys
 from wlu_chatbot import create_app
 from wlu_chatbot.quickstart import main as quickstart_main
+from wlu_chatbot.serve import main as serve_main
 
 if len(sys.argv) == 1:
     print(__doc__)
@@ -27,6 +29,8 @@ match sys.argv[1]:
     case "quickstart":
         with create_app().app_context():
             quickstart_main()
+    case "serve":
+        serve_main(sys.argv[2:])
     case _:
         print("Unknown command", file=sys.stderr)
         exit(1)
@@ -0,0 +1,92 @@
+"""A per-course cache of generated answers to first-turn questions.
+
+Courses opt into the cache. A cached answer is reused for a new first-turn
+question whose embedding is close enough to the cached question's embedding,
+as long as the course's documents have not changed since the answer was cached.
+"""
+
+from dataclasses import dataclass
+from typing import Optional, Sequence, cast
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from wlu_chatbot.config import app_config
+from wlu_chatbot.db.models import get_engine, Course, CachedAnswer
+
+
+@dataclass
+class CachedAnswerHit:
+    """A cached answer that may be reused for a question."""
+
+    answer: str
+    segment_ids: list[int]
+
+
+def get_answer_cache_version(course_id: int) -> Optional[int]:
+    """Returns the version of the course's documents against which answers are cached,
+    or None if the course has not enabled the answer cache.
+    """
+    with Session(get_engine()) as session:
+        course = session.get(Course, course_id)
+        if course is None or not cast(bool, course.answer_cache_enabled):
+            return None
+        return cast(int, course.documents_version)
+
+
+def find_cached_answer(
+    course_id: int, documents_version: int, prompt_embedding: Sequence[float]
+) -> Optional[CachedAnswerHit]:
+    """Finds the closest cached answer for a question, if one is close enough.
+
+    :param course_id: The course in which the question was asked.
+    :param documents_version: The current version of the course's documents.
+    :param prompt_embedding: The embedding of the question.
+    :return: The cached answer or None if there is no sufficiently similar question.
+    """
+    distance = CachedAnswer.vector.cosine_distance(prompt_embedding)
+    with Session(get_engine()) as session:
+        cached = (
+            session.query(CachedAnswer)
+            .where(
+                CachedAnswer.course_id == course_id,
+                CachedAnswer.documents_version == documents_version,
+                distance <= app_config.ANSWER_CACHE_MAX_DISTANCE,
+            )
+            .order_by(distance)
+            .first()
+        )
+        if cached is None:
+            return None
+        return CachedAnswerHit(
+            answer=cast(str, cached.answer),
+            segment_ids=list(cast(list[int], cached.segment_ids)),
+        )
+
+
+def cache_answer(
+    course_id: int,
+    documents_version: int,
+    prompt_embedding: Sequence[float],
+    segment_ids: list[int],
+    answer: str,
+):
+    """Stores a generated answer to a first-turn question."""
+    with Session(get_engine()) as session:
+        session.add(
+            CachedAnswer(
+                course_id=course_id,
+                vector=prompt_embedding,
+                segment_ids=segment_ids,
+                answer=answer,
+                documents_version=documents_version,
+            )
+        )
+        session.commit()
+
+
+def invalidate_cached_answers(session: Session, course_id: int):
+    """Deletes all cached answers for a course. Should be called whenever the course's documents change.
+    The deletion is committed along with the rest of the session.
+    """
+    session.execute(delete(CachedAnswer).where(CachedAnswer.course_id == course_id))
@@ -0,0 +1,152 @@
+"""Removes redundancy from retrieved segments.
+
+Segments of a PDF overlap their neighbours by a few sentences, so adjacent
+segments retrieved together repeat text. These functions merge adjacent
+segments, drop segments whose text is already covered by other segments,
+and diversify candidates with maximal marginal relevance (MMR).
+"""
+
+from dataclasses import replace
+from typing import Sequence
+
+import numpy as np
+
+from wlu_chatbot.api.embedding import normalize_rows
+
+from .retrieved_segment import RetrievedSegment
+
+NEAR_DUPLICATE_CONTAINMENT = 0.8
+"""The fraction of a segment's word trigrams that must already be included for the segment to be dropped."""
+
+
+def merge_adjacent(segments: list[RetrievedSegment]) -> list[RetrievedSegment]:
+    """Merges segments that are adjacent in the same document, removing the text they share.
+
+    Segments of a document are stored in order, so adjacent segments have
+    consecutive ids. A merged segment takes the place and reference number
+    of its most relevant part.
+
+    :param segments: The retrieved segments, most relevant first.
+    :return: The merged segments, most relevant first.
+    """
+    merged: list[RetrievedSegment] = []
+    for segment in segments:
+        merged.append(segment)
+        # Merging a segment may close the gap between two earlier ones, so
+        # keep merging until no two segments are adjacent.
+        index = len(merged) - 1
+        while index is not None:
+            index = _merge_into_neighbour(merged, index)
+    return merged
+
+
+def _merge_into_neighbour(segments: list[RetrievedSegment], index: int) -> int | None:
+    """Merges the segment at an index into an adjacent, more relevant segment if there is one,
+    or an adjacent, less relevant segment into it.
+
+    :return: The index of the merged segment, or None if nothing was merged.
+    """
+    segment = segments[index]
+    first, last = min(segment.segment_ids), max(segment.segment_ids)
+    for other_index, other in enumerate(segments):
+        if other_index == index or other.document_id != segment.document_id:
+            continue
+        other_ids = other.segment_ids
+        if max(other_ids) + 1 == first:
+            text = _join_overlapping(other.text, segment.text)
+        elif min(other_ids) - 1 == last:
+            text = _join_overlapping(segment.text, other.text)
+        else:
+            continue
+
+        keep, drop = sorted((index, other_index))
+        kept = segments[keep]
+        segments[keep] = replace(
+            kept,
+            text=text,
+            merged_ids=kept.merged_ids + segments[drop].segment_ids,
+        )
+        del segments[drop]
+        return keep
+    return None
+
+
+def _join_overlapping(first: str, second: str) -> str:
+    """Joins two texts, dropping the longest prefix of the second that ends the first at a word boundary."""
+    if not second:
+        return first
+    position = first.find(second[0])
+    while position != -1:
+        at_word_boundary = position == 0 or first[position - 1].isspace()
+        if at_word_boundary and second.startswith(first[position:]):
+            return first + second[len(first) - position :]
+        position = first.find(second[0], position + 1)
+    return first + " " + second
+
+
+def remove_near_duplicates(
+    segments: list[RetrievedSegment],
+    containment: float = NEAR_DUPLICATE_CONTAINMENT,
+) -> list[RetrievedSegment]:
+    """Drops segments whose text is mostly contained in more relevant segments.
+
+    Containment is measured on word trigrams, so it tolerates differences in
+    whitespace and a few changed words.
+
+    :param segments: The retrieved segments, most relevant first.
+    :param containment: The fraction of a segment's trigrams that must already be included to drop it.
+    :return: The remaining segments, most relevant first.
+    """
+    kept: list[RetrievedSegment] = []
+    seen: set[tuple[str, ...]] = set()
+    for segment in segments:
+        shingles = _word_trigrams(segment.text)
+        if shingles and len(shingles & seen) / len(shingles) >= containment:
+            continue
+        kept.append(segment)
+        seen |= shingles
+    return kept
+
+
+def _word_trigrams(text: str) -> set[tuple[str, ...]]:
+    words = text.lower().split()
+    return {tuple(words[i : i + 3]) for i in range(len(words) - 2)}
+
+
+def select_diverse(
+    prompt_embedding: Sequence[float],
+    candidate_vectors: Sequence[Sequence[float]],
+    num_selected: int,
+    relevance_weight: float,
+) -> list[int]:
+    """Selects candidates by maximal marginal relevance, trading their similarity to the prompt
+    against their similarity to the candidates already selected.
+
+    :param prompt_embedding: The embedding of the prompt.
+    :param candidate_vectors: The embeddings of the candidates.
+    :param num_selected: The number of candidates to select.
+    :param relevance_weight: The weight of relevance against diversity, between 0 and 1.
+        A weight of 1 selects purely by relevance.
+    :return: The indices of the selected candidates, in the order they were selected.
+    """
+    if len(candidate_vectors) == 0:
+        return []
+
+    candidates = normalize_rows(np.asarray(candidate_vectors, dtype=np.float32))
+    prompt = normalize_rows(np.asarray(prompt_embedding, dtype=np.float32)[np.newaxis])
+    relevance = (candidates @ prompt.T)[:, 0]
+    similarity = candidates @ candidates.T
+
+    selected: list[int] = []
+    # The largest similarity of each candidate to any selected candidate.
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+    for _ in range(min(num_selected, len(candidates))):
+        penalty = np.where(np.isneginf(redundancy), 0.0, redundancy)
+        scores = relevance_weight * relevance - (1 - relevance_weight) * penalty
+        scores[~available] = -np.inf
+        chosen = int(np.argmax(scores))
+        selected.append(chosen)
+        available[chosen] = False
+        redundancy = np.maximum(redundancy, similarity[chosen])
+    return selected
@@ -0,0 +1,21 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass
+class RetrievedSegment:
+    """A dataclass to hold the retrieved segment's data."""
+
+    id: int
+    text: str
+    document_name: str
+    document_id: int
+    merged_ids: list[int] = field(default_factory=list[int])
+    """The ids of adjacent segments whose text was merged into this segment."""
+    distance: Optional[float] = None
+    """The Euclidean distance between the segment's embedding and the prompt's embedding, if known."""
+
+    @property
+    def segment_ids(self) -> list[int]:
+        """The ids of all segments whose text this segment holds, starting with its own."""
+        return [self.id, *self.merged_ids]
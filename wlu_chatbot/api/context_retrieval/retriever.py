@@ -1,24 +1,159 @@
+from sqlalchemy import (
+    Executable,
+    Integer,
+    select,
+    func,
+    union_all,
+    literal,
+    null,
+    values,
+    column,
+    true,
+    text,
+    cast as sql_cast,
+)
+from sqlalchemy.dialects.postgresql import array
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Sequence, cast
+from collections import OrderedDict
 from dataclasses import dataclass
+from threading import Lock
+from concurrent.futures import Future, wait
+import io
 
-from wlu_chatbot.db.models import get_engine, Segment, Embedding, Document
+from flask import current_app
+from pgvector.sqlalchemy import HALFVEC  # type: ignore
 
-from ..embedding.embedding import embed_text
+from wlu_chatbot.background import run_interactively
+from wlu_chatbot.config import app_config, RetrievalMode, RetrievalBackend
+from wlu_chatbot.resources import get_resource
+from wlu_chatbot.db.models import (
+    get_engine,
+    Segment,
+    Embedding,
+    Document,
+    Course,
+    PreparedRetrieval,
+    MessageEmbedding,
+    COMPACT_EMBEDDING_DIMENSIONS,
+)
+from wlu_chatbot.api.hashing import hash_bytes
+
+from ..embedding.embedding import embed_text, embed_texts, compact_embedding
+from ..message_embeddings import embed_message
+from .retrieved_segment import RetrievedSegment
+from .redundancy import merge_adjacent, remove_near_duplicates, select_diverse
+from .vector_index import get_vector_index
+
+
+RetrievalCacheKey = tuple[int, int, str, int]
+"""The course id, course documents version, prompt hash, and number of segments for a retrieval."""
+
+
+class RetrievalCache:
+    """A bounded, least-recently-used cache of retrieval results that is shared by the threads of a process.
+
+    Entries are keyed by the version of the course's documents, so entries
+    made before the documents changed are never served and eventually evicted.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries: OrderedDict[RetrievalCacheKey, list[RetrievedSegment]] = (
+            OrderedDict()
+        )
+        self._lock = Lock()
+
+    def get(self, key: RetrievalCacheKey) -> Optional[list[RetrievedSegment]]:
+        """Returns the cached segments for a key, if there are any."""
+        with self._lock:
+            segments = self._entries.get(key)
+            if segments is None:
+                return None
+            self._entries.move_to_end(key)
+            return list(segments)
+
+    def put(self, key: RetrievalCacheKey, segments: list[RetrievedSegment]):
+        """Caches the segments for a key, evicting the least recently used entry if the cache is full."""
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = list(segments)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        """Returns the number of cached entries."""
+        with self._lock:
+            return len(self._entries)
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    """Gets this process's retrieval cache. Must be called from within an application context."""
+    return get_resource(
+        "retrieval_cache", lambda: RetrievalCache(app_config.RETRIEVAL_CACHE_SIZE)
+    )
+
+
+def get_pending_preparations() -> dict[int, Future[None]]:
+    """Gets the preparations that this process has started with start_preparing_for_message
+    and that have not finished, by the id of their message. Must be called from within an application context.
+    """
+    return get_resource("pending_preparations", dict[int, Future[None]])
+
+
+PREPARATION_WAIT_SECONDS = 3.0
+"""How long a response waits for the preparation of its message that is still running
+before it retrieves the segments itself."""
+
+RRF_K = 60
+"""The rank offset used by reciprocal rank fusion; larger values flatten the influence of top ranks."""
+
+HYBRID_CANDIDATES_PER_SEGMENT = 4
+"""How many candidates each of the lexical and vector searches contributes per requested segment in hybrid mode."""
+
+MMR_CANDIDATES_PER_SEGMENT = 3
+"""How many candidates are retrieved per requested segment when diversifying segments by maximal marginal relevance."""
+
+ADAPTIVE_K_GAP_RATIO = 2.0
+"""How many times larger than the mean of the other gaps the largest gap between distances must be for adaptive k to cut there."""
+
+COMPACT_CANDIDATES_PER_SEGMENT = 4
+"""How many candidates are shortlisted by compact embeddings per requested segment before ranking by full embeddings."""
 
 
 @dataclass
-class RetrievedSegment:
-    """A dataclass to hold the retrieved segment's data."""
+class PreparedSegments:
+    """The segments and embedding prepared for a student message."""
+
+    prompt_embedding: Sequence[float]
+    segments: list[RetrievedSegment]
 
-    id: int
-    text: str
-    document_name: str
+
+def adaptive_k(distances: list[float]) -> int:
+    """Chooses how many of the nearest segments to keep by cutting at the largest gap
+    between consecutive distances, if that gap stands out from the others.
+
+    :param distances: The distances of the found segments, in ascending order.
+    :return: The number of segments to keep.
+    """
+    gaps = [b - a for a, b in zip(distances, distances[1:])]
+    if not gaps:
+        return len(distances)
+    largest = max(range(len(gaps)), key=lambda i: gaps[i])
+    others = gaps[:largest] + gaps[largest + 1 :]
+    mean_other = sum(others) / len(others) if others else 0.0
+    if gaps[largest] <= 0 or gaps[largest] < ADAPTIVE_K_GAP_RATIO * mean_other:
+        return len(distances)
+    return largest + 1
 
 
 class Retriever:
     """
-    Retrieves relevant text segments from the database using vector search.
+    Retrieves relevant text segments from the database using vector search,
+    optionally fused with a full-text search. Vector searches run in Postgres
+    or in an in-process NumPy index, depending on the configured backend.
     """
 
     def get_segments_for(
@@ -26,37 +161,552 @@ class Retriever:
         prompt: str,
         course_id: int,
         num_segments: int = 3,
+        prompt_embedding: Optional[Sequence[float]] = None,
     ) -> List[RetrievedSegment]:
         """
         Gets relevant segments from the database by performing a vector similarity search.
+        Segments that are too distant from the prompt are left out, adjacent segments are
+        merged, and near-duplicates are dropped, so fewer segments than requested may be
+        returned. Results are cached until the course's documents change.
 
         :param prompt: The user's prompt for which to find context.
         :param num_segments: The number of segments to retrieve.
+        :param prompt_embedding: The embedding of the prompt, if it has already been computed.
         :return: A list of RetrievedSegment objects.
         """
-        prompt_embedding = embed_text(prompt)
+        documents_version = self._documents_version(course_id)
+        if documents_version is None:
+            return []
+
+        cache = get_retrieval_cache()
+        key = self._cache_key(prompt, course_id, documents_version, num_segments)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        if prompt_embedding is None:
+            prompt_embedding = embed_text(prompt)
+
+        found = self._find(
+            prompt,
+            course_id,
+            documents_version,
+            self._num_candidates(num_segments),
+            prompt_embedding,
+        )
+        retrieved_segments = self._refine(
+            course_id, found, num_segments, prompt_embedding
+        )
+        cache.put(key, retrieved_segments)
+        return retrieved_segments
+
+    def get_segments_for_many(
+        self, prompts: Sequence[str], course_id: int, num_segments: int = 3
+    ) -> list[list[RetrievedSegment]]:
+        """
+        Gets relevant segments for several prompts at once, like get_segments_for.
+        The prompts that are not cached are embedded in a single request, and plain
+        vector searches in Postgres run as a single query.
 
+        :param prompts: The prompts for which to find context.
+        :param course_id: The course whose segments are searched.
+        :param num_segments: The number of segments to retrieve per prompt.
+        :return: The retrieved segments of each prompt, in the order of the prompts.
+        """
+        documents_version = self._documents_version(course_id)
+        if documents_version is None:
+            return [[] for _ in prompts]
+
+        cache = get_retrieval_cache()
+        keys = [
+            self._cache_key(prompt, course_id, documents_version, num_segments)
+            for prompt in prompts
+        ]
+        results = [cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return cast(list[list[RetrievedSegment]], results)
+
+        embeddings = embed_texts([prompts[i] for i in missing])
+        num_candidates = self._num_candidates(num_segments)
+        if (
+            app_config.RETRIEVAL_MODE == RetrievalMode.VECTOR
+            and app_config.RETRIEVAL_BACKEND == RetrievalBackend.POSTGRES
+            and not app_config.COMPACT_EMBEDDINGS
+        ):
+            found = self._find_many(course_id, num_candidates, embeddings)
+        else:
+            found = [
+                self._find(
+                    prompts[i], course_id, documents_version, num_candidates, embedding
+                )
+                for i, embedding in zip(missing, embeddings)
+            ]
+
+        for i, embedding, segments in zip(missing, embeddings, found):
+            refined = self._refine(course_id, segments, num_segments, embedding)
+            cache.put(keys[i], refined)
+            results[i] = refined
+        return cast(list[list[RetrievedSegment]], results)
+
+    def prepare_for_message(
+        self, message_id: int, prompt: str, course_id: int, num_segments: int
+    ):
+        """Finds the segments for a student message ahead of a request for a response to it,
+        and stores them along with the message's embedding for get_prepared_segments.
+
+        :param message_id: The student message.
+        :param prompt: The body of the message.
+        :param course_id: The course whose segments are searched.
+        :param num_segments: The number of segments that the response will use.
+        """
+        documents_version = self._documents_version(course_id)
+        if documents_version is None:
+            return
+
+        prompt_embedding = embed_message(message_id, prompt)
+        found = self._find(
+            prompt,
+            course_id,
+            documents_version,
+            self._num_candidates(num_segments),
+            prompt_embedding,
+        )
+        with Session(get_engine()) as session:
+            session.merge(
+                PreparedRetrieval(
+                    message_id=message_id,
+                    segment_ids=[s.id for s in found],
+                    distances=[s.distance for s in found],
+                    num_segments=num_segments,
+                    documents_version=documents_version,
+                )
+            )
+            session.commit()
+
+    def start_preparing_for_message(
+        self, message_id: int, prompt: str, course_id: int, num_segments: int
+    ):
+        """Runs prepare_for_message in the background, so that get_prepared_segments
+        can wait for it while it runs. Must be called from within an application context.
+        """
+        future = run_interactively(
+            self.prepare_for_message, message_id, prompt, course_id, num_segments
+        )
+        pending = get_pending_preparations()
+        pending[message_id] = future
+        # Runs at once if the preparation has already finished.
+        future.add_done_callback(lambda _: pending.pop(message_id, None))
+
+    def get_prepared_segments(
+        self, message_id: int, course_id: int, num_segments: int, timeout: float = 0.0
+    ) -> Optional[PreparedSegments]:
+        """Gets the segments prepared for a student message by prepare_for_message.
+
+        :param timeout: The longest time in seconds to wait for a preparation of the
+            message that this process started and that is still running.
+        :return: The prepared segments, or None if none were prepared or they are out of date.
+        """
+        pending = get_pending_preparations().get(message_id)
+        if pending is not None and timeout > 0:
+            wait([pending], timeout=timeout)
         with Session(get_engine()) as session:
-            results = (
-                session.query(Segment, Document.name)
-                .join(Embedding)
-                .join(Document)
-                .filter(Document.course_id == course_id)
-                .order_by(Embedding.vector.l2_distance(prompt_embedding))
-                .limit(num_segments)
-                .all()
-            )
-
-            retrieved_segments = [
-                RetrievedSegment(
-                    id=segment.id,  # type: ignore
-                    text=segment.text,  # type: ignore
-                    document_name=name,  # type: ignore
-                )
-                for segment, name in results
+            prepared = session.get(PreparedRetrieval, message_id)
+            embedding = session.get(MessageEmbedding, message_id)
+            if (
+                prepared is None
+                or embedding is None
+                or cast(int, prepared.num_segments) != num_segments
+                or cast(int, prepared.documents_version)
+                != self._documents_version(course_id)
+            ):
+                return None
+            prompt_embedding = list(cast(Sequence[float], embedding.vector))
+            distances = dict(
+                zip(
+                    cast(list[int], prepared.segment_ids),
+                    cast(list[Optional[float]], prepared.distances),
+                )
+            )
+
+            results = cast(
+                list[tuple[Segment, str, None]],
+                session.execute(self._segments_statement(list(distances))).all(),
+            )
+            found = [
+                self._retrieved_segment(segment, name, distances[cast(int, segment.id)])
+                for segment, name, _ in results
             ]
 
+        return PreparedSegments(
+            prompt_embedding=prompt_embedding,
+            segments=self._refine(course_id, found, num_segments, prompt_embedding),
+        )
+
+    def _documents_version(self, course_id: int) -> Optional[int]:
+        """Returns the version of a course's documents, or None if there is no such course."""
+        with Session(get_engine()) as session:
+            course = session.get(Course, course_id)
+            if course is None:
+                return None
+            return cast(int, course.documents_version)
+
+    def _cache_key(
+        self, prompt: str, course_id: int, documents_version: int, num_segments: int
+    ) -> RetrievalCacheKey:
+        prompt_hash = hash_bytes(io.BytesIO(prompt.encode()))
+        return (course_id, documents_version, prompt_hash, num_segments)
+
+    def _num_candidates(self, num_segments: int) -> int:
+        """Returns how many segments to find before they are refined to the requested number."""
+        if app_config.RETRIEVAL_MMR_LAMBDA is None:
+            return num_segments
+        return num_segments * MMR_CANDIDATES_PER_SEGMENT
+
+    def _find(
+        self,
+        prompt: str,
+        course_id: int,
+        documents_version: int,
+        num_candidates: int,
+        prompt_embedding: Sequence[float],
+    ) -> list[RetrievedSegment]:
+        """Finds the candidate segments for a prompt with the configured mode and backend, nearest first."""
+        index_distances: dict[int, float] = {}
+        match app_config.RETRIEVAL_MODE, app_config.RETRIEVAL_BACKEND:
+            case RetrievalMode.VECTOR, RetrievalBackend.POSTGRES:
+                statement = self._vector_statement(
+                    course_id, num_candidates, prompt_embedding
+                )
+            case RetrievalMode.VECTOR, RetrievalBackend.NUMPY:
+                index_distances = dict(
+                    get_vector_index().search(
+                        course_id, documents_version, prompt_embedding, num_candidates
+                    )
+                )
+                statement = self._segments_statement(list(index_distances))
+            case RetrievalMode.HYBRID, _:
+                # The full-text search runs in Postgres, so hybrid retrieval
+                # always runs there as a single query.
+                statement = self._hybrid_statement(
+                    prompt, course_id, num_candidates, prompt_embedding
+                )
+
+        with Session(get_engine()) as session:
+            self._allow_compact_search(session)
+            results = cast(
+                list[tuple[Segment, str, Optional[float]]],
+                session.execute(statement).all(),
+            )
+            return [
+                self._retrieved_segment(
+                    segment,
+                    name,
+                    distance
+                    if distance is not None
+                    else index_distances.get(cast(int, segment.id)),
+                )
+                for segment, name, distance in results
+            ]
+
+    def _find_many(
+        self,
+        course_id: int,
+        num_candidates: int,
+        prompt_embeddings: Sequence[Sequence[float]],
+    ) -> list[list[RetrievedSegment]]:
+        """Finds the nearest segments for each of several prompt embeddings with a single
+        query, which searches the segments of the course once per prompt in a lateral join.
+        """
+        queries = values(
+            column("query_index", Integer), column("embedding", HALFVEC), name="queries"
+        ).data([(i, list(e)) for i, e in enumerate(prompt_embeddings)])
+        distance = Embedding.vector.l2_distance(sql_cast(queries.c.embedding, HALFVEC))
+        nearest = (
+            select(Embedding.segment_id, distance.label("distance"))
+            .join(Segment, Segment.id == Embedding.segment_id)
+            .join(Document, Document.id == Segment.document_id)
+            .where(Document.course_id == course_id)
+            .order_by(distance)
+            .limit(num_candidates)
+            .lateral("nearest")
+        )
+        statement = (  # type: ignore
+            select(queries.c.query_index, Segment, Document.name, nearest.c.distance)
+            .select_from(queries)
+            .join(nearest, true())
+            .join(Segment, Segment.id == nearest.c.segment_id)
+            .join(Document, Document.id == Segment.document_id)
+            .order_by(queries.c.query_index, nearest.c.distance)
+        )
+
+        found: list[list[RetrievedSegment]] = [[] for _ in prompt_embeddings]
+        with Session(get_engine()) as session:
+            results = cast(
+                list[tuple[int, Segment, str, float]],
+                session.execute(statement).all(),  # type: ignore
+            )
+            for query_index, segment, name, segment_distance in results:
+                found[query_index].append(
+                    self._retrieved_segment(segment, name, segment_distance)
+                )
+        return found
+
+    def _retrieved_segment(
+        self, segment: Segment, document_name: str, distance: Optional[float]
+    ) -> RetrievedSegment:
+        return RetrievedSegment(
+            id=cast(int, segment.id),
+            text=cast(str, segment.text),
+            document_name=document_name,
+            document_id=cast(int, segment.document_id),
+            distance=distance,
+        )
+
+    def _refine(
+        self,
+        course_id: int,
+        found: list[RetrievedSegment],
+        num_segments: int,
+        prompt_embedding: Sequence[float],
+    ) -> list[RetrievedSegment]:
+        """Cuts off, diversifies, and merges the found segments as configured, and logs the outcome."""
+        retrieved_segments = self._cut_off(found)
+
+        mmr_lambda = app_config.RETRIEVAL_MMR_LAMBDA
+        if mmr_lambda is not None:
+            retrieved_segments = self._diversify(
+                retrieved_segments, num_segments, prompt_embedding, mmr_lambda
+            )
+
+        if app_config.RETRIEVAL_MERGE_SEGMENTS:
+            retrieved_segments = remove_near_duplicates(
+                merge_adjacent(retrieved_segments)
+            )
+
+        current_app.logger.info(
+            "Retrieved %d of %d segments found for course %d at distances %s.",
+            len(retrieved_segments),
+            len(found),
+            course_id,
+            [
+                None if s.distance is None else round(s.distance, 4)
+                for s in retrieved_segments
+            ],
+        )
         return retrieved_segments
 
+    def _cut_off(self, segments: list[RetrievedSegment]) -> list[RetrievedSegment]:
+        """Leaves out the segments that are too distant from the prompt, as configured.
+
+        Segments without a distance, i.e. those found by hybrid retrieval, are kept.
+
+        :param segments: The found segments, nearest first.
+        :return: The segments to keep, nearest first.
+        """
+        max_distance = app_config.RETRIEVAL_MAX_DISTANCE
+        if max_distance is not None:
+            segments = [
+                s for s in segments if s.distance is None or s.distance <= max_distance
+            ]
+
+        if not app_config.RETRIEVAL_ADAPTIVE_K or len(segments) <= 2:
+            return segments
+        distances = [s.distance for s in segments]
+        if any(d is None for d in distances):
+            return segments
+        return segments[: adaptive_k(cast(list[float], distances))]
+
+    def _diversify(
+        self,
+        candidates: list[RetrievedSegment],
+        num_segments: int,
+        prompt_embedding: Sequence[float],
+        mmr_lambda: float,
+    ) -> list[RetrievedSegment]:
+        """Selects the given number of candidates by maximal marginal relevance."""
+        with Session(get_engine()) as session:
+            vectors = dict(
+                cast(
+                    list[tuple[int, Sequence[float]]],
+                    session.execute(
+                        select(Embedding.segment_id, Embedding.vector).where(  # type: ignore
+                            Embedding.segment_id.in_([c.id for c in candidates])
+                        )
+                    ).all(),
+                )
+            )
+        candidates = [c for c in candidates if c.id in vectors]
+        selected = select_diverse(
+            prompt_embedding,
+            [vectors[c.id] for c in candidates],
+            num_segments,
+            mmr_lambda,
+        )
+        return [candidates[i] for i in selected]
+
+    def _vector_statement(
+        self,
+        course_id: int,
+        num_segments: int,
+        prompt_embedding: Sequence[float],
+        compact: Optional[bool] = None,
+    ) -> Executable:
+        """Selects the segments whose embeddings are nearest to the prompt's embedding.
+
+        With compact embeddings, a shortlist is found by the index of the compact
+        embeddings and only the full embeddings of the shortlist are read to rank it.
+        The session that executes the statement must allow for it with _allow_compact_search.
+
+        :param compact: Whether to shortlist by compact embeddings. Defaults to the configured behaviour.
+        """
+        if compact is None:
+            compact = app_config.COMPACT_EMBEDDINGS
+
+        distance = Embedding.vector.l2_distance(prompt_embedding)
+        statement = (  # type: ignore
+            select(Segment, Document.name, distance.label("distance"))
+            .join(Embedding)
+            .join(Document)
+            .where(Document.course_id == course_id)
+            .order_by(distance)
+            .limit(num_segments)
+        )
+        if not compact or len(prompt_embedding) < COMPACT_EMBEDDING_DIMENSIONS:
+            return statement  # type: ignore
+
+        compact_prompt = compact_embedding(
+            prompt_embedding, COMPACT_EMBEDDING_DIMENSIONS
+        )
+        shortlist = (  # type: ignore
+            select(Embedding.id)
+            .join(Segment, Segment.id == Embedding.segment_id)
+            .join(Document, Document.id == Segment.document_id)
+            .where(
+                Document.course_id == course_id,
+                # Restricts the search to the vectors in the index of compact embeddings.
+                func.vector_dims(Embedding.vector) >= COMPACT_EMBEDDING_DIMENSIONS,
+            )
+            .order_by(Embedding.compact_vector.l2_distance(compact_prompt))
+            .limit(num_segments * COMPACT_CANDIDATES_PER_SEGMENT)
+        )
+        return statement.where(Embedding.id.in_(shortlist))  # type: ignore
+
+    def _allow_compact_search(self, session: Session, force: bool = False):
+        """Lets the index scans of compact embeddings in a session's transaction continue
+        past the segments of other courses, so that a course's shortlist is not cut short
+        by the segments of other courses that are near the prompt.
+
+        :param force: Whether to allow for compact searches even if they are not configured.
+        """
+        if force or app_config.COMPACT_EMBEDDINGS:
+            session.execute(text("SET LOCAL hnsw.iterative_scan = relaxed_order"))
+
+    def measure_compact_recall(
+        self, query_embeddings: Sequence[tuple[int, Sequence[float]]], num_segments: int
+    ) -> float:
+        """Measures how many of the segments found by full embeddings are also found
+        when shortlisting by compact embeddings.
+
+        :param query_embeddings: Pairs of a course id and a query embedding in that course.
+        :param num_segments: The number of segments retrieved per query.
+        :return: The mean recall of the compact search, between 0 and 1.
+        """
+        recalls: list[float] = []
+        with Session(get_engine()) as session:
+            self._allow_compact_search(session, force=True)
+
+            def retrieved_ids(
+                course_id: int, embedding: Sequence[float], compact: bool
+            ) -> set[int]:
+                statement = self._vector_statement(
+                    course_id, num_segments, embedding, compact=compact
+                )
+                results = cast(
+                    list[tuple[Segment, str, float]], session.execute(statement).all()
+                )
+                return {cast(int, segment.id) for segment, _, _ in results}
+
+            for course_id, embedding in query_embeddings:
+                exact = retrieved_ids(course_id, embedding, compact=False)
+                approximate = retrieved_ids(course_id, embedding, compact=True)
+                if exact:
+                    recalls.append(len(exact & approximate) / len(exact))
+        return sum(recalls) / len(recalls) if recalls else 1.0
+
+    def _segments_statement(self, segment_ids: list[int]) -> Executable:
+        """Selects the given segments in the given order."""
+        return (  # type: ignore
+            select(Segment, Document.name, null().label("distance"))
+            .join(Document)
+            .where(Segment.id.in_(segment_ids))
+            .order_by(
+                func.array_position(array(segment_ids, type_=Integer), Segment.id)
+            )
+        )
+
+    def _hybrid_statement(
+        self,
+        prompt: str,
+        course_id: int,
+        num_segments: int,
+        prompt_embedding: Sequence[float],
+    ) -> Executable:
+        """Selects segments by fusing the ranks of a vector search and a full-text search
+        with reciprocal rank fusion, so that both searches run in a single query.
+        """
+        num_candidates = num_segments * HYBRID_CANDIDATES_PER_SEGMENT
+
+        distance = Embedding.vector.l2_distance(prompt_embedding)
+        vector_ranked = (
+            select(
+                Embedding.segment_id.label("segment_id"),
+                func.row_number().over(order_by=distance).label("rank"),
+            )
+            .join(Segment, Segment.id == Embedding.segment_id)
+            .join(Document, Document.id == Segment.document_id)
+            .where(Document.course_id == course_id)
+            .order_by(distance)
+            .limit(num_candidates)
+            .cte("vector_ranked")
+        )
+
+        query = func.websearch_to_tsquery("english", prompt)
+        text_rank = func.ts_rank_cd(Segment.text_search, query)
+        lexical_ranked = (
+            select(
+                Segment.id.label("segment_id"),
+                func.row_number().over(order_by=text_rank.desc()).label("rank"),
+            )
+            .join(Document, Document.id == Segment.document_id)
+            .where(
+                Document.course_id == course_id,
+                Segment.text_search.bool_op("@@")(query),
+            )
+            .order_by(text_rank.desc())
+            .limit(num_candidates)
+            .cte("lexical_ranked")
+        )
+
+        fused = union_all(
+            select(
+                vector_ranked.c.segment_id,
+                (literal(1.0) / (RRF_K + vector_ranked.c.rank)).label("score"),
+            ),
+            select(
+                lexical_ranked.c.segment_id,
+                (literal(1.0) / (RRF_K + lexical_ranked.c.rank)).label("score"),
+            ),
+        ).subquery("fused")
+
+        return (  # type: ignore
+            select(Segment, Document.name, null().label("distance"))
+            .join(fused, fused.c.segment_id == Segment.id)
+            .join(Document, Document.id == Segment.document_id)
+            .group_by(Segment.id, Document.name)
+            .order_by(func.sum(fused.c.score).desc(), Segment.id)
+            .limit(num_segments)
+        )
+
 
 retriever = Retriever()
@@ -0,0 +1,298 @@
+"""An in-process vector index that answers nearest-neighbour queries without Postgres.
+
+Each course's embeddings are stored as a contiguous float32 matrix in a
+``.npy`` file beneath the file storage path. Every process memory-maps the
+file, so all workers share a single copy through the page cache.
+
+An index is written as an immutable generation and published by atomically
+replacing a ``CURRENT`` pointer, which also records the version of the
+course's documents that the generation reflects. Readers therefore never see
+a partially written index, and an index that has fallen behind the database
+is rebuilt from the database the next time it is searched.
+"""
+
+import fcntl
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Generator, Optional, Sequence, cast
+
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from wlu_chatbot.config import app_config
+from wlu_chatbot.db.models import get_engine, Course, Document, Segment, Embedding
+from wlu_chatbot.resources import get_resource
+
+INDEX_DIRECTORY = "_vector_index"
+"""The directory beneath the file storage path in which vector indexes are stored."""
+
+POINTER_FILE = "CURRENT"
+LOCK_FILE = "lock"
+VECTORS_FILE = "vectors.npy"
+SQUARED_NORMS_FILE = "squared_norms.npy"
+IDS_FILE = "ids.npy"
+
+
+@dataclass
+class _Pointer:
+    generation: str
+    documents_version: int
+
+
+@dataclass
+class _Generation:
+    generation: str
+    documents_version: int
+    vectors: npt.NDArray[np.float32]
+    """The embeddings of the segments, one per row."""
+    squared_norms: npt.NDArray[np.float32]
+    ids: npt.NDArray[np.int64]
+    """The segment id and document id of each row."""
+
+
+class VectorIndex:
+    """A per-course index of segment embeddings stored as memory-mapped NumPy arrays.
+
+    Queries are ranked by Euclidean distance, like the pgvector backend, and
+    are answered with a single matrix-vector product.
+    """
+
+    def __init__(self, root: Path):
+        self._root = root
+        self._loaded: dict[int, _Generation] = {}
+        self._lock = Lock()
+
+    def search(
+        self,
+        course_id: int,
+        documents_version: int,
+        prompt_embedding: Sequence[float],
+        num_segments: int,
+    ) -> list[tuple[int, float]]:
+        """Finds the segments whose embeddings are nearest to a prompt's embedding.
+
+        :param course_id: The course whose segments are searched.
+        :param documents_version: The version of the course's documents the index must reflect at least.
+        :param prompt_embedding: The embedding of the prompt.
+        :param num_segments: The number of segments to find.
+        :return: The ids of the nearest segments and their distances to the prompt, nearest first.
+        """
+        index = self._current(course_id, documents_version)
+        num_segments = min(num_segments, len(index.ids))
+        if num_segments <= 0:
+            return []
+
+        prompt = np.asarray(prompt_embedding, dtype=np.float32)
+        # The squared norm of the prompt is the same for every row, so it is
+        # only added for the nearest rows.
+        scores = index.squared_norms - 2 * (index.vectors @ prompt)
+        nearest = np.argpartition(scores, num_segments - 1)[:num_segments]
+        nearest = nearest[np.argsort(scores[nearest])]
+        distances = np.sqrt(np.maximum(scores[nearest] + prompt @ prompt, 0))
+        return [
+            (int(segment_id), float(distance))
+            for segment_id, distance in zip(index.ids[nearest, 0], distances)
+        ]
+
+    def add_document(
+        self,
+        course_id: int,
+        documents_version: int,
+        document_id: int,
+        segment_ids: Sequence[int],
+        vectors: Sequence[Sequence[float]],
+    ):
+        """Adds the segments of a newly uploaded document to a course's index.
+        Must be called after the upload is committed.
+
+        :param course_id: The course to which the document was uploaded.
+        :param documents_version: The version of the course's documents after the upload.
+        :param document_id: The uploaded document.
+        :param segment_ids: The ids of the document's segments.
+        :param vectors: The embeddings of the document's segments.
+        """
+        new_ids = np.array(
+            [(segment_id, document_id) for segment_id in segment_ids], dtype=np.int64
+        ).reshape(-1, 2)
+        new_vectors = _matrix(vectors)
+
+        with self._locked(course_id):
+            current = self._read_pointer(course_id)
+            if current is not None and current.documents_version >= documents_version:
+                return
+            if current is None or current.documents_version != documents_version - 1:
+                self._rebuild(course_id)
+                return
+
+            old = self._load(course_id, current)
+            # A document without segments only advances the index's version.
+            if len(new_ids) == 0:
+                ids, vectors_array = old.ids, old.vectors
+            elif len(old.ids) == 0:
+                ids, vectors_array = new_ids, new_vectors
+            else:
+                ids = np.concatenate([old.ids, new_ids])
+                vectors_array = np.concatenate([old.vectors, new_vectors])
+            self._publish(course_id, documents_version, ids, vectors_array)
+
+    def remove_document(self, course_id: int, documents_version: int, document_id: int):
+        """Removes the segments of a deleted document from a course's index.
+        Must be called after the deletion is committed.
+
+        :param course_id: The course from which the document was deleted.
+        :param documents_version: The version of the course's documents after the deletion.
+        :param document_id: The deleted document.
+        """
+        with self._locked(course_id):
+            current = self._read_pointer(course_id)
+            if current is not None and current.documents_version >= documents_version:
+                return
+            if current is None or current.documents_version != documents_version - 1:
+                self._rebuild(course_id)
+                return
+
+            old = self._load(course_id, current)
+            keep = old.ids[:, 1] != document_id
+            self._publish(
+                course_id, documents_version, old.ids[keep], old.vectors[keep]
+            )
+
+    def _current(self, course_id: int, documents_version: int) -> _Generation:
+        """Returns the loaded current generation of a course's index, rebuilding it if it is out of date."""
+        while True:
+            pointer = self._read_pointer(course_id)
+            if pointer is None or pointer.documents_version < documents_version:
+                with self._locked(course_id):
+                    pointer = self._read_pointer(course_id)
+                    if pointer is None or pointer.documents_version < documents_version:
+                        pointer = self._rebuild(course_id)
+
+            with self._lock:
+                loaded = self._loaded.get(course_id)
+            if loaded is not None and loaded.generation == pointer.generation:
+                return loaded
+
+            try:
+                loaded = self._load(course_id, pointer)
+            except FileNotFoundError:
+                # Usually a newer generation replaced this one while it was
+                # being read; otherwise the generation was lost and is rebuilt.
+                with self._locked(course_id):
+                    if self._read_pointer(course_id) == pointer:
+                        self._rebuild(course_id)
+                continue
+            with self._lock:
+                self._loaded[course_id] = loaded
+            return loaded
+
+    def _rebuild(self, course_id: int) -> _Pointer:
+        """Rebuilds a course's index from the database. Must be called while holding the course's lock."""
+        with Session(get_engine()) as session:
+            course = session.get(Course, course_id)
+            documents_version = (
+                0 if course is None else cast(int, course.documents_version)
+            )
+            rows = cast(
+                list[tuple[int, int, Sequence[float]]],
+                session.execute(
+                    select(  # type: ignore
+                        Embedding.segment_id, Segment.document_id, Embedding.vector
+                    )
+                    .join(Segment, Segment.id == Embedding.segment_id)
+                    .join(Document, Document.id == Segment.document_id)
+                    .where(Document.course_id == course_id)
+                    .order_by(Embedding.segment_id)
+                ).all(),
+            )
+
+        ids = np.array([(row[0], row[1]) for row in rows], dtype=np.int64).reshape(
+            -1, 2
+        )
+        vectors = _matrix([row[2] for row in rows])
+        return self._publish(course_id, documents_version, ids, vectors)
+
+    def _publish(
+        self,
+        course_id: int,
+        documents_version: int,
+        ids: npt.NDArray[np.int64],
+        vectors: npt.NDArray[np.float32],
+    ) -> _Pointer:
+        """Writes a new generation of a course's index and makes it current.
+        Must be called while holding the course's lock.
+        """
+        course_directory = self._course_directory(course_id)
+        pointer = _Pointer(uuid.uuid4().hex, documents_version)
+        directory = course_directory / pointer.generation
+        directory.mkdir(parents=True)
+
+        np.save(directory / VECTORS_FILE, vectors)
+        np.save(directory / SQUARED_NORMS_FILE, np.einsum("ij,ij->i", vectors, vectors))
+        np.save(directory / IDS_FILE, ids)
+
+        temporary = course_directory / f"{POINTER_FILE}.{pointer.generation}"
+        temporary.write_text(f"{pointer.generation} {pointer.documents_version}")
+        os.replace(temporary, course_directory / POINTER_FILE)
+
+        # Processes that still map an old generation keep reading it until
+        # they notice the new pointer, since unlinking does not unmap files.
+        for old in course_directory.iterdir():
+            if old.is_dir() and old.name != pointer.generation:
+                shutil.rmtree(old, ignore_errors=True)
+        return pointer
+
+    def _load(self, course_id: int, pointer: _Pointer) -> _Generation:
+        directory = self._course_directory(course_id) / pointer.generation
+        return _Generation(
+            generation=pointer.generation,
+            documents_version=pointer.documents_version,
+            vectors=np.load(directory / VECTORS_FILE, mmap_mode="r"),
+            squared_norms=np.load(directory / SQUARED_NORMS_FILE, mmap_mode="r"),
+            ids=np.load(directory / IDS_FILE),
+        )
+
+    def _read_pointer(self, course_id: int) -> Optional[_Pointer]:
+        try:
+            content = (self._course_directory(course_id) / POINTER_FILE).read_text()
+        except FileNotFoundError:
+            return None
+        generation, documents_version = content.split()
+        return _Pointer(generation, int(documents_version))
+
+    def _course_directory(self, course_id: int) -> Path:
+        return self._root / str(course_id)
+
+    @contextmanager
+    def _locked(self, course_id: int) -> Generator[None, None, None]:
+        """Holds an exclusive lock on a course's index that is shared by all processes."""
+        course_directory = self._course_directory(course_id)
+        course_directory.mkdir(parents=True, exist_ok=True)
+        with open(course_directory / LOCK_FILE, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _matrix(vectors: Sequence[Sequence[float]]) -> npt.NDArray[np.float32]:
+    """Stacks embeddings into a matrix with one per row. Without embeddings, the
+    matrix has no rows and no columns, since their dimensions are unknown."""
+    if len(vectors) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def get_vector_index() -> VectorIndex:
+    """Gets this process's vector index. Must be called from within an application context."""
+    return get_resource(
+        "vector_index",
+        lambda: VectorIndex(Path(app_config.FILE_STORAGE_PATH) / INDEX_DIRECTORY),
+    )
@@ -1,5 +1,5 @@
 "Functionality for embedding text as a vector"
 
-__all__ = ["embed_text"]
+__all__ = ["embed_text", "embed_texts", "compact_embedding", "normalize_rows"]
 
-from .embedding import embed_text
+from .embedding import embed_text, embed_texts, compact_embedding, normalize_rows
@@ -1,35 +1,90 @@
-from typing import Sequence
-from ollama import Client
+from typing import TYPE_CHECKING, Sequence
+import math
+
+import numpy as np
+import numpy.typing as npt
+
 from wlu_chatbot.config import app_config, LLMMode
-from flask import g
+from wlu_chatbot.resources import get_resource
+
+if TYPE_CHECKING:
+    from wlu_chatbot.api.ollama_pool import OllamaPool
+
+EMBEDDING_MODEL = "nomic-embed-text"
+
 
+def get_embedding_client() -> "OllamaPool | None":
+    """Gets the pool of Ollama servers that embed texts, which is shared by the threads of a process
+    and is separate from the servers that generate responses. Must be called from within an application context."""
+    match app_config.LLM_MODE:
+        case LLMMode.TESTING:
+            return None
+        case _:
+            return get_resource("embedding_client", _create_embedding_client)
 
-def get_embedding_client() -> Client | None:
-    """Gets the Ollama client instance. Must be called from within an request context."""
-    if g.get("_embedding_client") is None:
-        match app_config.LLM_MODE:
-            case LLMMode.TESTING:
-                return None
-            case _:
-                g._embedding_client = Client(host="http://host.docker.internal:11434")
-                return g._embedding_client
-    return g._embedding_client
+
+def _create_embedding_client() -> "OllamaPool":
+    # Imported on first use, so that processes that do not embed texts do not load ollama.
+    from wlu_chatbot.api.ollama_pool import OllamaPool
+
+    pool = OllamaPool(app_config.OLLAMA_EMBEDDING_URL)
+    pool.start_health_checks()
+    return pool
 
 
 def embed_text(text: str) -> Sequence[float]:
-    """Embeds a string of text into a vector representation.
+    """Embeds a string of text into a vector representation of unit length.
     Must be called from within a request context.
 
     :param text: The text to be embedded.
     :return: A list of floats representing the vector embedding.
     """
+    return embed_texts([text])[0]
+
+
+def embed_texts(texts: Sequence[str]) -> list[Sequence[float]]:
+    """Embeds several strings of text with a single request to the embedding model.
+    Must be called from within a request context.
+
+    The embeddings are scaled to unit length, as are all stored embeddings, so that
+    distances between them do not depend on how they were embedded.
+
+    :param texts: The texts to be embedded.
+    :return: The vector embeddings of the texts, in the same order.
+    """
+    if not texts:
+        return []
 
     client = get_embedding_client()
     if client is None:
-        return [0.1, 0.2, 0.3, 0.4, 0.5] * 20
+        return [[0.1, 0.2, 0.3, 0.4, 0.5] * 20 for _ in texts]
+
+    response = client.call(
+        lambda c: c.embed(
+            model=EMBEDDING_MODEL,
+            input=list(texts),
+            keep_alive=app_config.OLLAMA_KEEP_ALIVE,
+        )
+    )
+    return [list(embedding) for embedding in response["embeddings"]]
+
+
+def compact_embedding(embedding: Sequence[float], dimensions: int) -> list[float]:
+    """Truncates an embedding to its leading dimensions and rescales it to unit length.
+    nomic-embed-text is trained so that such a prefix remains a usable embedding.
+
+    :param embedding: The full embedding.
+    :param dimensions: The number of leading dimensions to keep.
+    :return: The compact embedding.
+    """
+    prefix = list(embedding[:dimensions])
+    norm = math.sqrt(sum(x * x for x in prefix))
+    if norm == 0:
+        return prefix
+    return [x / norm for x in prefix]
 
-    response = client.embeddings(model="nomic-embed-text", prompt=text)  # type: ignore
-    embedding = response["embedding"]
-    embed = list(embedding)
 
-    return embed
+def normalize_rows(vectors: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    """Scales each row of a matrix of embeddings to unit length, leaving rows of zeros as they are."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
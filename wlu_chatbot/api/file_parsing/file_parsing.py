@@ -2,14 +2,13 @@
 
 from io import BufferedIOBase
 from io import BytesIO
-import speech_recognition as sr
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
 import tempfile
 from typing import List, IO
-from pypdf import PdfReader
 from pathlib import Path
 
+# The libraries for audio and PDFs are imported by the parsers that use them,
+# since most processes never parse such files.
+
 
 class FileParsingError(ValueError):
     """File cannot be parsed."""
@@ -113,6 +112,10 @@ def _parse_audio(audio_file: str, time=None, segments=False) -> List[str]:
     :rtype: List[str] or str
     """
 
+    import speech_recognition as sr
+    from pydub import AudioSegment
+    from pydub.silence import split_on_silence
+
     current_directory = Path.cwd()
     transcript = ""
     l = []
@@ -209,6 +212,8 @@ def _parse_pdf(pdf_file: BufferedIOBase, chars_per_seg: int, overlap: int) -> li
     :param overlap: how many sentences should overlap per section
     :return: A list of segments of the textural representation of the pdf file.
     """
+    from pypdf import PdfReader
+
     reader = PdfReader(BytesIO(pdf_file.read()))
     all_text = []
     for page in reader.pages:
@@ -3,9 +3,8 @@ from pathlib import PurePath, Path
 from typing import IO
 import io
 
-from flask import g
-
 from wlu_chatbot.config import FileStorageMode, app_config
+from wlu_chatbot.resources import get_resource
 
 
 class StorageService(ABC):
@@ -81,9 +80,12 @@ class LocalStorage(StorageService):
 
 
 def get_storage_service() -> StorageService:
-    """Gets the storage service instance. Must be called from within a request context."""
-    if g.get("_storage_service") is None:
-        match app_config.FILE_STORAGE_MODE:
-            case FileStorageMode.LOCAL:
-                g._storage_service = LocalStorage(Path(app_config.FILE_STORAGE_PATH))
-    return g._storage_service
+    """Gets the storage service instance, which is shared by the threads of a process.
+    Must be called from within an application context."""
+    return get_resource("storage_service", _create_storage_service)
+
+
+def _create_storage_service() -> StorageService:
+    match app_config.FILE_STORAGE_MODE:
+        case FileStorageMode.LOCAL:
+            return LocalStorage(Path(app_config.FILE_STORAGE_PATH))
@@ -1,4 +1,17 @@
-from .response import get_language_model_client
+from .response import (
+    get_language_model_client,
+    get_admission_controller,
+    get_backend_metrics,
+)
 from .response import LanguageModelClient, ContentDict
+from .admission import Priority, OverloadedError
 
-__all__ = ["get_language_model_client", "LanguageModelClient", "ContentDict"]
+__all__ = [
+    "get_language_model_client",
+    "get_admission_controller",
+    "get_backend_metrics",
+    "LanguageModelClient",
+    "ContentDict",
+    "Priority",
+    "OverloadedError",
+]
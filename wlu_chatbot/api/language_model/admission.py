@@ -0,0 +1,281 @@
+"""Limits how many requests a process sends to the language model at once.
+
+Requests beyond the limit wait in a queue, from which the most urgent request
+is admitted first and requests of equal urgency are admitted in the order in
+which they arrived. The queue is bounded: when it is full, a request is
+refused at once unless a less urgent request is waiting, which is then shed
+in its place. A request that waits longer than the maximal wait is refused
+as well, so that callers can report that the model is busy rather than hang.
+
+The controller also chooses the rung of the model ladder on which a request is
+answered: requests less urgent than interactive ones always go one rung down,
+and every request goes one rung further down while the queue is deep or recent
+requests were slow, so that answers stay quick under load.
+"""
+
+import enum
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from threading import Condition
+from typing import Generator
+
+from pydantic import BaseModel as PydanticModel
+
+from wlu_chatbot.api.language_model.response import (
+    ContentDict,
+    LanguageModelClient,
+    ModelResponse,
+)
+
+
+class Priority(enum.IntEnum):
+    """How urgently a request to the language model is to be answered, most urgent first."""
+
+    INTERACTIVE = 0
+    """Answers for which a student is waiting."""
+    TITLE = 1
+    """Titles of conversations."""
+    SUMMARY = 2
+    """Summaries of conversations, for which an assistant is waiting."""
+    REPORT = 3
+    """Usage reports, which are generated in the background."""
+
+
+LATENCY_WINDOW = 100
+"""The number of recent requests from which the 95th percentile of their latency is computed."""
+
+
+class OverloadedError(RuntimeError):
+    """The language model is too busy to admit a request."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+        """The number of seconds after which a request is more likely to be admitted."""
+
+
+class AdmissionMetrics(PydanticModel):
+    """A snapshot of the state and history of an AdmissionController."""
+
+    max_concurrent: int
+    max_queue: int
+    in_flight: int
+    queued: dict[str, int]
+    """The number of waiting requests per priority."""
+    admitted: int
+    rejected: int
+    """The number of requests refused because the queue was full."""
+    shed: int
+    """The number of waiting requests dropped for more urgent ones."""
+    timed_out: int
+    mean_wait_seconds: float
+    """The mean time that admitted requests waited in the queue."""
+    p95_latency_seconds: float | None
+    """The 95th percentile of the time that recent requests ran, if any have finished."""
+    downgrading: bool
+    """Whether interactive requests are currently answered by a cheaper model."""
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: Priority
+    arrival: int
+    admitted: bool = field(default=False, compare=False)
+    shed: bool = field(default=False, compare=False)
+
+
+class AdmissionController:
+    """Admits requests to the language model by priority while at most a number of them run at once."""
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queue: int,
+        max_wait_seconds: float,
+        downgrade_queue_depth: int | None = None,
+        downgrade_p95_seconds: float | None = None,
+    ):
+        """
+        :param max_concurrent: The largest number of requests that run at once.
+        :param max_queue: The largest number of requests that wait to run.
+        :param max_wait_seconds: How long a request waits before it is refused.
+        :param downgrade_queue_depth: The number of waiting requests from which requests are answered by a cheaper model, or None to ignore the queue.
+        :param downgrade_p95_seconds: The 95th percentile of latency from which requests are answered by a cheaper model, or None to ignore latency.
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.downgrade_queue_depth = downgrade_queue_depth
+        self.downgrade_p95_seconds = downgrade_p95_seconds
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._condition = Condition()
+        self._queue: list[_Waiter] = []
+        self._arrivals = itertools.count()
+        self._in_flight = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._shed = 0
+        self._timed_out = 0
+        self._total_wait = 0.0
+
+    @contextmanager
+    def admit(self, priority: Priority) -> Generator[None]:
+        """Waits until a request may run and counts it as running until the context exits.
+
+        :raises OverloadedError: If the queue is full or the request waits too long.
+        """
+        self._acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._latencies.append(time.monotonic() - start)
+                self._in_flight -= 1
+                self._admit_waiters()
+
+    def rung(self, priority: Priority) -> int:
+        """Chooses how many rungs down the model ladder a request at a priority is answered."""
+        with self._condition:
+            return int(priority > Priority.INTERACTIVE) + int(self._overloaded())
+
+    def is_full(self, priority: Priority) -> bool:
+        """Whether a request at a priority would be refused at once, because the queue is full of requests at least as urgent."""
+        with self._condition:
+            if self._in_flight < self.max_concurrent and not self._queue:
+                return False
+            return len(self._queue) >= self.max_queue and all(
+                waiter.priority <= priority for waiter in self._queue
+            )
+
+    def metrics(self) -> AdmissionMetrics:
+        """Takes a snapshot of the controller's state and history."""
+        with self._condition:
+            queued = {p.name: 0 for p in Priority}
+            for waiter in self._queue:
+                queued[waiter.priority.name] += 1
+            return AdmissionMetrics(
+                max_concurrent=self.max_concurrent,
+                max_queue=self.max_queue,
+                in_flight=self._in_flight,
+                queued=queued,
+                admitted=self._admitted,
+                rejected=self._rejected,
+                shed=self._shed,
+                timed_out=self._timed_out,
+                mean_wait_seconds=self._total_wait / self._admitted
+                if self._admitted
+                else 0.0,
+                p95_latency_seconds=self._p95_latency(),
+                downgrading=self._overloaded(),
+            )
+
+    def _p95_latency(self) -> float | None:
+        """The 95th percentile of the latency of recent requests. Must hold the condition."""
+        if not self._latencies:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+    def _overloaded(self) -> bool:
+        """Whether the queue is deep or recent requests were slow. Must hold the condition."""
+        if (
+            self.downgrade_queue_depth is not None
+            and len(self._queue) >= self.downgrade_queue_depth
+        ):
+            return True
+        p95 = self._p95_latency()
+        return (
+            self.downgrade_p95_seconds is not None
+            and p95 is not None
+            and p95 >= self.downgrade_p95_seconds
+        )
+
+    def _acquire(self, priority: Priority):
+        start = time.monotonic()
+        with self._condition:
+            if self._in_flight < self.max_concurrent and not self._queue:
+                self._in_flight += 1
+                self._admitted += 1
+                return
+
+            if len(self._queue) >= self.max_queue:
+                least_urgent = max(self._queue)
+                if least_urgent.priority <= priority:
+                    self._rejected += 1
+                    raise OverloadedError(
+                        "The language model is too busy to accept more requests.",
+                        self.retry_after(),
+                    )
+                self._queue.remove(least_urgent)
+                heapq.heapify(self._queue)
+                least_urgent.shed = True
+                self._shed += 1
+
+            waiter = _Waiter(priority, next(self._arrivals))
+            heapq.heappush(self._queue, waiter)
+            self._condition.notify_all()
+            deadline = start + self.max_wait_seconds
+            while not waiter.admitted and not waiter.shed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            if waiter.admitted:
+                self._total_wait += time.monotonic() - start
+                return
+            if waiter.shed:
+                raise OverloadedError(
+                    "The request was dropped for more urgent requests to the language model.",
+                    self.retry_after(),
+                )
+            self._queue.remove(waiter)
+            heapq.heapify(self._queue)
+            self._timed_out += 1
+            raise OverloadedError(
+                "The request waited too long for the language model.",
+                self.retry_after(),
+            )
+
+    def _admit_waiters(self):
+        """Admits the most urgent waiters while capacity remains. Must hold the condition."""
+        while self._queue and self._in_flight < self.max_concurrent:
+            waiter = heapq.heappop(self._queue)
+            waiter.admitted = True
+            self._in_flight += 1
+            self._admitted += 1
+        self._condition.notify_all()
+
+    def retry_after(self) -> int:
+        """The number of seconds after which a refused request may be retried."""
+        return max(1, round(self.max_wait_seconds))
+
+
+class AdmittedClient(LanguageModelClient):
+    """A language model client whose requests pass through an AdmissionController at a priority,
+    which also chooses the rung of the model ladder that answers them."""
+
+    def __init__(
+        self,
+        client: LanguageModelClient,
+        controller: AdmissionController,
+        priority: Priority,
+    ):
+        self.client = client
+        self.controller = controller
+        self.priority = priority
+        self.context_window = client.context_window
+        self.token_estimator = client.token_estimator
+        self.models = client.models
+
+    def get_response(  # noqa: D102
+        self, contents: list[ContentDict], max_tokens: int = 3000, rung: int = 0
+    ) -> ModelResponse:
+        with self.controller.admit(self.priority):
+            rung = max(rung, self.controller.rung(self.priority))
+            return self.client.get_response(contents, max_tokens, rung)
@@ -0,0 +1,121 @@
+"""A language model client for the Gemini API."""
+
+import logging
+import time
+from datetime import timedelta
+from threading import Lock
+from typing import Any, Sequence
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+from wlu_chatbot.api.language_model.response import (
+    ContentDict,
+    LanguageModelClient,
+    ModelResponse,
+    TokenEstimator,
+    count_characters,
+    split_system_instruction,
+)
+
+logger = logging.getLogger(__name__)
+
+CACHE_MIN_TOKENS = 4096
+"""The fewest tokens of a system instruction that are stored as cached content. Gemini does not cache fewer."""
+
+CACHE_TTL = timedelta(hours=1)
+"""How long Gemini keeps cached content, which is created again once it has expired."""
+
+MAX_INSTRUCTIONS = 16
+"""The number of distinct system instructions per model whose models are kept."""
+
+
+class Gemini(LanguageModelClient):
+    """A class representation of the Gemini 2.5 Pro API."""
+
+    context_window = 1_048_576
+    token_estimator = TokenEstimator()
+
+    def __init__(
+        self,
+        key: str,
+        models: Sequence[str] = ("gemini-2.0-flash", "gemini-2.0-flash-lite"),
+        cache_instructions: bool = False,
+    ):
+        """
+        :param key: The API key for Gemini.
+        :param models: The ladder of models to use, from the most capable to the cheapest.
+        :param cache_instructions: Whether to store long system instructions as cached content,
+            so that Gemini does not process them again for every request.
+        """
+        if not key:
+            raise ValueError("A Gemini API key is required for production mode.")
+        if not models:
+            raise ValueError("At least one Gemini model is required.")
+        genai.configure(api_key=key)  # type: ignore
+        self.models = tuple(models)
+        self.cache_instructions = cache_instructions
+        self.temp = 1.0
+        self._models: dict[tuple[str, str | None], tuple[Any, float | None]] = {}
+        """The models by name and system instruction, with the monotonic time at which they expire, if they do."""
+        self._lock = Lock()
+
+    def get_response(  # noqa: D102
+        self, contents: list[ContentDict], max_tokens: int = 3000, rung: int = 0
+    ) -> ModelResponse:
+        config = {
+            "temperature": self.temp,
+            "max_output_tokens": max_tokens,
+        }
+        name = self.model_for(rung)
+        system, turns = split_system_instruction(contents)
+        model = self._model(name, system)
+        response = model.generate_content(turns, generation_config=config)
+        # The prompt token count includes the tokens of the system instruction,
+        # whether or not they were cached.
+        self.token_estimator.observe(
+            count_characters(contents),
+            response.usage_metadata.prompt_token_count,
+        )
+        return ModelResponse(
+            content=ContentDict(role="model", parts=[{"text": response.text}]),
+            model=name,
+        )
+
+    def _model(self, name: str, system: str | None) -> Any:
+        """Gets the model of a name with a system instruction, creating it if it does not exist or has expired."""
+        key = (name, system)
+        with self._lock:
+            entry = self._models.get(key)
+        if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+            return entry[0]
+
+        model, expires = self._create_model(name, system)
+        with self._lock:
+            if len(self._models) >= MAX_INSTRUCTIONS * len(self.models):
+                self._models.clear()
+            self._models[key] = (model, expires)
+        return model
+
+    def _create_model(self, name: str, system: str | None) -> tuple[Any, float | None]:
+        if (
+            system is None
+            or not self.cache_instructions
+            or self.count_tokens(system) < CACHE_MIN_TOKENS
+        ):
+            model = genai.GenerativeModel(name, system_instruction=system)  # type: ignore
+            return model, None
+
+        # Renewed shortly before Gemini deletes it, so that no request refers to deleted content.
+        expires = time.monotonic() + CACHE_TTL.total_seconds() - 60
+        try:
+            cached = caching.CachedContent.create(  # type: ignore
+                model=name, system_instruction=system, ttl=CACHE_TTL
+            )
+        except Exception as e:
+            # The instruction is sent with every request until caching is tried again.
+            logger.warning("Could not cache a system instruction for %s: %s", name, e)
+            model = genai.GenerativeModel(name, system_instruction=system)  # type: ignore
+            return model, expires
+        model = genai.GenerativeModel.from_cached_content(cached)  # type: ignore
+        return model, expires
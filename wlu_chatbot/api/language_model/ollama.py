@@ -0,0 +1,167 @@
+"""A language model client for a local Ollama server."""
+
+import logging
+from threading import Lock
+from typing import Sequence
+
+import ollama
+
+from wlu_chatbot.api.ollama_pool import OllamaPool
+from wlu_chatbot.resources import get_resource
+from wlu_chatbot.api.language_model.response import (
+    ContentDict,
+    LanguageModelClient,
+    ModelResponse,
+    TokenEstimator,
+)
+
+logger = logging.getLogger(__name__)
+
+SMALLEST_NUM_CTX = 2048
+"""The smallest context that is allocated for a request. Larger contexts double from it."""
+
+ANSWER_NUM_CTX = 4096
+"""The smallest context that is allocated for a request to a model, which holds the prompt
+and response of an ordinary answer, so that answers do not reload the model."""
+
+CONTEXT_WINDOW = 8192
+"""The number of tokens of context that are used with the models by default."""
+
+MESSAGE_OVERHEAD_TOKENS = 8
+"""The tokens that the chat template adds around each message."""
+
+
+def context_bucket(tokens: int, context_window: int) -> int:
+    """The smallest bucket of context that holds a number of tokens, doubling from SMALLEST_NUM_CTX up to the context window."""
+    bucket = SMALLEST_NUM_CTX
+    while bucket < tokens and bucket < context_window:
+        bucket *= 2
+    return min(bucket, context_window)
+
+
+class ContextSizer:
+    """Chooses the context size (num_ctx) of the requests to each model.
+
+    Ollama reloads a model whenever the context size of a request differs from
+    that with which the model was loaded, and each worker process, along with
+    its heartbeat, sizes its requests on its own. The size therefore starts at
+    ANSWER_NUM_CTX and only ever grows, to the bucket of the largest request so
+    far, so that all workers send the same size but for a moment after one of
+    them first needs a larger bucket.
+    """
+
+    def __init__(self, context_window: int):
+        self.context_window = context_window
+        self._starting_size = min(ANSWER_NUM_CTX, context_window)
+        self._sizes: dict[str, int] = {}
+        self._lock = Lock()
+
+    def size_for(self, model: str, tokens: int) -> int:
+        """Chooses the context size of a request to a model that needs a number of tokens, prompt and response together."""
+        needed = context_bucket(tokens, self.context_window)
+        with self._lock:
+            size = max(needed, self._sizes.get(model, self._starting_size))
+            self._sizes[model] = size
+            return size
+
+    def current_size(self, model: str) -> int:
+        """The context size with which requests to a model are sent, and so with which it stays loaded."""
+        with self._lock:
+            return self._sizes.get(model, self._starting_size)
+
+
+def get_context_sizer() -> ContextSizer:
+    """Gets the ContextSizer that this process's Ollama client shares with the warm-up of its models.
+    Must be called from within an application context."""
+    return get_resource("ollama_context_sizer", lambda: ContextSizer(CONTEXT_WINDOW))
+
+
+class Ollama(LanguageModelClient):
+    """A class representation for a local Ollama API."""
+
+    # Not calibrated, since Ollama's prompt_eval_count leaves out the prompt
+    # tokens that it reuses from its cache.
+    token_estimator = TokenEstimator()
+
+    def __init__(
+        self,
+        models: Sequence[str] = ("llama3.2:3B", "llama3.2:1B"),
+        hosts: Sequence[str] = ("http://localhost:11434",),
+        context_window: int = CONTEXT_WINDOW,
+        keep_alive: str | None = None,
+        context_sizer: ContextSizer | None = None,
+    ):
+        """Initializes the Ollama client with the specified models and hosts.
+        :param models: The ladder of Ollama models to use, from the most capable to the cheapest.
+        :param hosts: The URLs of the Ollama servers, among which requests are balanced.
+        :param context_window: The number of tokens of context that are to be used with the model.
+        :param keep_alive: How long Ollama keeps a model loaded after a request, such as "30m", or None for Ollama's default.
+        :param context_sizer: Chooses the context size of the requests. Defaults to one of the client's own.
+        :raises ConnectionError: If the Ollama client cannot connect to any of the hosts."""
+        if not models:
+            raise ValueError("At least one Ollama model is required.")
+        self.models = tuple(models)
+        self.context_window = context_window
+        self.keep_alive = keep_alive
+        self.context_sizer = context_sizer or ContextSizer(context_window)
+        self.temp = 0.7
+        self.pool = OllamaPool(hosts)
+        try:
+            self.pool.call(lambda client: client.list())
+        except Exception:
+            raise ConnectionError(
+                f"Could not connect to Ollama at {', '.join(hosts)}. Please ensure Ollama is running."
+            )
+        self.pool.start_health_checks()
+
+    def get_response(  # noqa: D102
+        self, contents: list[ContentDict], max_tokens: int = 3000, rung: int = 0
+    ) -> ModelResponse:
+        model = self.model_for(rung)
+        prompt_tokens = sum(
+            MESSAGE_OVERHEAD_TOKENS
+            + sum(self.count_tokens(part["text"]) for part in content["parts"])
+            for content in contents
+        )
+        if prompt_tokens + max_tokens > self.context_window:
+            logger.warning(
+                "A prompt of about %d tokens and %d response tokens exceed the context window of %d tokens, so Ollama truncates the prompt.",
+                prompt_tokens,
+                max_tokens,
+                self.context_window,
+            )
+        options = {
+            "temperature": self.temp,
+            "num_predict": max_tokens,
+            "num_ctx": self.context_sizer.size_for(model, prompt_tokens + max_tokens),
+        }
+
+        messages = list(map(self._convert_to_ollama_message, contents))
+        response = self.pool.call(
+            lambda client: client.chat(  # type: ignore[reportUnknownMemberType]
+                model=model,
+                messages=messages,
+                options=options,
+                stream=False,
+                keep_alive=self.keep_alive,
+            )
+        )
+        return ModelResponse(
+            content=ContentDict(
+                role="model", parts=[{"text": response.message.content or ""}]
+            ),
+            model=model,
+        )
+
+    def _convert_to_ollama_message(self, content: ContentDict) -> ollama.Message:
+        match content["role"]:
+            case "system":
+                role = "system"
+            case "user":
+                role = "user"
+            case "model":
+                role = "assistant"
+
+        assert len(content["parts"]) == 1
+
+        return ollama.Message(role=role, content=content["parts"][0]["text"])
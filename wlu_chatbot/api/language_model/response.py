@@ -1,13 +1,20 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
+import logging
+import math
 import typing as t
 
-import google.generativeai as genai
-import ollama
-from flask import g
+from wlu_chatbot.config import LLMMode, app_config
+from wlu_chatbot.resources import get_resource
 
+if t.TYPE_CHECKING:
+    from wlu_chatbot.api.language_model.admission import (
+        AdmissionController,
+        Priority,
+    )
+    from wlu_chatbot.api.language_model.routing import BackendMetrics
 
-from wlu_chatbot.config import LLMMode, app_config
+logger = logging.getLogger(__name__)
 
 
 class PartDict(t.TypedDict, total=True):
@@ -15,30 +22,97 @@ class PartDict(t.TypedDict, total=True):
 
 
 class ContentDict(t.TypedDict, total=True):
-    role: t.Literal["user", "model"]
+    role: t.Literal["system", "user", "model"]
+    """The author of the content. Only the first content may be a system instruction."""
     parts: list[PartDict]
 
 
+def split_system_instruction(
+    contents: list[ContentDict],
+) -> tuple[str | None, list[ContentDict]]:
+    """Splits the system instruction, if any, from the start of some contents.
+
+    :return: The text of the system instruction and the remaining contents.
+    """
+    if contents and contents[0]["role"] == "system":
+        return "\n".join(p["text"] for p in contents[0]["parts"]), contents[1:]
+    return None, contents
+
+
 @dataclass
 class ModelResponse:
     content: ContentDict
+    model: str | None = None
+    """The name of the model that generated the response."""
 
     def get_text(self) -> str:
         """The text body of this response."""
         return "\n".join([p["text"] for p in self.content["parts"]])
 
 
+CHARACTERS_PER_TOKEN = 4.0
+"""The number of characters per token assumed before an estimate has been calibrated."""
+
+
+class TokenEstimator:
+    """Estimates the number of tokens in a text from a ratio of characters per token,
+    which is calibrated against the prompt token counts reported by a backend.
+    """
+
+    def __init__(
+        self, characters_per_token: float = CHARACTERS_PER_TOKEN, smoothing: float = 0.1
+    ):
+        self.characters_per_token = characters_per_token
+        self._smoothing = smoothing
+
+    def estimate(self, text: str) -> int:
+        """Estimates the number of tokens in a text."""
+        return math.ceil(len(text) / self.characters_per_token)
+
+    def observe(self, characters: int, tokens: int):
+        """Moves the estimate toward an observed number of tokens for a number of characters."""
+        if characters <= 0 or tokens <= 0:
+            return
+        observed = characters / tokens
+        self.characters_per_token += self._smoothing * (
+            observed - self.characters_per_token
+        )
+
+
+def count_characters(contents: list[ContentDict]) -> int:
+    """Counts the characters of text in some contents."""
+    return sum(len(part["text"]) for content in contents for part in content["parts"])
+
+
 class LanguageModelClient(ABC):
     """An abstract base class for language model clients."""
 
+    context_window: int = 8192
+    """The maximal number of tokens, prompt and response together, that the model accepts."""
+
+    token_estimator = TokenEstimator()
+    """Estimates the number of tokens in texts for the model. Shared by all clients of a class in a process."""
+
+    models: t.Sequence[str] = ()
+    """The ladder of models that the client may use, from the most capable to the cheapest."""
+
+    def model_for(self, rung: int) -> str:
+        """The model a number of rungs down the ladder, or the cheapest model if the ladder is shorter."""
+        return self.models[min(rung, len(self.models) - 1)]
+
+    def count_tokens(self, text: str) -> int:
+        """Estimates the number of tokens into which the model splits a text."""
+        return self.token_estimator.estimate(text)
+
     @abstractmethod
     def get_response(
-        self, contents: list[ContentDict], max_tokens: int = 3000
+        self, contents: list[ContentDict], max_tokens: int = 3000, rung: int = 0
     ) -> ModelResponse:
         """Gets a single, complete response from the language model.
 
         :param prompt: The prompt to feed into the language model.
         :param max_tokens: The maximal number of tokens to generate.
+        :param rung: How many rungs down the model ladder to go for a cheaper, quicker model.
         :return: The completion from the language model.
         """
         pass
@@ -52,8 +126,11 @@ class TestingClient(LanguageModelClient):
     to it and returns formatted responses showing what was received.
     """
 
+    token_estimator = TokenEstimator()
+    models = ("testing", "testing-small")
+
     def get_response(  # noqa: D102
-        self, contents: list[ContentDict], max_tokens: int = 3000
+        self, contents: list[ContentDict], max_tokens: int = 3000, rung: int = 0
     ) -> ModelResponse:
         response_parts = [
             f"You passed in arguments: contents='{contents}', max_tokens={max_tokens}"
@@ -62,96 +139,108 @@ class TestingClient(LanguageModelClient):
         return ModelResponse(
             content=ContentDict(
                 role="model", parts=[{"text": " | ".join(response_parts)}]
-            )
+            ),
+            model=self.model_for(rung),
         )
 
 
-class Gemini(LanguageModelClient):
-    """A class representation of the Gemini 2.5 Pro API."""
+def get_language_model_client(
+    priority: "Priority | None" = None,
+) -> LanguageModelClient:
+    """Gets a language model client whose requests are admitted at a priority by the
+    process's AdmissionController. Must be called from within an application context.
 
-    def __init__(self, key: str):
-        if not key:
-            raise ValueError("A Gemini API key is required for production mode.")
-        genai.configure(api_key=key)  # type: ignore
-        self.model = genai.GenerativeModel(model_name="gemini-2.0-flash")  # type: ignore
-        self.temp = 1.0
+    :param priority: How urgently the client's requests are to be answered. Defaults to Priority.INTERACTIVE.
+    """
+    # Imported here, since the admission module builds on the classes of this one.
+    from wlu_chatbot.api.language_model.admission import AdmittedClient, Priority
 
-    def get_response(  # noqa: D102
-        self, contents: list[ContentDict], max_tokens: int = 3000
-    ) -> ModelResponse:
-        config = {
-            "temperature": self.temp,
-            "max_output_tokens": max_tokens,
-        }
-        response = self.model.generate_content(contents, generation_config=config)  # type: ignore
-        return ModelResponse(
-            content=ContentDict(role="model", parts=[{"text": response.text}])
-        )
+    client = get_resource("llm_client", _create_language_model_client)
+    return AdmittedClient(
+        client, get_admission_controller(), priority or Priority.INTERACTIVE
+    )
 
 
-class Ollama(LanguageModelClient):
-    """A class representation for a local Ollama API."""
+def get_admission_controller() -> "AdmissionController":
+    """Gets the AdmissionController that admits this process's requests to the language model.
+    Must be called from within an application context.
 
-    def __init__(
-        self, model: str = "llama3.2:3B", host: str = "http://localhost:11434"
-    ):
-        """Initializes the Ollama client with the specified model and host.
-        :param model: The name of the Ollama model to use.
-        :param host: The host URL for the Ollama API.
-        :raises ConnectionError: If the Ollama client cannot connect to the specified host."""
-        self.model = model
-        self.temp = 0.7
-        try:
-            self.client = ollama.Client(host=host)
-            self.client.list()
-        except Exception:
-            raise ConnectionError(
-                f"Could not connect to Ollama at {host}. Please ensure Ollama is running."
-            )
+    The configured limits hold for the whole server, so each of its worker
+    processes enforces its share of them, rounded up so that no worker is
+    left without a request to the language model.
+    """
+    from wlu_chatbot.api.language_model.admission import AdmissionController
 
-    def get_response(  # noqa: D102
-        self, contents: list[ContentDict], max_tokens: int = 3000
-    ) -> ModelResponse:
-        options = {
-            "temperature": self.temp,
-            "num_predict": max_tokens,
-        }
-
-        response = self.client.chat(  # type: ignore[reportUnknownMemberType]
-            model=self.model,
-            messages=list(map(self._convert_to_ollama_message, contents)),
-            options=options,
-            stream=False,
-        )
-        return ModelResponse(
-            content=ContentDict(
-                role="model", parts=[{"text": response.message.content or ""}]
-            )
-        )
+    def share(total: int) -> int:
+        return math.ceil(total / app_config.SERVER_WORKERS)
+
+    return get_resource(
+        "llm_admission",
+        lambda: AdmissionController(
+            max_concurrent=share(app_config.LLM_MAX_CONCURRENCY),
+            max_queue=share(app_config.LLM_MAX_QUEUE),
+            max_wait_seconds=app_config.LLM_MAX_WAIT_SECONDS,
+            downgrade_queue_depth=share(app_config.LLM_DOWNGRADE_QUEUE_DEPTH),
+            downgrade_p95_seconds=app_config.LLM_DOWNGRADE_P95_SECONDS,
+        ),
+    )
 
-    def _convert_to_ollama_message(self, content: ContentDict) -> ollama.Message:
-        match content["role"]:
-            case "user":
-                role = "user"
-            case "model":
-                role = "assistant"
 
-        assert len(content["parts"]) == 1
+def get_backend_metrics() -> "list[BackendMetrics]":
+    """Takes a snapshot of the state of each backend to which this process routes requests,
+    or an empty list if it uses a single backend. Must be called from within an application context."""
+    from wlu_chatbot.api.language_model.routing import RoutingClient
 
-        return ollama.Message(role=role, content=content["parts"][0]["text"])
+    client = get_resource("llm_client", _create_language_model_client)
+    if isinstance(client, RoutingClient):
+        return client.metrics()
+    return []
 
 
-def get_language_model_client() -> LanguageModelClient:
-    """Gets the language model client instance. Must be called from within a request context."""
-    if g.get("_llm_client") is None:
-        match app_config.LLM_MODE:
-            case LLMMode.TESTING:
-                g._llm_client = TestingClient()
-            case LLMMode.OLLAMA:
-                g._llm_client = Ollama(host=app_config.OLLAMA_URL)
-            case LLMMode.GEMINI:
-                if not app_config.GEMINI_API_KEY:
-                    raise ValueError("GEMINI_API_KEY environment variable not set.")
-                g._llm_client = Gemini(key=app_config.GEMINI_API_KEY)
+def _create_language_model_client() -> LanguageModelClient:
+    modes = [app_config.LLM_MODE, *app_config.LLM_FALLBACK_MODES]
+    if len(modes) == 1:
+        return _create_backend(modes[0])
 
-    return g._llm_client
+    from wlu_chatbot.api.language_model.routing import RoutingClient
+
+    backends: list[tuple[str, LanguageModelClient]] = []
+    for mode in modes:
+        try:
+            backends.append((mode.name.lower(), _create_backend(mode)))
+        except Exception:
+            # A backend that cannot be reached at startup is left out, so
+            # that the others can still answer requests.
+            logger.exception(
+                "Could not create the %s language model backend.", mode.name
+            )
+    if not backends:
+        raise ConnectionError("Could not create any language model backend.")
+    return RoutingClient(backends, latency_routing=app_config.LLM_LATENCY_ROUTING)
+
+
+def _create_backend(mode: LLMMode) -> LanguageModelClient:
+    match mode:
+        case LLMMode.TESTING:
+            return TestingClient()
+        # The backends' libraries are imported on first use, so that a process
+        # only loads the library of the backend that it is configured with.
+        case LLMMode.OLLAMA:
+            from wlu_chatbot.api.language_model.ollama import Ollama, get_context_sizer
+
+            return Ollama(
+                models=app_config.OLLAMA_MODELS,
+                hosts=app_config.OLLAMA_URL,
+                keep_alive=app_config.OLLAMA_KEEP_ALIVE,
+                context_sizer=get_context_sizer(),
+            )
+        case LLMMode.GEMINI:
+            from wlu_chatbot.api.language_model.gemini import Gemini
+
+            if not app_config.GEMINI_API_KEY:
+                raise ValueError("GEMINI_API_KEY environment variable not set.")
+            return Gemini(
+                key=app_config.GEMINI_API_KEY,
+                models=app_config.GEMINI_MODELS,
+                cache_instructions=app_config.GEMINI_CACHE_INSTRUCTIONS,
+            )
@@ -0,0 +1,246 @@
+"""Routes requests to the language model among several backends.
+
+Each backend keeps a rolling record of the latency and outcome of its recent
+requests and a circuit breaker. A backend whose requests fail several times in
+a row is taken out of rotation for a while; afterwards a single trial request
+decides whether it is taken back. A request that fails on one backend is
+retried on the next, so that a backend that is rate-limited or saturated does
+not fail the request.
+
+Requests go to the backends in the order in which they are configured, unless
+latency routing is enabled, in which case the first backend to try is chosen at
+random with a share of the traffic that grows with the backend's speed and
+shrinks with its error rate.
+"""
+
+import enum
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Sequence
+
+from pydantic import BaseModel as PydanticModel
+
+from wlu_chatbot.api.language_model.admission import OverloadedError
+from wlu_chatbot.api.language_model.response import (
+    ContentDict,
+    LanguageModelClient,
+    ModelResponse,
+)
+
+logger = logging.getLogger(__name__)
+
+ROLLING_WINDOW = 50
+"""The number of recent requests per backend from which latency and error rates are computed."""
+
+FAILURE_THRESHOLD = 3
+"""The number of consecutive failures after which a backend's circuit opens."""
+
+OPEN_SECONDS = 30.0
+"""How long a backend's circuit stays open before a trial request is let through."""
+
+
+class CircuitState(enum.Enum):
+    """Whether a backend receives requests."""
+
+    CLOSED = "closed"
+    """The backend receives requests."""
+    OPEN = "open"
+    """The backend failed recently and receives no requests."""
+    HALF_OPEN = "half_open"
+    """The backend may receive a trial request, which decides whether it is closed again."""
+
+
+class BackendMetrics(PydanticModel):
+    """A snapshot of the state and recent history of a backend of a RoutingClient."""
+
+    name: str
+    state: str
+    requests: int
+    """The number of requests in the rolling window."""
+    error_rate: float
+    mean_latency_seconds: float | None
+    """The mean latency of the successful requests in the rolling window, if there are any."""
+
+
+@dataclass
+class _Backend:
+    name: str
+    client: LanguageModelClient
+    outcomes: deque[tuple[float, bool]] = field(
+        default_factory=lambda: deque(maxlen=ROLLING_WINDOW)
+    )
+    """The latency and success of recent requests."""
+    failures: int = 0
+    """The number of consecutive failed requests."""
+    opened_at: float | None = None
+    """The monotonic time at which the circuit opened, if it is open or half-open."""
+    trial_running: bool = False
+
+    def state(self, now: float, open_seconds: float) -> CircuitState:
+        if self.opened_at is None:
+            return CircuitState.CLOSED
+        if now - self.opened_at < open_seconds:
+            return CircuitState.OPEN
+        return CircuitState.HALF_OPEN
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(not ok for _, ok in self.outcomes) / len(self.outcomes)
+
+    def mean_latency(self) -> float | None:
+        latencies = [seconds for seconds, ok in self.outcomes if ok]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+
+class RoutingClient(LanguageModelClient):
+    """A language model client that sends each request to one of several backends and fails over between them."""
+
+    def __init__(
+        self,
+        backends: Sequence[tuple[str, LanguageModelClient]],
+        latency_routing: bool = False,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        open_seconds: float = OPEN_SECONDS,
+        rng: random.Random | None = None,
+    ):
+        """
+        :param backends: The names and clients of the backends, in order of preference.
+        :param latency_routing: Whether to spread requests among healthy backends by their speed rather than by preference.
+        :param failure_threshold: The number of consecutive failures after which a backend's circuit opens.
+        :param open_seconds: How long a backend's circuit stays open before a trial request is let through.
+        :param rng: The source of the random choices of latency routing.
+        """
+        if not backends:
+            raise ValueError("A routing client needs at least one backend.")
+        self.backends = [_Backend(name, client) for name, client in backends]
+        self.latency_routing = latency_routing
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._rng = rng or random.Random()
+        self._lock = Lock()
+        # Prompts are sized for the backend with the smallest context window,
+        # so that they fit whichever backend answers them.
+        smallest = min(
+            (b.client for b in self.backends), key=lambda c: c.context_window
+        )
+        self.context_window = smallest.context_window
+        self.token_estimator = smallest.token_estimator
+        self.models = self.backends[0].client.models
+
+    def get_response(  # noqa: D102
+        self, contents: list[ContentDict], max_tokens: int = 3000, rung: int = 0
+    ) -> ModelResponse:
+        error: Exception | None = None
+        for backend in self._order():
+            if not self._claim(backend):
+                continue
+            start = time.monotonic()
+            try:
+                response = backend.client.get_response(contents, max_tokens, rung)
+            except Exception as e:
+                self._record(backend, time.monotonic() - start, False)
+                logger.warning("Language model backend %s failed: %s", backend.name, e)
+                error = e
+                continue
+            self._record(backend, time.monotonic() - start, True)
+            return response
+
+        if error is not None:
+            raise error
+        raise OverloadedError(
+            "No language model backend is available.", self._retry_after()
+        )
+
+    def metrics(self) -> list[BackendMetrics]:
+        """Takes a snapshot of the state and recent history of every backend."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                BackendMetrics(
+                    name=b.name,
+                    state=b.state(now, self.open_seconds).value,
+                    requests=len(b.outcomes),
+                    error_rate=b.error_rate(),
+                    mean_latency_seconds=b.mean_latency(),
+                )
+                for b in self.backends
+            ]
+
+    def _order(self) -> list[_Backend]:
+        """Orders the backends in which a request is to be tried."""
+        now = time.monotonic()
+        with self._lock:
+            states = {id(b): b.state(now, self.open_seconds) for b in self.backends}
+            # A backend waiting for a trial is tried first, so that it is not
+            # kept out of rotation only because the others are healthy.
+            trials = [
+                b for b in self.backends if states[id(b)] == CircuitState.HALF_OPEN
+            ]
+            closed = [b for b in self.backends if states[id(b)] == CircuitState.CLOSED]
+            if self.latency_routing and len(closed) > 1:
+                first = self._rng.choices(closed, weights=self._weights(closed))[0]
+                closed.remove(first)
+                closed.insert(0, first)
+            return trials + closed
+
+    def _weights(self, backends: list[_Backend]) -> list[float]:
+        """Weighs backends by their speed and success. Backends without a record count as fast as the fastest."""
+        latencies = [b.mean_latency() for b in backends]
+        known = [latency for latency in latencies if latency is not None]
+        fastest = min(known) if known else 1.0
+        return [
+            (1.0 - b.error_rate()) / max(latency or fastest, 1e-3) + 1e-6
+            for b, latency in zip(backends, latencies)
+        ]
+
+    def _claim(self, backend: _Backend) -> bool:
+        """Whether a request may be sent to a backend, claiming its trial if its circuit is half-open."""
+        with self._lock:
+            state = backend.state(time.monotonic(), self.open_seconds)
+            if state == CircuitState.CLOSED:
+                return True
+            if state == CircuitState.HALF_OPEN and not backend.trial_running:
+                backend.trial_running = True
+                return True
+            return False
+
+    def _record(self, backend: _Backend, seconds: float, ok: bool):
+        with self._lock:
+            backend.outcomes.append((seconds, ok))
+            backend.trial_running = False
+            if ok:
+                if backend.opened_at is not None:
+                    logger.info("Language model backend %s recovered.", backend.name)
+                backend.failures = 0
+                backend.opened_at = None
+                return
+            backend.failures += 1
+            if (
+                backend.opened_at is not None
+                or backend.failures >= self.failure_threshold
+            ):
+                if backend.opened_at is None:
+                    logger.warning(
+                        "Opening the circuit of language model backend %s after %d failures.",
+                        backend.name,
+                        backend.failures,
+                    )
+                backend.opened_at = time.monotonic()
+
+    def _retry_after(self) -> int:
+        """The number of seconds until the first circuit lets a trial request through."""
+        now = time.monotonic()
+        with self._lock:
+            remaining = [
+                self.open_seconds - (now - b.opened_at)
+                for b in self.backends
+                if b.opened_at is not None
+            ]
+        return max(1, round(min(remaining, default=1)))
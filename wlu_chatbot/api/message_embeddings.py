@@ -0,0 +1,100 @@
+"""Stores the embeddings of student messages, so that no message is embedded twice.
+
+A message is embedded when segments are retrieved for it or when a usage
+report groups it into topics, and older messages are embedded in batches by
+the ``embed-messages`` command of the database CLI.
+Embeddings are stored at unit length, whether they were embedded one at a time
+or in batches, like the embeddings of segments, so that they can be used as
+the embeddings of prompts in searches for segments.
+"""
+
+from typing import Optional, Sequence, cast
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from wlu_chatbot.db.models import get_engine, MessageEmbedding
+from wlu_chatbot.api.embedding import embed_text, embed_texts
+
+EMBEDDING_BATCH_SIZE = 100
+"""The number of messages embedded per request to the embedding model."""
+
+
+def get_message_embedding(message_id: int) -> Optional[list[float]]:
+    """Returns the stored embedding of a message, or None if it has not been embedded."""
+    with Session(get_engine()) as session:
+        return _stored_embeddings(session, [message_id]).get(message_id)
+
+
+def embed_message(message_id: int, body: str) -> Sequence[float]:
+    """Returns the embedding of a message, embedding and storing it if it has not been embedded.
+    Must be called from within a request context.
+
+    :param message_id: The message.
+    :param body: The body of the message.
+    :return: The embedding of the message.
+    """
+    stored = get_message_embedding(message_id)
+    if stored is not None:
+        return stored
+
+    vector = embed_text(body)
+    with Session(get_engine()) as session:
+        return _store(session, {message_id: vector})[message_id]
+
+
+def get_message_embeddings(
+    messages: Sequence[tuple[int, str]],
+) -> list[Sequence[float]]:
+    """Returns the embeddings of several messages, embedding and storing those that have not been embedded
+    in batches. Must be called from within a request context.
+
+    :param messages: The id and body of each message.
+    :return: The embeddings of the messages, in the same order.
+    """
+    with Session(get_engine()) as session:
+        stored = _stored_embeddings(session, [id for id, _ in messages])
+
+        missing = [(id, body) for id, body in messages if id not in stored]
+        for start in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+            batch = missing[start : start + EMBEDDING_BATCH_SIZE]
+            vectors = embed_texts([body for _, body in batch])
+            stored.update(
+                _store(session, {id: vector for (id, _), vector in zip(batch, vectors)})
+            )
+
+    return [stored[id] for id, _ in messages]
+
+
+def _stored_embeddings(
+    session: Session, message_ids: Sequence[int]
+) -> dict[int, list[float]]:
+    """Reads the stored embeddings of those of the given messages that have been embedded."""
+    rows = cast(
+        list[tuple[int, Sequence[float]]],
+        session.execute(
+            select(MessageEmbedding.message_id, MessageEmbedding.vector).where(  # type: ignore
+                MessageEmbedding.message_id.in_(message_ids)
+            )
+        ).all(),
+    )
+    return {id: list(vector) for id, vector in rows}
+
+
+def _store(
+    session: Session, vectors: dict[int, Sequence[float]]
+) -> dict[int, list[float]]:
+    """Stores the embeddings of messages and commits them. A message that was embedded
+    meanwhile, e.g. by the preparation of its retrieval while a response to it was
+    being generated, keeps the embedding that was stored first.
+
+    :return: The stored embeddings of the messages.
+    """
+    session.execute(
+        insert(MessageEmbedding)
+        .values([{"message_id": id, "vector": v} for id, v in vectors.items()])
+        .on_conflict_do_nothing(index_elements=[MessageEmbedding.message_id])
+    )
+    session.commit()
+    return _stored_embeddings(session, list(vectors))
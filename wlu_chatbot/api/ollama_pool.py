@@ -0,0 +1,190 @@
+"""Spreads requests to Ollama across several hosts.
+
+Each request goes to the healthy host with the fewest requests outstanding
+from this process. A host that fails several requests in a row is ejected
+for a while; once its ejection ends, a health check must succeed before it
+receives requests again. A request that fails because its host could not be
+reached is retried on another host.
+
+This module imports ollama, so it is itself imported only where Ollama is used.
+"""
+
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+from threading import Event, Lock, Thread
+from typing import Callable, Sequence
+
+import httpx
+import ollama
+
+logger = logging.getLogger(__name__)
+
+MAX_FAILURES = 3
+"""The number of consecutive failures after which a host is ejected."""
+
+EJECTION_SECONDS = 30.0
+"""How long an ejected host receives no requests before it is checked again."""
+
+HEALTH_CHECK_SECONDS = 10.0
+"""How often ejected hosts are checked in the background."""
+
+
+def is_host_failure(error: Exception) -> bool:
+    """Whether an error of a request says that its host, rather than the request, is at fault."""
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+
+@dataclass
+class OllamaHost:
+    """A host in an OllamaPool and the record of its recent requests."""
+
+    url: str
+    client: ollama.Client
+    outstanding: int = 0
+    failures: int = 0
+    """The number of consecutive requests that failed."""
+    ejected_until: float = 0.0
+    """The monotonic time until which the host receives no requests."""
+    checked: bool = True
+    """Whether the host has passed a health check since it was last ejected."""
+    served: int = 0
+    """The number of requests that the host answered."""
+
+    def available(self, now: float) -> bool:
+        """Whether the host may receive requests."""
+        return self.checked and self.ejected_until <= now
+
+
+class OllamaPool:
+    """A pool of Ollama hosts among which requests are balanced."""
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        timeout: float | None = None,
+        max_failures: int = MAX_FAILURES,
+        ejection_seconds: float = EJECTION_SECONDS,
+        client_factory: Callable[[str], ollama.Client] | None = None,
+    ):
+        """
+        :param urls: The URLs of the hosts.
+        :param timeout: The seconds after which a request to a host is abandoned, or None to wait indefinitely.
+        :param max_failures: The number of consecutive failures after which a host is ejected.
+        :param ejection_seconds: How long an ejected host receives no requests before it is checked again.
+        :param client_factory: Creates the client of a host from its URL. Defaults to an ollama.Client.
+        """
+        if not urls:
+            raise ValueError("An Ollama pool needs at least one host.")
+
+        def create(url: str) -> ollama.Client:
+            if client_factory is not None:
+                return client_factory(url)
+            return ollama.Client(host=url, timeout=timeout)
+
+        self.hosts = [OllamaHost(url, create(url)) for url in urls]
+        self.max_failures = max_failures
+        self.ejection_seconds = ejection_seconds
+        self._lock = Lock()
+        self._turns = itertools.count()
+        self._stop_checks = Event()
+
+    def call[T](self, request: Callable[[ollama.Client], T]) -> T:
+        """Makes a request of the least busy healthy host, retrying on other hosts if hosts cannot be reached.
+
+        :param request: Makes the request with the client of a host.
+        :raises: The error of the last attempt, if no host succeeds.
+        """
+        tried: set[str] = set()
+        while True:
+            host = self._acquire(tried)
+            tried.add(host.url)
+            try:
+                result = request(host.client)
+            except Exception as error:
+                failed = is_host_failure(error)
+                self._release(host, failed)
+                if failed and len(tried) < len(self.hosts):
+                    logger.warning("Ollama at %s failed; retrying elsewhere.", host.url)
+                    continue
+                raise
+            self._release(host, False)
+            return result
+
+    def check_health(self) -> int:
+        """Checks every host that is not known to be healthy, restoring those that respond.
+
+        :return: The number of hosts that may receive requests afterwards.
+        """
+        now = time.monotonic()
+        for host in self.hosts:
+            with self._lock:
+                due = not host.available(now) and host.ejected_until <= now
+            if not due:
+                continue
+            try:
+                host.client.list()
+            except Exception:
+                with self._lock:
+                    host.ejected_until = time.monotonic() + self.ejection_seconds
+                continue
+            with self._lock:
+                host.checked = True
+                host.failures = 0
+                logger.info("Ollama at %s is healthy again.", host.url)
+        now = time.monotonic()
+        with self._lock:
+            return sum(host.available(now) for host in self.hosts)
+
+    def start_health_checks(self, interval: float = HEALTH_CHECK_SECONDS):
+        """Checks ejected hosts in a background thread until stop_health_checks is called."""
+
+        def run():
+            while not self._stop_checks.wait(interval):
+                self.check_health()
+
+        Thread(target=run, name="ollama-health", daemon=True).start()
+
+    def stop_health_checks(self):
+        """Stops the background health checks."""
+        self._stop_checks.set()
+
+    def _acquire(self, tried: set[str]) -> OllamaHost:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [h for h in self.hosts if h.url not in tried] or self.hosts
+            available = [h for h in candidates if h.available(now)]
+            if available:
+                # Ties are broken in turn, so that idle hosts share the requests.
+                turn = next(self._turns)
+                host = min(
+                    available,
+                    key=lambda h: (
+                        h.outstanding,
+                        (self.hosts.index(h) - turn) % len(self.hosts),
+                    ),
+                )
+            else:
+                # Every host is ejected, so the one whose ejection ends first is tried.
+                host = min(candidates, key=lambda h: h.ejected_until)
+            host.outstanding += 1
+            return host
+
+    def _release(self, host: OllamaHost, failed: bool):
+        with self._lock:
+            host.outstanding -= 1
+            if not failed:
+                host.failures = 0
+                host.served += 1
+                host.checked = True
+                return
+            host.failures += 1
+            if host.failures >= self.max_failures and host.available(time.monotonic()):
+                logger.warning(
+                    "Ejecting Ollama at %s after %d failures.", host.url, host.failures
+                )
+                host.ejected_until = time.monotonic() + self.ejection_seconds
+                host.checked = False
@@ -0,0 +1,137 @@
+"""Keeps the Ollama models loaded, so that students do not wait for a model to load.
+
+Ollama unloads a model once it has not been used for the keep-alive duration
+of its last request, and loading it again delays the next request by seconds.
+The served application therefore loads the chat and embedding models on every
+Ollama host when it starts, and a heartbeat in each worker loads them again
+during the warm hours before their keep-alive runs out.
+
+A request to load a model that is already loaded returns at once and only
+renews its keep-alive, so the heartbeat costs the hosts next to nothing. It
+must ask for the context size of the requests to the model, though, since
+Ollama reloads a model for a request of another context size.
+"""
+
+import logging
+from datetime import datetime, time
+from threading import Thread
+from time import sleep
+
+from flask import Flask
+
+from wlu_chatbot.api.embedding.embedding import EMBEDDING_MODEL
+from wlu_chatbot.config import LLMMode, app_config
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_TIMEOUT = 120.0
+"""The seconds after which loading a model on a host is abandoned."""
+
+
+def parse_warm_hours(hours: str) -> tuple[time, time] | bool:
+    """Parses warm hours such as "08:00-22:00", which may wrap past midnight.
+
+    :return: The start and end of the hours, or whether it is always warm for "always" and "never".
+    :raises ValueError: If the hours are malformed.
+    """
+    match hours.strip().lower():
+        case "always":
+            return True
+        case "never":
+            return False
+        case span:
+            try:
+                start, end = span.split("-")
+                return time.fromisoformat(start.strip()), time.fromisoformat(
+                    end.strip()
+                )
+            except ValueError:
+                raise ValueError(
+                    f"Invalid warm hours '{hours}', expected e.g. '08:00-22:00', 'always' or 'never'."
+                )
+
+
+def is_warm_time(hours: str, now: datetime) -> bool:
+    """Whether a time falls within warm hours."""
+    parsed = parse_warm_hours(hours)
+    if isinstance(parsed, bool):
+        return parsed
+    start, end = parsed
+    current = now.time()
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def warm_up_models() -> int:
+    """Loads the chat models and the embedding model on every Ollama host that serves them.
+    Failures are logged rather than raised. Must be called from within an application context.
+
+    :return: The number of models loaded.
+    """
+    modes = [app_config.LLM_MODE, *app_config.LLM_FALLBACK_MODES]
+    targets: list[tuple[str, str, bool]] = []
+    if LLMMode.OLLAMA in modes:
+        targets += [
+            (url, model, False)
+            for url in app_config.OLLAMA_URL
+            for model in app_config.OLLAMA_MODELS
+        ]
+    if app_config.LLM_MODE != LLMMode.TESTING:
+        targets += [
+            (url, EMBEDDING_MODEL, True) for url in app_config.OLLAMA_EMBEDDING_URL
+        ]
+    if not targets:
+        return 0
+
+    # Imported here, so that processes that do not use Ollama do not load it.
+    import ollama
+
+    from wlu_chatbot.api.language_model.ollama import get_context_sizer
+
+    context_sizer = get_context_sizer()
+    keep_alive = app_config.OLLAMA_KEEP_ALIVE
+    loaded = 0
+    for url, model, embedding in targets:
+        client = ollama.Client(host=url, timeout=WARM_UP_TIMEOUT)
+        try:
+            if embedding:
+                client.embed(model=model, input="", keep_alive=keep_alive)
+            else:
+                # A request without a prompt loads the model without generating.
+                client.generate(
+                    model=model,
+                    keep_alive=keep_alive,
+                    options={"num_ctx": context_sizer.current_size(model)},
+                )
+        except Exception as e:
+            logger.warning("Could not load %s on Ollama at %s: %s", model, url, e)
+            continue
+        loaded += 1
+    return loaded
+
+
+def start_heartbeat(app: Flask) -> Thread | None:
+    """Starts a daemon thread that loads the Ollama models again during the warm hours.
+
+    :return: The thread, or None if the application does not use Ollama.
+    """
+    with app.app_context():
+        if app_config.LLM_MODE == LLMMode.TESTING:
+            return None
+        hours = app_config.OLLAMA_WARM_HOURS
+        interval = app_config.OLLAMA_HEARTBEAT_SECONDS
+    # Malformed hours are reported when the worker starts rather than in the thread.
+    parse_warm_hours(hours)
+
+    def run():
+        while True:
+            sleep(interval)
+            if not is_warm_time(hours, datetime.now()):
+                continue
+            with app.app_context():
+                warm_up_models()
+
+    thread = Thread(target=run, name="ollama-heartbeat", daemon=True)
+    thread.start()
+    return thread
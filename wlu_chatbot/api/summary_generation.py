@@ -5,8 +5,15 @@ from flask import (
 from sqlalchemy import select, func
 
 from datetime import datetime
-from wlu_chatbot.api.language_model import get_language_model_client
-from typing import List, Optional
+from wlu_chatbot.api.language_model import (
+    get_language_model_client,
+    LanguageModelClient,
+    Priority,
+)
+from wlu_chatbot.api.message_embeddings import get_message_embeddings
+from wlu_chatbot.config import app_config
+from wlu_chatbot.api.topic_clustering import find_topics, Topic
+from typing import List, Optional, Sequence, cast
 
 
 from wlu_chatbot.db.models import (
@@ -15,11 +22,28 @@ from wlu_chatbot.db.models import (
     Message,
     Conversation,
     MessageType,
+    ConversationState,
 )
 
 
 bp = Blueprint("web_routes", __name__)
 
+LABEL_PROMPT = """This is a question that a student asked an AI chatbot tutor for a {subject} course. It is typical of many similar questions.
+Reply with a short label of at most six words for the topic of the question, and nothing else.
+
+{question}"""
+
+LABEL_MAX_TOKENS = 20
+
+CONVERSATION_SUMMARY_MAX_TOKENS = 600
+"""The largest number of tokens in a summary of a conversation for an assistant."""
+
+REPORT_MAX_TOKENS = 1500
+"""The largest number of tokens in the generated part of a usage report."""
+
+TREND_RATIO = 1.5
+"""How many times more frequent a topic must become between the halves of a period to be rising, or less frequent to be falling."""
+
 
 def generate_conversation_summary(
     conversation_id: int,
@@ -57,8 +81,9 @@ def generate_conversation_summary(
         total_messages_txt = "\n".join(total_messages)
 
         prompt = prompt + total_messages_txt
-        response = get_language_model_client().get_response(
-            [{"role": "user", "parts": [{"text": prompt}]}]
+        response = get_language_model_client(Priority.SUMMARY).get_response(
+            [{"role": "user", "parts": [{"text": prompt}]}],
+            max_tokens=CONVERSATION_SUMMARY_MAX_TOKENS,
         )
 
         return response.get_text()
@@ -73,67 +98,71 @@ def generate_usage_summary(
     """Generates a summary of all student-chatbot interactions that occurred between a start and end time."""
 
     with Session(get_engine()) as session:
-        stmt = (
-            select(func.count(func.distinct(Message.written_by)))
-            .join(Conversation, Message.conversation_id == Conversation.id)
-            .where(Conversation.course_id == course_id)
-        )
-
+        conditions = [Conversation.course_id == course_id]
         if time_start:
-            stmt = stmt.where(Message.timestamp > time_start)
+            conditions.append(Message.timestamp > time_start)
         if time_end:
-            stmt = stmt.where(Message.timestamp < time_end)
+            conditions.append(Message.timestamp < time_end)
 
-        student_count = session.execute(stmt).scalar_one()
-
-        stmt = (
-            select(func.count(func.distinct(Message.conversation_id)))
+        student_count, conv_count = session.execute(
+            select(
+                func.count(func.distinct(Message.written_by)),
+                func.count(func.distinct(Message.conversation_id)),
+            )
             .join(Conversation, Message.conversation_id == Conversation.id)
-            .where(Conversation.course_id == course_id)
+            .where(*conditions)
+        ).one()
+
+        questions = cast(
+            list[tuple[int, str, datetime, ConversationState]],
+            session.execute(
+                select(Message.id, Message.body, Message.timestamp, Conversation.state)  # type: ignore
+                .join(Conversation, Message.conversation_id == Conversation.id)
+                .where(*conditions, Message.type == MessageType.STUDENT_MESSAGE)
+                .order_by(Message.timestamp)
+            ).all(),
         )
 
-        if time_start:
-            stmt = stmt.where(Message.timestamp > time_start)
-        if time_end:
-            stmt = stmt.where(Message.timestamp < time_end)
-
-        conv_count = session.execute(stmt).scalar_one()
-
-        stmt = (
-            select(func.distinct(Message.conversation_id))
-            .join(Conversation, Message.conversation_id == Conversation.id)
-            .where(Conversation.course_id == course_id)
+    topics = find_topics(
+        get_message_embeddings([(id, body) for id, body, _, _ in questions]),
+        later=_in_later_half([timestamp for _, _, timestamp, _ in questions]),
+        redirected=[state != ConversationState.CHATBOT for *_, state in questions],
+    )
+    client = get_language_model_client(Priority.REPORT)
+    labels = [label_topic(client, questions[t.representative][1]) for t in topics]
+    topics_txt = "\n".join(
+        _describe_topic(
+            topic, label, questions[topic.representative][1], len(questions)
         )
-        if time_start:
-            stmt = stmt.where(Message.timestamp > time_start)
-        if time_end:
-            stmt = stmt.where(Message.timestamp < time_end)
-
-        conversation_ids = session.execute(stmt).scalars().all()
-
-        total_messages: List[str] = []
-        prompt = """These are all of the messages within one conversation between a student and a AI chatbot tutor. Create a summary of this conversation, including topics discussed and student performance.
-        Also include a section for specific topics being discussed where students talked to a human assistant. Messages labeled 'AssistantMessage' represent human assistants"""
-        for conv_id in conversation_ids:
-            total_messages.append(
-                generate_conversation_summary(conv_id, prompt, time_start, time_end)
-            )
-
-        total_messages_txt = "\n".join(total_messages)
+        for topic, label in zip(topics, labels)
+    )
 
-    prompt = f"""These are all of the messages that students have been having with a AI chatbot for help with a computer science course. 
+    prompt = f"""These are the topics of the questions that students have asked an AI chatbot for help with a {app_config.COURSE_SUBJECT} course, found by grouping similar questions.
+                Each topic has its share of all questions, how its frequency changed between the earlier and later halves of the period, the share of its questions in conversations that were redirected to a human assistant, and an example question.
                 Generate a report for this course's instructor summarising students\' interactions with the chatbot, highlighting common questions and students\' strengths and weaknesses
-                Here are the all student chatbot messages \n{total_messages_txt}
+                Here are the topics \n{topics_txt}
                 Do not include any information of chatbot performance, or include recommendations for the professor
-                Do not focus too much on specific/invidual interactions between a student and the chatbot. 
-                Focus more higher level, what topics are being discussed and with what frequency, which topics are students struggling at, how are they struggling.
+                Focus on what topics are being discussed and with what frequency, which topics are students struggling at, how are they struggling.
                 Do not include a title for the report.
                 Also include a section for specific topics where students needed help and required talking to a human assistant.
                 """
 
-    response = get_language_model_client().get_response(
-        [{"role": "user", "parts": [{"text": prompt}]}]
-    )
+    if topics:
+        body = (
+            "Common Topics:\n"
+            + "\n".join(
+                f"- {label}: {topic.count} questions ({_trend(topic)}, "
+                f"{topic.redirected_count / topic.count:.0%} redirected to an assistant)"
+                for topic, label in zip(topics, labels)
+            )
+            + "\n\n"
+            + client.get_response(
+                [{"role": "user", "parts": [{"text": prompt}]}],
+                max_tokens=REPORT_MAX_TOKENS,
+            ).get_text()
+        )
+    else:
+        body = "Students asked no questions in this period."
 
     if time_start and time_end:
         title = f"## {course_name} Chatbot Interaction Report ({time_start.date()} - {time_end.date()})\n\n"
@@ -149,7 +178,43 @@ def generate_usage_summary(
         + "\nTotal Conversations: "
         + str(conv_count)
         + "\n\n"
-        + response.get_text()
+        + body
     )
 
     return summary
+
+
+def label_topic(client: LanguageModelClient, question: str) -> str:
+    """Names the topic of a question that represents a cluster of questions."""
+    prompt = LABEL_PROMPT.format(subject=app_config.COURSE_SUBJECT, question=question)
+    response = client.get_response(
+        [{"role": "user", "parts": [{"text": prompt}]}],
+        max_tokens=LABEL_MAX_TOKENS,
+    )
+    lines = response.get_text().strip().splitlines()
+    return lines[0].strip() if lines else question
+
+
+def _in_later_half(timestamps: Sequence[datetime]) -> list[bool]:
+    """Tells whether each timestamp is in the later half of the span of all of them."""
+    if not timestamps:
+        return []
+    middle = min(timestamps) + (max(timestamps) - min(timestamps)) / 2
+    return [timestamp > middle for timestamp in timestamps]
+
+
+def _trend(topic: Topic) -> str:
+    if topic.later_count > topic.earlier_count * TREND_RATIO:
+        return "rising"
+    if topic.earlier_count > topic.later_count * TREND_RATIO:
+        return "falling"
+    return "steady"
+
+
+def _describe_topic(topic: Topic, label: str, example: str, total: int) -> str:
+    return (
+        f"Topic: {label}; share of questions: {topic.count / total:.0%}; "
+        f"trend: {_trend(topic)} ({topic.earlier_count} earlier, {topic.later_count} later); "
+        f"redirected to a human assistant: {topic.redirected_count / topic.count:.0%}; "
+        f"example question: {example}"
+    )
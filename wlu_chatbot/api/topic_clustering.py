@@ -0,0 +1,153 @@
+"""Groups student messages into topics by clustering their embeddings.
+
+Embeddings are compared by cosine similarity, so they are scaled to unit
+length and clustered by spherical mini-batch k-means, which keeps its
+centroids at unit length as well. Each batch moves a centroid toward the
+mean of its assigned messages with a learning rate that decays with the
+number of messages the centroid has absorbed, so the cost of clustering
+grows with the number of iterations rather than the number of messages.
+"""
+
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from wlu_chatbot.api.embedding import normalize_rows
+
+MAX_TOPICS = 12
+"""The largest number of topics into which messages are grouped."""
+
+MINI_BATCH_SIZE = 256
+ITERATIONS = 50
+
+
+@dataclass
+class Topic:
+    """A cluster of messages about one topic."""
+
+    representative: int
+    """The index of the message nearest the cluster's centroid."""
+    count: int
+    earlier_count: int
+    """The number of messages sent in the earlier half of the period."""
+    later_count: int
+    """The number of messages sent in the later half of the period."""
+    redirected_count: int
+    """The number of messages in conversations that were redirected to a human assistant."""
+
+
+def default_num_topics(num_messages: int) -> int:
+    """Chooses the number of topics for a number of messages, growing with its square root."""
+    return max(1, min(MAX_TOPICS, round((num_messages / 2) ** 0.5)))
+
+
+def find_topics(
+    embeddings: Sequence[Sequence[float]],
+    later: Sequence[bool],
+    redirected: Sequence[bool],
+    num_topics: Optional[int] = None,
+) -> list[Topic]:
+    """Clusters messages by their embeddings and counts the messages in each cluster.
+
+    :param embeddings: The embeddings of the messages.
+    :param later: Whether each message was sent in the later half of the period.
+    :param redirected: Whether each message's conversation was redirected to a human assistant.
+    :param num_topics: The number of clusters. Defaults to a number that grows with the number of messages.
+    :return: The non-empty clusters, largest first.
+    """
+    if len(embeddings) == 0:
+        return []
+
+    vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    centroids, labels = mini_batch_k_means(
+        vectors, num_topics or default_num_topics(len(vectors))
+    )
+    num_clusters = len(centroids)
+    later_mask = np.asarray(later, dtype=bool)
+    redirected_mask = np.asarray(redirected, dtype=bool)
+
+    counts = np.bincount(labels, minlength=num_clusters)
+    later_counts = np.bincount(labels[later_mask], minlength=num_clusters)
+    redirected_counts = np.bincount(labels[redirected_mask], minlength=num_clusters)
+
+    # The representative of a cluster is its member most similar to its centroid.
+    similarity = np.einsum("ij,ij->i", vectors, centroids[labels])
+    order = np.lexsort((-similarity, labels))
+    firsts = np.searchsorted(labels[order], np.arange(num_clusters))
+
+    topics = [
+        Topic(
+            representative=int(order[firsts[cluster]]),
+            count=int(counts[cluster]),
+            earlier_count=int(counts[cluster] - later_counts[cluster]),
+            later_count=int(later_counts[cluster]),
+            redirected_count=int(redirected_counts[cluster]),
+        )
+        for cluster in range(num_clusters)
+        if counts[cluster] > 0
+    ]
+    topics.sort(key=lambda topic: topic.count, reverse=True)
+    return topics
+
+
+def mini_batch_k_means(
+    vectors: npt.NDArray[np.float32],
+    num_clusters: int,
+    batch_size: int = MINI_BATCH_SIZE,
+    iterations: int = ITERATIONS,
+    seed: int = 0,
+) -> tuple[npt.NDArray[np.float32], npt.NDArray[np.intp]]:
+    """Clusters unit-length vectors by spherical mini-batch k-means.
+
+    :param vectors: The vectors to cluster, one per row, at unit length.
+    :param num_clusters: The number of clusters, which is reduced to the number of vectors if there are fewer.
+    :param batch_size: The number of vectors sampled per iteration.
+    :param iterations: The number of iterations.
+    :param seed: The seed of the random sampling, which makes clustering repeatable.
+    :return: The centroids of the clusters, one per row, and the cluster of each vector.
+    """
+    rng = np.random.default_rng(seed)
+    num_clusters = min(num_clusters, len(vectors))
+    centroids = _initial_centroids(vectors, num_clusters, rng)
+    absorbed = np.zeros(num_clusters, dtype=np.float32)
+
+    batch_size = min(batch_size, len(vectors))
+    for _ in range(iterations):
+        batch = vectors[rng.choice(len(vectors), batch_size, replace=False)]
+        nearest = np.argmax(batch @ centroids.T, axis=1)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, nearest, batch)
+        batch_counts = np.bincount(nearest, minlength=num_clusters).astype(np.float32)
+        absorbed += batch_counts
+
+        assigned = batch_counts > 0
+        rates = batch_counts[assigned] / absorbed[assigned]
+        means = sums[assigned] / batch_counts[assigned, np.newaxis]
+        centroids[assigned] += rates[:, np.newaxis] * (means - centroids[assigned])
+        centroids = normalize_rows(centroids)
+
+    labels = np.argmax(vectors @ centroids.T, axis=1)
+    return centroids, labels
+
+
+def _initial_centroids(
+    vectors: npt.NDArray[np.float32], num_clusters: int, rng: np.random.Generator
+) -> npt.NDArray[np.float32]:
+    """Chooses vectors as initial centroids by k-means++, which favours vectors far from those already chosen."""
+    chosen = [int(rng.integers(len(vectors)))]
+    distances = 1 - vectors @ vectors[chosen[0]]
+    for _ in range(1, num_clusters):
+        weights = np.maximum(distances, 0).astype(np.float64)
+        weights[chosen] = 0
+        if weights.sum() > 0:
+            index = int(rng.choice(len(vectors), p=weights / weights.sum()))
+        else:
+            # The remaining vectors duplicate chosen ones.
+            remaining = np.setdiff1d(np.arange(len(vectors)), chosen)
+            index = int(rng.choice(remaining))
+        chosen.append(index)
+        distances = np.minimum(distances, 1 - vectors @ vectors[index])
+    return vectors[chosen].copy()
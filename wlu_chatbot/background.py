@@ -0,0 +1,88 @@
+"""Runs work that a request starts but does not wait for.
+
+Work for which a student is waiting, such as AI responses, runs on threads of
+its own, separate from the threads of other work, such as titles and usage
+reports, so that a burst of reports never delays an answer. The former has
+enough threads for every answer that the language model may run or queue at
+once to reach its admission control, which then decides whether the answer
+waits, is answered by a cheaper model or is refused.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, ParamSpec, cast
+
+from flask import Flask, current_app
+
+from wlu_chatbot.resources import get_resource
+
+INTERACTIVE_THREADS = 8
+"""The number of threads per process that run work for which a student is waiting,
+besides those that wait for the language model."""
+
+BACKGROUND_THREADS = 2
+"""The number of threads per process that run other work, such as titles and reports."""
+
+P = ParamSpec("P")
+
+
+def run_in_background(
+    function: Callable[P, None], *args: P.args, **kwargs: P.kwargs
+) -> Future[None]:
+    """Runs a function in a background thread within a new application context.
+    Must be called from within an application context.
+
+    When the application is testing, the function runs immediately in the
+    current application context instead, so that tests observe its effects
+    deterministically. Exceptions are logged rather than raised, since nobody
+    waits for the result.
+
+    :return: A future that is done once the function has run.
+    """
+    return _submit("background_executor", BACKGROUND_THREADS, function, args, kwargs)
+
+
+def run_interactively(
+    function: Callable[P, None], *args: P.args, **kwargs: P.kwargs
+) -> Future[None]:
+    """Runs a function like run_in_background, but on threads of its own that are reserved
+    for work for which a student is waiting, so that it never waits behind other work.
+
+    :return: A future that is done once the function has run.
+    """
+    # Imported here, so that the language model is not loaded with this module.
+    from wlu_chatbot.api.language_model import get_admission_controller
+
+    controller = get_admission_controller()
+    threads = INTERACTIVE_THREADS + controller.max_concurrent + controller.max_queue
+    return _submit("interactive_executor", threads, function, args, kwargs)
+
+
+def _submit(
+    name: str,
+    threads: int,
+    function: Callable[..., None],
+    args: tuple[Any, ...],
+    kwargs: dict[str, Any],
+) -> Future[None]:
+    app = cast(Flask, current_app._get_current_object())  # type: ignore
+
+    def run() -> None:
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            app.logger.exception("Background task '%s' failed.", function.__qualname__)
+
+    def run_in_app_context() -> None:
+        with app.app_context():
+            run()
+
+    if app.testing:
+        run()
+        future: Future[None] = Future()
+        future.set_result(None)
+        return future
+    executor = get_resource(
+        name,
+        lambda: ThreadPoolExecutor(max_workers=threads, thread_name_prefix=name),
+    )
+    return executor.submit(run_in_app_context)
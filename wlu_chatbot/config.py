@@ -54,11 +54,49 @@ class FileStorageMode(Enum):
                 raise ValueError(f"Invalid file storage mode '{invalid_name}'")
 
 
+class RetrievalMode(Enum):
+    """The way in which segments relevant to a prompt are retrieved."""
+
+    VECTOR = 1
+    HYBRID = 2
+
+    @staticmethod
+    def from_str(enum_name: str) -> "RetrievalMode":
+        """Creates a RetrievalMode from a string."""
+        match enum_name.lower():
+            case "vector":
+                return RetrievalMode.VECTOR
+            case "hybrid":
+                return RetrievalMode.HYBRID
+            case invalid_name:
+                raise ValueError(f"Invalid retrieval mode '{invalid_name}'")
+
+
+class RetrievalBackend(Enum):
+    """The backend in which the nearest neighbours of a prompt's embedding are searched."""
+
+    POSTGRES = 1
+    NUMPY = 2
+
+    @staticmethod
+    def from_str(enum_name: str) -> "RetrievalBackend":
+        """Creates a RetrievalBackend from a string."""
+        match enum_name.lower():
+            case "postgres":
+                return RetrievalBackend.POSTGRES
+            case "numpy":
+                return RetrievalBackend.NUMPY
+            case invalid_name:
+                raise ValueError(f"Invalid retrieval backend '{invalid_name}'")
+
+
 class Config:
     """The global configuration for the WLU Chatbot."""
 
     SECRET_KEY = os.getenv("SECRET_KEY", os.urandom(32))
 
+    DEBUG = get_non_empty_env("DEBUG", "false").lower() == "true"
+
     DB_NAME = os.environ["DB_NAME"]
     DB_USER = os.environ["DB_USER"]
     DB_PASSWORD = os.environ["DB_PASSWORD"]
@@ -69,15 +107,98 @@ class Config:
 
     REQUIRE_OAUTH = get_non_empty_env("REQUIRE_OAUTH", "true").lower() == "true"
 
-    OLLAMA_URL = get_non_empty_env("OLLAMA_URL", "http://localhost:11434")
+    COURSE_SUBJECT = get_non_empty_env("COURSE_SUBJECT", "statistics")
+
+    OLLAMA_URL = [
+        url.strip()
+        for url in get_non_empty_env("OLLAMA_URL", "http://localhost:11434").split(",")
+        if url.strip()
+    ]
+    OLLAMA_EMBEDDING_URL = [
+        url.strip()
+        for url in get_non_empty_env(
+            "OLLAMA_EMBEDDING_URL", "http://host.docker.internal:11434"
+        ).split(",")
+        if url.strip()
+    ]
+    OLLAMA_MODELS = [
+        model.strip()
+        for model in get_non_empty_env(
+            "OLLAMA_MODELS", "llama3.2:3B,llama3.2:1B"
+        ).split(",")
+        if model.strip()
+    ]
+    OLLAMA_KEEP_ALIVE = get_non_empty_env("OLLAMA_KEEP_ALIVE", "30m")
+    OLLAMA_WARM_HOURS = get_non_empty_env("OLLAMA_WARM_HOURS", "08:00-22:00")
+    OLLAMA_HEARTBEAT_SECONDS = float(
+        get_non_empty_env("OLLAMA_HEARTBEAT_SECONDS", "300")
+    )
     GEMINI_API_KEY = get_non_empty_env("GEMINI_API_KEY")
+    GEMINI_CACHE_INSTRUCTIONS = (
+        get_non_empty_env("GEMINI_CACHE_INSTRUCTIONS", "false").lower() == "true"
+    )
+    GEMINI_MODELS = [
+        model.strip()
+        for model in get_non_empty_env(
+            "GEMINI_MODELS", "gemini-2.0-flash,gemini-2.0-flash-lite"
+        ).split(",")
+        if model.strip()
+    ]
     LLM_MODE = LLMMode.from_str(get_non_empty_env("LLM_MODE", "testing"))
+    LLM_FALLBACK_MODES = [
+        LLMMode.from_str(mode.strip())
+        for mode in get_non_empty_env("LLM_FALLBACK_MODES", "").split(",")
+        if mode.strip()
+    ]
+    LLM_LATENCY_ROUTING = (
+        get_non_empty_env("LLM_LATENCY_ROUTING", "false").lower() == "true"
+    )
+    # Set for each worker by the gunicorn configuration.
+    SERVER_WORKERS = 1
+    LLM_MAX_CONCURRENCY = int(get_non_empty_env("LLM_MAX_CONCURRENCY", "4"))
+    LLM_MAX_QUEUE = int(get_non_empty_env("LLM_MAX_QUEUE", "32"))
+    LLM_MAX_WAIT_SECONDS = float(get_non_empty_env("LLM_MAX_WAIT_SECONDS", "30"))
+    LLM_DOWNGRADE_QUEUE_DEPTH = int(get_non_empty_env("LLM_DOWNGRADE_QUEUE_DEPTH", "8"))
+    LLM_DOWNGRADE_P95_SECONDS = float(
+        get_non_empty_env("LLM_DOWNGRADE_P95_SECONDS", "20")
+    )
 
     FILE_STORAGE_MODE = FileStorageMode.from_str(
         get_non_empty_env("FILE_STORAGE_MODE", "local")
     )
     FILE_STORAGE_PATH = get_non_empty_env("FILE_STORAGE_PATH", "storage")
 
+    ANSWER_CACHE_MAX_DISTANCE = float(
+        get_non_empty_env("ANSWER_CACHE_MAX_DISTANCE", "0.05")
+    )
+    RETRIEVAL_CACHE_SIZE = int(get_non_empty_env("RETRIEVAL_CACHE_SIZE", "1024"))
+    RETRIEVAL_MODE = RetrievalMode.from_str(
+        get_non_empty_env("RETRIEVAL_MODE", "vector")
+    )
+    RETRIEVAL_BACKEND = RetrievalBackend.from_str(
+        get_non_empty_env("RETRIEVAL_BACKEND", "postgres")
+    )
+    RETRIEVAL_NUM_SEGMENTS = int(get_non_empty_env("RETRIEVAL_NUM_SEGMENTS", "8"))
+    RETRIEVAL_MAX_DISTANCE = (
+        float(os.environ["RETRIEVAL_MAX_DISTANCE"])
+        if get_non_empty_env("RETRIEVAL_MAX_DISTANCE")
+        else None
+    )
+    RETRIEVAL_ADAPTIVE_K = (
+        get_non_empty_env("RETRIEVAL_ADAPTIVE_K", "false").lower() == "true"
+    )
+    COMPACT_EMBEDDINGS = (
+        get_non_empty_env("COMPACT_EMBEDDINGS", "false").lower() == "true"
+    )
+    RETRIEVAL_MERGE_SEGMENTS = (
+        get_non_empty_env("RETRIEVAL_MERGE_SEGMENTS", "true").lower() == "true"
+    )
+    RETRIEVAL_MMR_LAMBDA = (
+        float(os.environ["RETRIEVAL_MMR_LAMBDA"])
+        if get_non_empty_env("RETRIEVAL_MMR_LAMBDA")
+        else None
+    )
+
 
 class ConfigProxy:
     """A typed proxy for accessing Flask's configuration."""
@@ -88,6 +209,12 @@ class ConfigProxy:
         """The secret key for the Flask application."""
         return current_app.config["SECRET_KEY"]
 
+    @property
+    @no_type_check
+    def DEBUG(self) -> bool:  # noqa: N802
+        """Whether the application runs in debug mode, which must not be used in production."""
+        return current_app.config["DEBUG"]
+
     @property
     @no_type_check
     def DB_NAME(self) -> str:  # noqa: N802
@@ -132,10 +259,59 @@ class ConfigProxy:
 
     @property
     @no_type_check
-    def OLLAMA_URL(self) -> str:  # noqa: N802
-        """The URL for OLLAMA"""
+    def COURSE_SUBJECT(self) -> str:  # noqa: N802
+        """The subject of the courses, such as "statistics", which prompts to the language model name."""
+        return current_app.config["COURSE_SUBJECT"]
+
+    @property
+    @no_type_check
+    def OLLAMA_URL(self) -> list[str]:  # noqa: N802
+        """The URLs of the Ollama servers that generate responses, given as a comma-separated list."""
         return current_app.config["OLLAMA_URL"]
 
+    @property
+    @no_type_check
+    def OLLAMA_EMBEDDING_URL(self) -> list[str]:  # noqa: N802
+        """The URLs of the Ollama servers that embed texts, given as a comma-separated list."""
+        return current_app.config["OLLAMA_EMBEDDING_URL"]
+
+    @property
+    @no_type_check
+    def OLLAMA_MODELS(self) -> list[str]:  # noqa: N802
+        """The ladder of Ollama models, from the most capable to the cheapest, given as a comma-separated list."""
+        return current_app.config["OLLAMA_MODELS"]
+
+    @property
+    @no_type_check
+    def OLLAMA_KEEP_ALIVE(self) -> str:  # noqa: N802
+        """How long Ollama keeps a model loaded after a request, such as "30m" or "-1" for indefinitely."""
+        return current_app.config["OLLAMA_KEEP_ALIVE"]
+
+    @property
+    @no_type_check
+    def OLLAMA_WARM_HOURS(self) -> str:  # noqa: N802
+        """The hours of the day, such as "08:00-22:00" in the server's local time, "always" or "never",
+        during which a heartbeat keeps the Ollama models loaded."""
+        return current_app.config["OLLAMA_WARM_HOURS"]
+
+    @property
+    @no_type_check
+    def OLLAMA_HEARTBEAT_SECONDS(self) -> float:  # noqa: N802
+        """How often the heartbeat reloads the Ollama models, which must be less than OLLAMA_KEEP_ALIVE."""
+        return current_app.config["OLLAMA_HEARTBEAT_SECONDS"]
+
+    @property
+    @no_type_check
+    def GEMINI_MODELS(self) -> list[str]:  # noqa: N802
+        """The ladder of Gemini models, from the most capable to the cheapest, given as a comma-separated list."""
+        return current_app.config["GEMINI_MODELS"]
+
+    @property
+    @no_type_check
+    def GEMINI_CACHE_INSTRUCTIONS(self) -> bool:  # noqa: N802
+        """Whether long system instructions are stored as cached content with Gemini rather than sent with every request."""
+        return current_app.config["GEMINI_CACHE_INSTRUCTIONS"]
+
     @property
     @no_type_check
     def GEMINI_API_KEY(self) -> str:  # noqa: N802
@@ -148,6 +324,54 @@ class ConfigProxy:
         """The type of LLM that is used."""
         return current_app.config["LLM_MODE"]
 
+    @property
+    @no_type_check
+    def LLM_FALLBACK_MODES(self) -> list[LLMMode]:  # noqa: N802
+        """The backends to which requests fail over when the LLM_MODE backend fails, in order, given as a comma-separated list."""
+        return current_app.config["LLM_FALLBACK_MODES"]
+
+    @property
+    @no_type_check
+    def LLM_LATENCY_ROUTING(self) -> bool:  # noqa: N802
+        """Whether requests are spread among the healthy backends by their speed rather than sent to the first of them."""
+        return current_app.config["LLM_LATENCY_ROUTING"]
+
+    @property
+    @no_type_check
+    def SERVER_WORKERS(self) -> int:  # noqa: N802
+        """The number of worker processes that serve the application, among which the LLM limits are divided."""
+        return current_app.config["SERVER_WORKERS"]
+
+    @property
+    @no_type_check
+    def LLM_MAX_CONCURRENCY(self) -> int:  # noqa: N802
+        """The largest number of requests that the server sends to the language model at once, divided among its SERVER_WORKERS and rounded up."""
+        return current_app.config["LLM_MAX_CONCURRENCY"]
+
+    @property
+    @no_type_check
+    def LLM_MAX_QUEUE(self) -> int:  # noqa: N802
+        """The largest number of requests that wait for the language model before requests are refused, divided among the SERVER_WORKERS and rounded up."""
+        return current_app.config["LLM_MAX_QUEUE"]
+
+    @property
+    @no_type_check
+    def LLM_MAX_WAIT_SECONDS(self) -> float:  # noqa: N802
+        """How long a request waits for the language model before it is refused."""
+        return current_app.config["LLM_MAX_WAIT_SECONDS"]
+
+    @property
+    @no_type_check
+    def LLM_DOWNGRADE_QUEUE_DEPTH(self) -> int:  # noqa: N802
+        """The number of requests waiting for the language model from which interactive requests are answered by a cheaper model, divided among the SERVER_WORKERS and rounded up."""
+        return current_app.config["LLM_DOWNGRADE_QUEUE_DEPTH"]
+
+    @property
+    @no_type_check
+    def LLM_DOWNGRADE_P95_SECONDS(self) -> float:  # noqa: N802
+        """The 95th percentile of recent latency from which interactive requests are answered by a cheaper model."""
+        return current_app.config["LLM_DOWNGRADE_P95_SECONDS"]
+
     @property
     @no_type_check
     def FILE_STORAGE_MODE(self) -> FileStorageMode:  # noqa: N802
@@ -166,6 +390,71 @@ class ConfigProxy:
         """The location where files are stored if relevant to the file storage mode."""
         return PurePath(current_app.config["FILE_STORAGE_PATH"])
 
+    @property
+    @no_type_check
+    def ANSWER_CACHE_MAX_DISTANCE(self) -> float:  # noqa: N802
+        """The largest cosine distance between two first-turn questions for which a cached answer is reused."""
+        return current_app.config["ANSWER_CACHE_MAX_DISTANCE"]
+
+    @property
+    @no_type_check
+    def RETRIEVAL_CACHE_SIZE(self) -> int:  # noqa: N802
+        """The maximal number of retrieval results cached per process. Zero disables the cache."""
+        return current_app.config["RETRIEVAL_CACHE_SIZE"]
+
+    @property
+    @no_type_check
+    def RETRIEVAL_MODE(self) -> RetrievalMode:  # noqa: N802
+        """The way in which segments relevant to a prompt are retrieved."""
+        return current_app.config["RETRIEVAL_MODE"]
+
+    @property
+    @no_type_check
+    def RETRIEVAL_BACKEND(self) -> RetrievalBackend:  # noqa: N802
+        """The backend in which vector searches run. The NumPy backend stores its index beneath
+        the file storage path, which must be on a filesystem local to the workers."""
+        return current_app.config["RETRIEVAL_BACKEND"]
+
+    @property
+    @no_type_check
+    def RETRIEVAL_NUM_SEGMENTS(self) -> int:  # noqa: N802
+        """The number of segments retrieved as context for a response."""
+        return current_app.config["RETRIEVAL_NUM_SEGMENTS"]
+
+    @property
+    @no_type_check
+    def RETRIEVAL_MAX_DISTANCE(self) -> float | None:  # noqa: N802
+        """The largest Euclidean distance between the embeddings of a prompt and a segment,
+        which are of unit length and thus at most 2 apart, for the segment to be retrieved,
+        or None to retrieve segments at any distance."""
+        return current_app.config["RETRIEVAL_MAX_DISTANCE"]
+
+    @property
+    @no_type_check
+    def RETRIEVAL_ADAPTIVE_K(self) -> bool:  # noqa: N802
+        """Whether retrieval stops before the largest gap between the distances of consecutive segments."""
+        return current_app.config["RETRIEVAL_ADAPTIVE_K"]
+
+    @property
+    @no_type_check
+    def RETRIEVAL_MERGE_SEGMENTS(self) -> bool:  # noqa: N802
+        """Whether adjacent retrieved segments are merged and near-duplicate segments are dropped."""
+        return current_app.config["RETRIEVAL_MERGE_SEGMENTS"]
+
+    @property
+    @no_type_check
+    def RETRIEVAL_MMR_LAMBDA(self) -> float | None:  # noqa: N802
+        """The weight of relevance against diversity when diversifying retrieved segments
+        by maximal marginal relevance, or None to not diversify them."""
+        return current_app.config["RETRIEVAL_MMR_LAMBDA"]
+
+    @property
+    @no_type_check
+    def COMPACT_EMBEDDINGS(self) -> bool:  # noqa: N802
+        """Whether vector searches shortlist segments by the index of their compact embeddings
+        and only rank the shortlist by the full embeddings. Requires pgvector 0.8 or later."""
+        return current_app.config["COMPACT_EMBEDDINGS"]
+
 
 app_config = ConfigProxy()
 """A global instance of the ConfigProxy for accessing application configuration values."""
@@ -6,13 +6,30 @@ This tool may be used to create new users as needed.
 
 import argparse
 import typing as t
-from sqlalchemy import inspect, text
+from sqlalchemy import (
+    inspect,
+    text,
+    select,
+    update,
+    func,
+    cast as sql_cast,
+    CursorResult,
+)
+from pgvector.sqlalchemy import Vector  # type: ignore
 import sys
 
+from wlu_chatbot.config import app_config
 from wlu_chatbot.db.models import (
     get_engine,
     base,
     Course,
+    Document,
+    Segment,
+    Embedding,
+    COMPACT_EMBEDDING_DIMENSIONS,
+    Message,
+    MessageType,
+    MessageEmbedding,
     User,
     add_new_course,
     add_new_user,
@@ -21,6 +38,9 @@ from wlu_chatbot.db.models import (
     ParticipatesIn,
     Limit,
 )
+from wlu_chatbot.api.message_embeddings import get_message_embeddings
+from wlu_chatbot.api.context_retrieval.retriever import Retriever
+from wlu_chatbot.web_helpers.analytics import rebuild_daily_usage
 
 
 def main(arg_list: list[str] | None = None):
@@ -57,6 +77,50 @@ def main(arg_list: list[str] | None = None):
         help="if set, forcefully clears all tables and recreates them, deleting all data.",
     )
 
+    sub_parsers.add_parser(
+        "compact-embeddings",
+        help="convert the embeddings of a database created before they were stored at half precision, and index their compact embeddings.",
+    )
+
+    recall_parser = sub_parsers.add_parser(
+        "measure-recall",
+        help="measure how well searching compact embeddings finds the segments found by full embeddings.",
+    )
+    recall_parser.add_argument(
+        "--queries",
+        type=int,
+        default=100,
+        help="the number of randomly chosen segments whose embeddings are used as queries.",
+    )
+    recall_parser.add_argument(
+        "--num-segments",
+        type=int,
+        default=None,
+        help="the number of segments retrieved per query. Defaults to the configured number.",
+    )
+
+    sub_parsers.add_parser(
+        "normalize-embeddings",
+        help="rescale the stored embeddings of segments and messages to unit length, which those stored before it was the convention are not.",
+    )
+
+    embed_messages_parser = sub_parsers.add_parser(
+        "embed-messages",
+        help="embed the student messages that have not been embedded.",
+    )
+    embed_messages_parser.add_argument("--batch-size", type=int, default=100)
+
+    analytics_parser = sub_parsers.add_parser(
+        "rebuild-analytics",
+        help="recount the daily usage of courses from their messages and conversations.",
+    )
+    analytics_parser.add_argument(
+        "--course-id",
+        type=int,
+        default=None,
+        help="the course whose usage is recounted. Defaults to every course.",
+    )
+
     create_parser = sub_parsers.add_parser(
         "create", help="create a new entity in the database."
     )
@@ -115,6 +179,24 @@ def main(arg_list: list[str] | None = None):
         limit_parser = search_sub.add_parser("limit")
         limit_parser.add_argument("course_id", type=int)
 
+    update_parser = sub_parsers.add_parser(
+        "update", help="Update entities in the database."
+    )
+    for _ in range(1):
+        update_sub = update_parser.add_subparsers(
+            dest="entity_type",
+            help="the entity type to be updated.",
+            required=True,
+        )
+
+        course_parser = update_sub.add_parser("course")
+        course_parser.add_argument("course_id", type=int)
+        course_parser.add_argument(
+            "--answer-cache",
+            choices=["enabled", "disabled"],
+            help="whether answers to repeated first-turn questions are reused for the course.",
+        )
+
     destroy_parser = sub_parsers.add_parser(
         "destroy", help="Destroy entities in the database."
     )
@@ -142,6 +224,20 @@ def main(arg_list: list[str] | None = None):
         initialize(args.force)
     elif args.command == "mock":
         mock(args.force)
+    elif args.command == "compact-embeddings":
+        compact_embeddings()
+    elif args.command == "measure-recall":
+        measure_recall(
+            args.queries,
+            args.num_segments or app_config.RETRIEVAL_NUM_SEGMENTS,
+        )
+    elif args.command == "normalize-embeddings":
+        normalize_embeddings()
+    elif args.command == "embed-messages":
+        embed_messages(args.batch_size)
+    elif args.command == "rebuild-analytics":
+        rebuild_daily_usage(args.course_id)
+        print("Daily usage recounted.")
     elif args.command == "create":
         match args.entity_type:
             case "course":
@@ -234,6 +330,26 @@ def main(arg_list: list[str] | None = None):
                     table.print()
             case type_:
                 raise error(f"Invalid entity type '{type_}'.")
+    elif args.command == "update":
+        match args.entity_type:
+            case "course":
+                with Session(get_engine()) as sess:
+                    course = sess.get(Course, args.course_id)
+                    if not course:
+                        raise error(f"No course exists with id {args.course_id}")
+                    if args.answer_cache is not None:
+                        course.answer_cache_enabled = args.answer_cache == "enabled"  # type: ignore
+                    sess.commit()
+                    answer_cache = (
+                        "enabled"
+                        if t.cast(bool, course.answer_cache_enabled)
+                        else "disabled"
+                    )
+                    print(
+                        f"Course '{course.name}' with ID '{course.id}' has the answer cache {answer_cache}."
+                    )
+            case type_:
+                raise error(f"Invalid entity type '{type_}'.")
     elif args.command == "destroy":
         match args.entity_type:
             case "participates_in":
@@ -351,6 +467,142 @@ def initialize(force: bool):
         print("Database already initialized.")
 
 
+def compact_embeddings():
+    """Converts the embeddings of a database created before they were stored at half precision,
+    drops the compact embeddings that used to be stored next to them, and creates the index
+    of compact embeddings if it does not exist.
+    """
+    with Session(get_engine()) as sess:
+        column_type = sess.execute(
+            text(
+                "SELECT udt_name FROM information_schema.columns"
+                " WHERE table_name = 'embeddings' AND column_name = 'vector'"
+            )
+        ).scalar()
+        if column_type == "vector":
+            sess.execute(
+                text(
+                    "ALTER TABLE embeddings ALTER COLUMN vector TYPE halfvec USING vector::halfvec"
+                )
+            )
+        sess.execute(
+            text("ALTER TABLE embeddings DROP COLUMN IF EXISTS compact_vector")
+        )
+        sess.commit()
+    for index in Embedding.__table__.indexes:
+        index.create(get_engine(), checkfirst=True)
+    print(
+        f"Embeddings stored at half precision, with an index of their first {COMPACT_EMBEDDING_DIMENSIONS} dimensions."
+    )
+
+
+def normalize_embeddings():
+    """Rescales the stored embeddings of segments and messages to unit length. Searches
+    compare them with each other, so those stored before it was the convention would
+    be found at the wrong distances.
+    """
+    with Session(get_engine()) as sess:
+        rescaled = {}
+        for name, model in [("segment", Embedding), ("message", MessageEmbedding)]:
+            # Half precision leaves unit-length vectors slightly off unit length.
+            result = t.cast(
+                CursorResult[t.Any],
+                sess.execute(
+                    update(model)
+                    .where(
+                        func.abs(func.vector_norm(sql_cast(model.vector, Vector)) - 1)
+                        > 0.01
+                    )
+                    .values(vector=func.l2_normalize(model.vector))
+                ),
+            )
+            rescaled[name] = result.rowcount
+        sess.commit()
+    print(
+        f"Rescaled {rescaled['segment']} segment embeddings and {rescaled['message']} message embeddings to unit length."
+    )
+
+
+def embed_messages(batch_size: int):
+    """Embeds the student messages that have no stored embedding in batches, committing each batch.
+
+    :param batch_size: The number of messages read and embedded at a time.
+    """
+    last_id = 0
+    embedded = 0
+    with Session(get_engine()) as sess:
+        while True:
+            rows = t.cast(
+                list[tuple[int, str]],
+                sess.execute(
+                    select(Message.id, Message.body)  # type: ignore
+                    .outerjoin(
+                        MessageEmbedding, MessageEmbedding.message_id == Message.id
+                    )
+                    .where(
+                        Message.id > last_id,
+                        Message.type == MessageType.STUDENT_MESSAGE,
+                        MessageEmbedding.message_id.is_(None),
+                    )
+                    .order_by(Message.id)
+                    .limit(batch_size)
+                ).all(),
+            )
+            if not rows:
+                break
+            # Stored like the embeddings of messages that are embedded as they are used,
+            # which may be stored meanwhile.
+            get_message_embeddings(rows)
+            last_id = rows[-1][0]
+            embedded += len(rows)
+    print(f"Embedded {embedded} student messages.")
+
+
+def measure_recall(num_queries: int, num_segments: int):
+    """Prints the recall of searching compact embeddings against searching full embeddings,
+    using the embeddings of random segments as queries, the average stored size of the
+    embeddings at single and at half precision, and the size of the index of compact embeddings.
+    """
+    with Session(get_engine()) as sess:
+        queries = t.cast(
+            list[tuple[int, t.Sequence[float]]],
+            sess.execute(
+                select(Document.course_id, Embedding.vector)  # type: ignore
+                .join(Segment, Segment.id == Embedding.segment_id)
+                .join(Document, Document.id == Segment.document_id)
+                .order_by(func.random())
+                .limit(num_queries)
+            ).all(),
+        )
+        single_size, half_size = t.cast(
+            tuple[float | None, float | None],
+            sess.execute(
+                select(
+                    func.avg(func.pg_column_size(sql_cast(Embedding.vector, Vector))),
+                    func.avg(func.pg_column_size(Embedding.vector)),
+                )
+            ).one(),
+        )
+        index_size = t.cast(
+            int,
+            sess.execute(
+                text("SELECT pg_relation_size('ix_embeddings_compact_vector')")
+            ).scalar(),
+        )
+
+    recall = Retriever().measure_compact_recall(queries, num_segments)
+    print(
+        f"Recall@{num_segments} of the compact search over {len(queries)} queries: {recall:.3f}"
+    )
+    single_size = single_size or 0
+    half_size = half_size or 0
+    saved = 1 - half_size / single_size if single_size else 0
+    print(
+        f"Average stored size: {single_size:.0f} bytes per embedding at single precision, {half_size:.0f} bytes at half precision ({saved:.0%} smaller)."
+    )
+    print(f"Size of the index of compact embeddings: {index_size} bytes.")
+
+
 def mock(force: bool):
     """Adds mock courses and users with varying roles to the database.
     Only adds mock data if the users and Course tables are empty.
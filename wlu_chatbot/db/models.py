@@ -5,18 +5,35 @@ from sqlalchemy import (
     Column,
     Integer,
     DateTime,
+    Date,
     ForeignKey,
     Text,
     Enum,
     UniqueConstraint,
+    Boolean,
+    Float,
+    Computed,
+    Index,
+    update,
+    cast as sql_cast,
+    func,
+    ColumnElement,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
+
+from sqlalchemy.orm import (
+    declarative_base,
+    mapped_column,
+    relationship,
+    deferred,
+    column_property,
+    Session,
 )
-
-from sqlalchemy.orm import declarative_base, mapped_column, relationship, Session
 import enum
-from pgvector.sqlalchemy import Vector  # type: ignore
+from pgvector.sqlalchemy import Vector, HALFVEC  # type: ignore
 from datetime import datetime, timezone
 from sqlalchemy.exc import SQLAlchemyError
-from typing import cast
+from typing import Any, cast
 import secrets
 import string
 from pathlib import PurePath
@@ -24,20 +41,23 @@ from pathlib import PurePath
 
 from flask_login import UserMixin  # type: ignore
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import g
 import markdown
 
 
 from wlu_chatbot.config import app_config
+from wlu_chatbot.resources import get_resource
 
 
 def get_engine() -> Engine:
-    """Gets the database engine instance. Must be called from within a request context."""
-    if g.get("_db_engine") is None:
-        g._db_engine = create_engine(
-            f"""postgresql+psycopg2://{app_config.DB_USER}:{app_config.DB_PASSWORD}@{app_config.DB_URL}/{app_config.DB_NAME}"""
-        )
-    return g._db_engine
+    """Gets the database engine instance, whose connection pool is shared by the threads of a process.
+    Must be called from within an application context."""
+    return get_resource(
+        "db_engine",
+        lambda: create_engine(
+            f"""postgresql+psycopg2://{app_config.DB_USER}:{app_config.DB_PASSWORD}@{app_config.DB_URL}/{app_config.DB_NAME}""",
+            pool_pre_ping=True,
+        ),
+    )
 
 
 base = declarative_base()
@@ -164,6 +184,8 @@ class Course(base):
     __tablename__ = "courses"
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String)
+    answer_cache_enabled = Column(Boolean, nullable=False, default=False)
+    documents_version = Column(Integer, nullable=False, default=0)
 
     conversations = relationship(
         "Conversation",
@@ -186,6 +208,15 @@ class Course(base):
     limits = relationship(
         "Limit", back_populates="course", uselist=True, cascade="all, delete-orphan"
     )
+    cached_answers = relationship(
+        "CachedAnswer",
+        back_populates="course",
+        uselist=True,
+        cascade="all, delete-orphan",
+    )
+    reports = relationship(
+        "Report", back_populates="course", uselist=True, cascade="all, delete-orphan"
+    )
 
 
 class ConsentForm(base):
@@ -259,6 +290,16 @@ class Segment(base):
     document_id = Column(
         Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False
     )
+    text_search = deferred(
+        Column(
+            TSVECTOR,
+            Computed("to_tsvector('english', coalesce(text, ''))", persisted=True),
+        )
+    )
+
+    __table_args__ = (
+        Index("ix_segments_text_search", text_search, postgresql_using="gin"),
+    )
 
     document = relationship("Document", back_populates="segments")
     embeddings = relationship(
@@ -283,11 +324,37 @@ class Message(base):
     written_by = Column(
         String, ForeignKey("users.email", ondelete="CASCADE"), nullable=False
     )
+    # The language model that generated a bot message, which is null for other
+    # messages and for answers reused from the answer cache.
+    model = Column(String, nullable=True)
 
     conversation = relationship("Conversation", back_populates="messages")
     user = relationship("User", back_populates="messages")
 
 
+class MessageEmbedding(base):
+    """Represents the embedding of a student message, which is compared with other embeddings by cosine distance"""
+
+    __tablename__ = "message_embeddings"
+    message_id = Column(
+        Integer, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True
+    )
+    vector = mapped_column(Vector)
+
+
+class PreparedRetrieval(base):
+    """Represents the segments found for a student message before a response to it was requested"""
+
+    __tablename__ = "prepared_retrievals"
+    message_id = Column(
+        Integer, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True
+    )
+    segment_ids = Column(ARRAY(Integer), nullable=False)
+    distances = Column(ARRAY(Float(asdecimal=False)), nullable=False)
+    num_segments = Column(Integer, nullable=False)
+    documents_version = Column(Integer, nullable=False)
+
+
 class Limit(base):
     """Represents the per-user limit for LLM access"""
 
@@ -302,19 +369,167 @@ class Limit(base):
     course = relationship("Course", back_populates="limits")
 
 
+COMPACT_EMBEDDING_DIMENSIONS = 256
+"""The number of leading dimensions of an embedding that are indexed as its compact embedding."""
+
+
+def _compact_vector(vector: Column[Any]) -> ColumnElement[Any]:
+    """The leading dimensions of a vector, rescaled to unit length."""
+    return sql_cast(
+        func.l2_normalize(func.subvector(vector, 1, COMPACT_EMBEDDING_DIMENSIONS)),
+        HALFVEC(COMPACT_EMBEDDING_DIMENSIONS),
+    )
+
+
 class Embedding(base):
     """Represents the embedding of a segment"""
 
     __tablename__ = "embeddings"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    vector = mapped_column(Vector)
+    vector = Column(HALFVEC)
+    """The embedding at half precision, which takes half the space of single precision."""
+    compact_vector = column_property(_compact_vector(vector), deferred=True)
+    """The leading dimensions of the vector at unit length, which are searched by an index
+    before the full vectors of the nearest candidates. Only defined for vectors with at least
+    as many dimensions, to which searches of it must be restricted to use the index."""
     segment_id = Column(
         Integer, ForeignKey("segments.id", ondelete="CASCADE"), nullable=False
     )
 
+    __table_args__ = (
+        Index(
+            "ix_embeddings_compact_vector",
+            _compact_vector(vector).label("compact_vector"),
+            postgresql_using="hnsw",
+            postgresql_ops={"compact_vector": "halfvec_l2_ops"},
+            postgresql_where=func.vector_dims(vector) >= COMPACT_EMBEDDING_DIMENSIONS,
+        ),
+    )
+
     segment = relationship("Segment", back_populates="embeddings")
 
 
+class CachedAnswer(base):
+    """Represents a generated answer to a first-turn question that may be reused for similar questions"""
+
+    __tablename__ = "cached_answers"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    course_id = Column(
+        Integer, ForeignKey("courses.id", ondelete="CASCADE"), nullable=False
+    )
+    vector = mapped_column(Vector)
+    segment_ids = Column(ARRAY(Integer), nullable=False)
+    answer = Column(Text, nullable=False)
+    documents_version = Column(Integer, nullable=False)
+    timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    course = relationship("Course", back_populates="cached_answers")
+
+
+class ReportStatus(str, enum.Enum):
+    PENDING = "PENDING"
+    READY = "READY"
+    FAILED = "FAILED"
+
+
+class Report(base):
+    """Represents a usage report of a course for a range of dates, which is generated in the background"""
+
+    __tablename__ = "reports"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    course_id = Column(
+        Integer, ForeignKey("courses.id", ondelete="CASCADE"), nullable=False
+    )
+    time_start = Column(DateTime, nullable=True)
+    time_end = Column(DateTime, nullable=True)
+    status: ReportStatus = Column(
+        Enum(ReportStatus),
+        nullable=False,
+        default=ReportStatus.PENDING,  # type: ignore
+    )
+    content = Column(Text, nullable=True)
+    message_count = Column(Integer, nullable=False)
+    """The number of messages in the range when the report was requested."""
+    last_message_id = Column(Integer, nullable=True)
+    """The newest message in the range when the report was requested, which tells whether messages were added since."""
+    requested_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        UniqueConstraint(
+            "course_id",
+            "time_start",
+            "time_end",
+            name="_report_range_uc",
+            postgresql_nulls_not_distinct=True,
+        ),
+    )
+    course = relationship("Course", back_populates="reports")
+
+
+class DailyCourseUsage(base):
+    """Represents the usage of a course on one day, which is counted as it happens"""
+
+    __tablename__ = "daily_course_usage"
+    course_id = Column(
+        Integer, ForeignKey("courses.id", ondelete="CASCADE"), primary_key=True
+    )
+    day = Column(Date, primary_key=True)
+    student_messages = Column(Integer, nullable=False, default=0)
+    bot_messages = Column(Integer, nullable=False, default=0)
+    assistant_messages = Column(Integer, nullable=False, default=0)
+    conversations = Column(Integer, nullable=False, default=0)
+    redirects = Column(Integer, nullable=False, default=0)
+    limit_hits = Column(Integer, nullable=False, default=0)
+    """The number of requests refused because a limit was reached, which cannot be recounted from other tables."""
+
+
+class DailyStudentActivity(base):
+    """Represents the messages that a student sent in a course on one day"""
+
+    __tablename__ = "daily_student_activity"
+    course_id = Column(
+        Integer, ForeignKey("courses.id", ondelete="CASCADE"), primary_key=True
+    )
+    day = Column(Date, primary_key=True)
+    email = Column(
+        String, ForeignKey("users.email", ondelete="CASCADE"), primary_key=True
+    )
+    student_messages = Column(Integer, nullable=False, default=0)
+
+
+class AiResponseStatus(str, enum.Enum):
+    PENDING = "PENDING"
+    READY = "READY"
+    FAILED = "FAILED"
+
+
+class AiResponseJob(base):
+    """Represents the generation of an AI response to a student message, which runs in the background"""
+
+    __tablename__ = "ai_response_jobs"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message_id = Column(
+        Integer,
+        ForeignKey("messages.id", ondelete="CASCADE"),
+        nullable=False,
+        unique=True,
+    )
+    """The student message that is responded to."""
+    requested_by = Column(
+        String, ForeignKey("users.email", ondelete="CASCADE"), nullable=False
+    )
+    status: AiResponseStatus = Column(
+        Enum(AiResponseStatus),
+        nullable=False,
+        default=AiResponseStatus.PENDING,  # type: ignore
+    )
+    bot_message_id = Column(
+        Integer, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True
+    )
+    """The generated response, once the job is ready."""
+    requested_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
 class Reference(base):
     """Represents the relationship between a message and referenced segments"""
 
@@ -327,6 +542,24 @@ class Reference(base):
     )
 
 
+def bump_documents_version(session: Session, course_id: int) -> int:
+    """Records that the documents of a course have changed, so that anything
+    derived from the previous set of documents is no longer used.
+    The change is committed along with the rest of the session.
+
+    :param session: The session in which the documents were changed.
+    :param course_id: The course whose documents were changed.
+    :return: The new version of the course's documents.
+    """
+    result = session.execute(  # type: ignore
+        update(Course)  # type: ignore
+        .where(Course.id == course_id)
+        .values(documents_version=Course.documents_version + 1)
+        .returning(Course.documents_version)
+    )
+    return cast(int, result.scalar_one())
+
+
 def add_new_user(email: str):
     """Adds new user entry to users table with the given parameters.
     Must be called within a request context.
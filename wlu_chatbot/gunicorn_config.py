@@ -0,0 +1,63 @@
+"""The gunicorn configuration with which the WLU Chatbot is served in production.
+
+Requests mostly wait on the database and language models rather than the CPU,
+so each worker process serves several requests at once in threads. The
+application is loaded once before the workers are forked, which shares its
+memory and its generated secret key among them; resources such as database
+connections are created by each worker on first use (see wlu_chatbot.resources).
+
+Before the workers are forked, the Ollama models are loaded on every host, and
+each worker keeps them loaded during the warm hours with a heartbeat (see
+wlu_chatbot.api.ollama_warm_up).
+
+Each worker limits its own requests to the language model, so the LLM limits
+of the configuration, which hold for the whole server, are divided among the
+workers, whose number each worker learns when it starts.
+
+Every setting can be overridden by an environment variable:
+
+- GUNICORN_BIND: The address to listen on. Defaults to 0.0.0.0:5000.
+- WEB_CONCURRENCY: The number of worker processes. Defaults to the number of CPUs.
+- GUNICORN_THREADS: The number of threads per worker. Defaults to 8.
+- GUNICORN_TIMEOUT: The seconds after which a silent worker is restarted. Defaults to 120.
+"""
+
+import os
+from typing import Any
+
+bind = os.getenv("GUNICORN_BIND") or "0.0.0.0:5000"
+
+workers = int(os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 1)
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS") or 8)
+
+# AI responses and reports are generated in the background, but uploaded
+# documents are embedded within their request, which can outlast the default 30s.
+timeout = int(os.getenv("GUNICORN_TIMEOUT") or 120)
+graceful_timeout = 30
+keepalive = 5
+
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+
+
+def when_ready(server: Any):
+    """Loads the Ollama models before the workers start serving requests."""
+    # Imported here, so that the configuration can be read without the application.
+    from wlu_chatbot.api.ollama_warm_up import warm_up_models
+
+    app = server.app.wsgi()
+    with app.app_context():
+        loaded = warm_up_models()
+    server.log.info("Loaded %d Ollama models.", loaded)
+
+
+def post_worker_init(worker: Any):
+    """Tells the worker how many workers share the LLM limits and starts the
+    heartbeat that keeps the Ollama models loaded."""
+    from wlu_chatbot.api.ollama_warm_up import start_heartbeat
+
+    worker.wsgi.config["SERVER_WORKERS"] = worker.cfg.workers
+    start_heartbeat(worker.wsgi)
@@ -0,0 +1,34 @@
+"""Shares resources, such as the database engine and model clients, among the threads of a process.
+
+Resources are stored in the application's extensions along with the id of the
+process that created them. A process forked from one that created a resource,
+as gunicorn forks its workers from a preloaded application, creates the
+resource again rather than sharing its parent's connections.
+"""
+
+import os
+from threading import Lock
+from typing import Callable, cast
+
+from flask import current_app
+
+_lock = Lock()
+
+
+def get_resource[T](name: str, create: Callable[[], T]) -> T:
+    """Gets a resource of the current application, creating it on its first use in this process.
+    Must be called from within an application context. The resource must be safe to use from several threads.
+
+    :param name: The name under which the resource is stored in the application's extensions.
+    :param create: Creates the resource.
+    """
+    extensions = current_app.extensions
+    pid = os.getpid()
+    entry = extensions.get(name)
+    if entry is None or entry[0] != pid:
+        with _lock:
+            entry = extensions.get(name)
+            if entry is None or entry[0] != pid:
+                entry = (pid, create())
+                extensions[name] = entry
+    return cast(T, entry[1])
@@ -0,0 +1,29 @@
+"""Serves the WLU Chatbot with gunicorn, configured by wlu_chatbot.gunicorn_config."""
+
+import os
+import sys
+
+GUNICORN_ARGS = [
+    "gunicorn",
+    "--config",
+    "python:wlu_chatbot.gunicorn_config",
+    "wlu_chatbot:create_app()",
+]
+
+
+def main(args: list[str] | None = None):
+    """Replaces this process with gunicorn serving the WLU Chatbot.
+
+    :param args: Further arguments for gunicorn, which override the configuration.
+    """
+    command = [sys.executable, "-m", *GUNICORN_ARGS, *(args or [])]
+    print(f"Starting Gunicorn: {' '.join(command)}")
+    try:
+        os.execv(sys.executable, command)
+    except Exception as e:
+        print(f"An unexpected error occurred while starting Gunicorn: {e}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
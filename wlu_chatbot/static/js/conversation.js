@@ -266,10 +266,13 @@ async function sendMessage(e) {
         );
       }
 
-      return response.json();
+      return waitForAiResponse(await response.json());
     }).then(async (data) => {
       appendMessage("bot", data.text, data.message_id);
       conversationItemElement.textContent = data.title;
+      if (data.title_pending) {
+        waitForTitle(conversationId, data.title, conversationItemElement);
+      }
     }).catch((error) => {
       console.error(error);
       appendMessage("system", "Could not fetch a response from the AI Tutor.");
@@ -281,6 +284,50 @@ async function sendMessage(e) {
   userMessageTextarea.disabled = false;
   userMessageTextarea.focus();
 }
+/**
+ * Follows a job that generates an AI response until it is no longer pending.
+ * @param {{status: string, status_url: string}} job
+ *  */
+async function waitForAiResponse(job) {
+  while (job.status === "PENDING") {
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+    const response = await fetch(job.status_url, {
+      headers: { "Accept": "application/json" },
+    });
+    if (!response.ok) {
+      throw Error("Could not get AI Tutor response.");
+    }
+    job = await response.json();
+  }
+  if (job.status !== "READY") {
+    throw Error("Could not get AI Tutor response.");
+  }
+  return job;
+}
+
+/**
+ * Shows the title of a conversation in the sidebar once it has been generated.
+ * @param {number} id
+ * @param {string} pendingTitle the title until the generated one is stored
+ * @param {HTMLElement} conversationItemElement
+ *  */
+async function waitForTitle(id, pendingTitle, conversationItemElement) {
+  for (let attempt = 0; attempt < 10; attempt++) {
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+    const response = await fetch(`/conversations/${id}`, {
+      headers: { "Accept": "application/json" },
+    });
+    if (!response.ok) {
+      return;
+    }
+    const data = await response.json();
+    if (data.title && data.title !== pendingTitle) {
+      conversationItemElement.textContent = data.title;
+      return;
+    }
+  }
+}
+
 /**
  * @param {string} sender
  * @param {string} text
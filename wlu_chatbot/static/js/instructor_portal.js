@@ -1,6 +1,7 @@
 const ParticipatesInsForms = document.querySelectorAll(
   "[participates-ins-form]",
 );
+const SummaryForms = document.querySelectorAll("[summary-form]");
 // const documentListElement = document.getElementById("documentList");
 // const courseId = document.body.dataset.courseId
 //   ? Number(document.body.dataset.courseId)
@@ -147,4 +148,58 @@ ParticipatesInsForms.forEach((form) => {
   });
 });
 
+const SUMMARY_POLL_INTERVAL_MS = 2000;
+
+/**
+ * Polls the status of a summary until it has been generated.
+ * @param {string} statusUrl The URL of the summary's status.
+ * @returns {Promise<string>} the URL from which the summary is downloaded
+ */
+async function waitForSummary(statusUrl) {
+  while (true) {
+    await new Promise((resolve) => setTimeout(resolve, SUMMARY_POLL_INTERVAL_MS));
+    const response = await fetch(statusUrl, {
+      headers: { "Accept": "application/json" },
+    });
+    if (!response.ok) {
+      throw Error("Could not get the status of the report.");
+    }
+    const summary = await response.json();
+    if (summary.status === "READY") {
+      return summary.download_url;
+    }
+    if (summary.status === "FAILED") {
+      throw Error("The report could not be generated.");
+    }
+  }
+}
+
+SummaryForms.forEach((form) => {
+  form.addEventListener("submit", (event) => {
+    event.preventDefault();
+    const button = document.getElementById("summaryButton");
+    button.disabled = true;
+    button.textContent = "Generating report...";
+
+    fetch(form.action, {
+      method: "POST",
+      headers: { "Accept": "application/json" },
+      body: new FormData(form),
+    }).then(async (response) => {
+      if (!response.ok) {
+        throw Error("Could not request the report.");
+      }
+      const summary = await response.json();
+      window.location.href = summary.download_url ??
+        await waitForSummary(summary.status_url);
+    }).catch((error) => {
+      console.error("Error generating report:", error);
+      alert("Error generating report.");
+    }).finally(() => {
+      button.disabled = false;
+      button.textContent = "Download Report";
+    });
+  });
+});
+
 // loadDocumentList();
@@ -0,0 +1,153 @@
+"""Generates AI responses as background jobs, so that web workers do not wait on the language model.
+
+A job responds to one student message. Requesting a response to a message
+that is already being responded to reuses its job, unless the job failed or
+has been pending for so long that its generation was likely lost.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, cast
+
+from sqlalchemy import CursorResult, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from wlu_chatbot.background import run_interactively
+from wlu_chatbot.api.language_model import get_language_model_client, Priority
+from wlu_chatbot.db.models import (
+    get_engine,
+    AiResponseJob,
+    AiResponseStatus,
+    Message,
+    MessageType,
+    Reference,
+)
+from wlu_chatbot.web_helpers.analytics import record_usage
+from wlu_chatbot.web_helpers.conversation import generate_response
+
+AI_RESPONSE_TIMEOUT = timedelta(minutes=5)
+"""How long a job may stay pending before a request generates the response again, in case its generation was lost."""
+
+
+def request_ai_response(
+    message_id: int, email: str
+) -> tuple[int, AiResponseStatus, bool]:
+    """Gets the job that responds to a student message, starting it in the background
+    unless it is pending or ready. Must be called from within a request context.
+
+    :param message_id: The student message to respond to, which must be the newest message of its conversation.
+    :param email: The student who requested the response.
+    :return: The id and status of the job, and whether this request created it.
+    """
+    with Session(get_engine()) as session:
+        row = cast(
+            Optional[tuple[AiResponseJob, bool]],
+            session.execute(
+                select(  # type: ignore
+                    AiResponseJob,
+                    AiResponseJob.requested_at
+                    > datetime.now(timezone.utc) - AI_RESPONSE_TIMEOUT,
+                ).where(AiResponseJob.message_id == message_id)
+            ).first(),
+        )
+
+        if row is not None:
+            job, recent = row
+            if job.status == AiResponseStatus.READY or (
+                job.status == AiResponseStatus.PENDING and recent
+            ):
+                return cast(int, job.id), job.status, False
+        else:
+            job = AiResponseJob(message_id=message_id, requested_by=email)
+            session.add(job)
+
+        created = row is None
+        job.status = AiResponseStatus.PENDING
+        job.requested_at = datetime.now(timezone.utc)  # type: ignore
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another request created the job first.
+            session.rollback()
+            return request_ai_response(message_id, email)
+        job_id = cast(int, job.id)
+
+    run_interactively(generate_ai_response, job_id)
+    with Session(get_engine()) as session:
+        # The job may have finished already if it ran inline.
+        job = session.get(AiResponseJob, job_id)
+        status = AiResponseStatus.PENDING if job is None else job.status
+        return job_id, status, created
+
+
+def generate_ai_response(job_id: int):
+    """Generates the response of a job and stores it as a bot message,
+    unless the job was requested again meanwhile."""
+    with Session(get_engine()) as session:
+        job = session.get(AiResponseJob, job_id)
+        if job is None:
+            return
+        message = session.get(Message, job.message_id)
+        if message is None:
+            return
+        conversation_id = cast(int, message.conversation_id)
+        course_id = cast(int, message.conversation.course_id)
+        email = cast(str, job.requested_by)
+        requested_at = cast(datetime, job.requested_at)
+
+    try:
+        response = generate_response(
+            get_language_model_client(Priority.INTERACTIVE),
+            conversation_id=conversation_id,
+        )
+    except Exception:
+        _fail(job_id, requested_at)
+        raise
+    if response is None:
+        # A message was added to the conversation after the job was requested.
+        _fail(job_id, requested_at)
+        return
+
+    with Session(get_engine()) as session:
+        bot_message = Message(
+            body=response.text,
+            type=MessageType.BOT_MESSAGE,
+            written_by=email,
+            conversation_id=conversation_id,
+            model=response.model,
+        )
+        session.add(bot_message)
+        session.flush()
+        for source in response.sources:
+            session.add(
+                Reference(message_id=bot_message.id, segment_id=source.segment_id)
+            )
+        result = cast(
+            CursorResult[Any],
+            session.execute(
+                update(AiResponseJob)  # type: ignore
+                .where(
+                    AiResponseJob.id == job_id,
+                    AiResponseJob.requested_at == requested_at,
+                )
+                .values(status=AiResponseStatus.READY, bot_message_id=bot_message.id)
+            ),
+        )
+        if result.rowcount == 0:
+            # The job was started again, and that run stores the response.
+            session.rollback()
+            return
+        record_usage(session, course_id, bot_messages=1)
+        session.commit()
+
+
+def _fail(job_id: int, requested_at: datetime):
+    with Session(get_engine()) as session:
+        session.execute(
+            update(AiResponseJob)  # type: ignore
+            .where(
+                AiResponseJob.id == job_id, AiResponseJob.requested_at == requested_at
+            )
+            .values(status=AiResponseStatus.FAILED)
+        )
+        session.commit()
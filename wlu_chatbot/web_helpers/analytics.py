@@ -0,0 +1,317 @@
+"""Counts the usage of courses per day, so that usage over any range of dates is a sum of a few rows.
+
+Usage is counted by record_usage in the same transaction as the event that it
+counts. The counts that can be derived from messages and conversations can be
+recounted by rebuild_daily_usage, e.g. after the tables were introduced.
+"""
+
+from datetime import date, datetime, timezone
+from typing import Any, Optional, cast
+
+from pydantic import BaseModel as PydanticModel
+from sqlalchemy import (
+    ColumnElement,
+    Date,
+    Select,
+    delete,
+    func,
+    literal,
+    select,
+    update,
+)
+from sqlalchemy import cast as sql_cast
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from wlu_chatbot.db.models import (
+    get_engine,
+    Conversation,
+    ConversationState,
+    DailyCourseUsage,
+    DailyStudentActivity,
+    Message,
+    MessageType,
+)
+
+COUNTED_FROM_MESSAGES = [
+    "student_messages",
+    "bot_messages",
+    "assistant_messages",
+    "conversations",
+    "redirects",
+]
+"""The columns of the daily usage that rebuild_daily_usage recounts."""
+
+
+class DailyUsage(PydanticModel):
+    """The usage of a course on one day."""
+
+    day: date
+    student_messages: int
+    bot_messages: int
+    assistant_messages: int
+    conversations: int
+    redirects: int
+    limit_hits: int
+    active_students: int
+
+
+class CourseAnalytics(PydanticModel):
+    """The usage of a course over a range of dates."""
+
+    start_date: Optional[date]
+    end_date: Optional[date]
+    student_messages: int
+    bot_messages: int
+    assistant_messages: int
+    conversations: int
+    redirects: int
+    limit_hits: int
+    active_students: int
+    redirect_rate: float
+    """The fraction of conversations started in the range that were redirected to an assistant."""
+    bot_messages_per_student: float
+    days: list[DailyUsage]
+
+
+def record_usage(
+    session: Session,
+    course_id: int,
+    email: Optional[str] = None,
+    student_messages: int = 0,
+    bot_messages: int = 0,
+    assistant_messages: int = 0,
+    conversations: int = 0,
+    redirects: int = 0,
+    limit_hits: int = 0,
+):
+    """Adds to the usage of a course today. The caller commits the session.
+
+    :param session: The session in which the counted event is committed.
+    :param course_id: The course that was used.
+    :param email: The student who sent the student messages, if any.
+    """
+    today = datetime.now(timezone.utc).date()
+    counts = {
+        "student_messages": student_messages,
+        "bot_messages": bot_messages,
+        "assistant_messages": assistant_messages,
+        "conversations": conversations,
+        "redirects": redirects,
+        "limit_hits": limit_hits,
+    }
+    if not any(counts.values()):
+        return
+
+    statement = insert(DailyCourseUsage).values(
+        course_id=course_id, day=today, **counts
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[DailyCourseUsage.course_id, DailyCourseUsage.day],
+            set_={
+                name: getattr(DailyCourseUsage, name) + statement.excluded[name]
+                for name, count in counts.items()
+                if count
+            },
+        )
+    )
+
+    if email is not None and student_messages:
+        statement = insert(DailyStudentActivity).values(
+            course_id=course_id,
+            day=today,
+            email=email,
+            student_messages=student_messages,
+        )
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[
+                    DailyStudentActivity.course_id,
+                    DailyStudentActivity.day,
+                    DailyStudentActivity.email,
+                ],
+                set_={
+                    "student_messages": DailyStudentActivity.student_messages
+                    + statement.excluded.student_messages
+                },
+            )
+        )
+
+
+def record_limit_hit(course_id: int):
+    """Counts a request to a course that was refused because a limit was reached."""
+    with Session(get_engine()) as session:
+        record_usage(session, course_id, limit_hits=1)
+        session.commit()
+
+
+def get_course_analytics(
+    course_id: int, start_date: Optional[date], end_date: Optional[date]
+) -> CourseAnalytics:
+    """Sums the daily usage of a course over a range of dates.
+
+    :param course_id: The course.
+    :param start_date: The first day of the range, or None to start with the first recorded day.
+    :param end_date: The last day of the range, or None to end with the last recorded day.
+    """
+    usage_conditions = [DailyCourseUsage.course_id == course_id]
+    activity_conditions = [DailyStudentActivity.course_id == course_id]
+    if start_date:
+        usage_conditions.append(DailyCourseUsage.day >= start_date)
+        activity_conditions.append(DailyStudentActivity.day >= start_date)
+    if end_date:
+        usage_conditions.append(DailyCourseUsage.day <= end_date)
+        activity_conditions.append(DailyStudentActivity.day <= end_date)
+
+    with Session(get_engine()) as session:
+        rows = session.execute(
+            select(DailyCourseUsage)
+            .where(*usage_conditions)
+            .order_by(DailyCourseUsage.day)
+        ).scalars()
+        active_per_day = dict(
+            cast(
+                list[tuple[date, int]],
+                session.execute(
+                    select(DailyStudentActivity.day, func.count())  # type: ignore
+                    .where(*activity_conditions)
+                    .group_by(DailyStudentActivity.day)
+                ).all(),
+            )
+        )
+        active_students = session.execute(
+            select(func.count(func.distinct(DailyStudentActivity.email))).where(
+                *activity_conditions
+            )
+        ).scalar_one()
+        days = [
+            DailyUsage(
+                day=cast(date, row.day),
+                student_messages=cast(int, row.student_messages),
+                bot_messages=cast(int, row.bot_messages),
+                assistant_messages=cast(int, row.assistant_messages),
+                conversations=cast(int, row.conversations),
+                redirects=cast(int, row.redirects),
+                limit_hits=cast(int, row.limit_hits),
+                active_students=active_per_day.get(cast(date, row.day), 0),
+            )
+            for row in rows
+        ]
+
+    conversations = sum(d.conversations for d in days)
+    redirects = sum(d.redirects for d in days)
+    bot_messages = sum(d.bot_messages for d in days)
+    return CourseAnalytics(
+        start_date=start_date,
+        end_date=end_date,
+        student_messages=sum(d.student_messages for d in days),
+        bot_messages=bot_messages,
+        assistant_messages=sum(d.assistant_messages for d in days),
+        conversations=conversations,
+        redirects=redirects,
+        limit_hits=sum(d.limit_hits for d in days),
+        active_students=active_students,
+        redirect_rate=redirects / conversations if conversations else 0.0,
+        bot_messages_per_student=bot_messages / active_students
+        if active_students
+        else 0.0,
+        days=days,
+    )
+
+
+def rebuild_daily_usage(course_id: Optional[int] = None):
+    """Recounts the daily usage that is derived from messages and conversations, keeping the limit hits.
+
+    A conversation counts on the day of its first message, and so does its
+    redirection, since the time of a redirection is not stored.
+
+    :param course_id: The course whose usage is recounted, or None to recount every course.
+    """
+    usage_conditions: list[ColumnElement[bool]] = []
+    activity_conditions: list[ColumnElement[bool]] = []
+    message_conditions: list[ColumnElement[bool]] = []
+    if course_id is not None:
+        usage_conditions.append(DailyCourseUsage.course_id == course_id)
+        activity_conditions.append(DailyStudentActivity.course_id == course_id)
+        message_conditions.append(Conversation.course_id == course_id)
+
+    day = sql_cast(Message.timestamp, Date)
+    messages: Select[*tuple[Any, ...]] = (  # type: ignore
+        select(  # type: ignore
+            Conversation.course_id,
+            day.label("day"),
+            func.count().filter(Message.type == MessageType.STUDENT_MESSAGE),
+            func.count().filter(Message.type == MessageType.BOT_MESSAGE),
+            func.count().filter(Message.type == MessageType.ASSISTANT_MESSAGE),
+            literal(0),
+            literal(0),
+            literal(0),
+        )
+        .join(Conversation, Message.conversation_id == Conversation.id)
+        .where(*message_conditions)
+        .group_by(Conversation.course_id, day)
+    )
+
+    first_messages = (
+        select(  # type: ignore
+            Message.conversation_id,
+            func.min(day).label("day"),
+        )
+        .group_by(Message.conversation_id)
+        .subquery()
+    )
+    conversations: Select[*tuple[Any, ...]] = (  # type: ignore
+        select(  # type: ignore
+            Conversation.course_id,
+            first_messages.c.day,
+            literal(0),
+            literal(0),
+            literal(0),
+            func.count(),
+            func.count().filter(Conversation.state != ConversationState.CHATBOT),  # type: ignore
+            literal(0),
+        )
+        .join(first_messages, first_messages.c.conversation_id == Conversation.id)
+        .where(*message_conditions)
+        .group_by(Conversation.course_id, first_messages.c.day)
+    )
+
+    activity: Select[*tuple[Any, ...]] = (  # type: ignore
+        select(  # type: ignore
+            Conversation.course_id,
+            day,
+            Message.written_by,
+            func.count(),
+        )
+        .join(Conversation, Message.conversation_id == Conversation.id)
+        .where(Message.type == MessageType.STUDENT_MESSAGE, *message_conditions)
+        .group_by(Conversation.course_id, day, Message.written_by)
+    )
+
+    columns = ["course_id", "day", *COUNTED_FROM_MESSAGES, "limit_hits"]
+    with Session(get_engine()) as session:
+        session.execute(
+            update(DailyCourseUsage)  # type: ignore
+            .where(*usage_conditions)
+            .values({name: 0 for name in COUNTED_FROM_MESSAGES})
+        )
+        for counts in (messages, conversations):
+            statement = insert(DailyCourseUsage).from_select(columns, counts)
+            session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[DailyCourseUsage.course_id, DailyCourseUsage.day],
+                    set_={
+                        name: getattr(DailyCourseUsage, name) + statement.excluded[name]
+                        for name in COUNTED_FROM_MESSAGES
+                    },
+                )
+            )
+
+        session.execute(delete(DailyStudentActivity).where(*activity_conditions))
+        session.execute(
+            insert(DailyStudentActivity).from_select(
+                ["course_id", "day", "email", "student_messages"], activity
+            )
+        )
+        session.commit()
@@ -0,0 +1,135 @@
+from dataclasses import dataclass, field, replace
+
+from wlu_chatbot.api.language_model import LanguageModelClient, ContentDict
+from wlu_chatbot.api.context_retrieval.retriever import RetrievedSegment
+
+MIN_TRUNCATED_TOKENS = 64
+"""The fewest tokens to which an item is truncated; an item that would be cut shorter is dropped instead."""
+
+
+def format_segment(segment: RetrievedSegment) -> str:
+    """Formats a retrieved segment as it appears in the context of a prompt."""
+    return f"Reference number: {segment.id}, text: {segment.text}"
+
+
+@dataclass
+class PackedContext:
+    """The retrieved segments and historical messages that fit within a token budget."""
+
+    segments: list[RetrievedSegment]
+    history: list[ContentDict]
+    tokens: int
+    dropped_segment_ids: list[int] = field(default_factory=list[int])
+    truncated_segment_ids: list[int] = field(default_factory=list[int])
+    dropped_history: int = 0
+    truncated_history: int = 0
+
+
+@dataclass
+class _Item:
+    value: float
+    tokens: int
+    segment_index: int | None = None
+    history_index: int | None = None
+
+
+def pack_context(
+    client: LanguageModelClient,
+    budget: int,
+    segments: list[RetrievedSegment],
+    history: list[ContentDict],
+) -> PackedContext:
+    """Chooses the retrieved segments and historical messages to include in a prompt
+    so that they together take at most a budget of tokens.
+
+    Items are ranked by value: segments by their retrieval rank and messages by
+    recency, counting a question and its answer as one exchange. The most
+    valuable items are kept whole; the item that no longer fits is truncated if
+    enough of it fits, and everything of lower value is dropped. Messages older
+    than a dropped message are dropped as well, so the history stays contiguous.
+
+    :param client: The client whose model the tokens are counted for.
+    :param budget: The number of tokens available for segments and history.
+    :param segments: The retrieved segments, most relevant first.
+    :param history: The historical messages, oldest first.
+    :return: The packed segments and history, in their original orders.
+    """
+    items: list[_Item] = []
+    for rank, segment in enumerate(segments):
+        items.append(
+            _Item(
+                value=1 / (1 + rank),
+                tokens=client.count_tokens(format_segment(segment) + "\n"),
+                segment_index=rank,
+            )
+        )
+    for age, content in enumerate(reversed(history)):
+        items.append(
+            _Item(
+                value=1 / (1 + age // 2),
+                tokens=client.count_tokens(content["parts"][0]["text"]),
+                history_index=len(history) - 1 - age,
+            )
+        )
+    # Ties go to history, since a follow-up question is meaningless without it.
+    items.sort(
+        key=lambda item: (item.value, item.history_index is not None), reverse=True
+    )
+
+    remaining = budget
+    packed_segments: dict[int, RetrievedSegment] = {}
+    packed_history: dict[int, ContentDict] = {}
+    packed = PackedContext(segments=[], history=[], tokens=0)
+    oldest_kept_history = len(history)
+
+    for item in items:
+        if item.history_index is not None and item.history_index > oldest_kept_history:
+            # A more recent message was dropped.
+            packed.dropped_history += 1
+            continue
+
+        fraction = 1.0
+        if item.tokens > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                fraction = 0.0
+            else:
+                fraction = remaining / item.tokens
+
+        if item.segment_index is not None:
+            segment = segments[item.segment_index]
+            if fraction == 0.0:
+                packed.dropped_segment_ids.append(segment.id)
+                continue
+            if fraction < 1.0:
+                segment = replace(segment, text=_truncate(segment.text, fraction))
+                packed.truncated_segment_ids.append(segment.id)
+            packed_segments[item.segment_index] = segment
+        elif item.history_index is not None:
+            content = history[item.history_index]
+            if fraction == 0.0:
+                packed.dropped_history += 1
+                oldest_kept_history = -1
+                continue
+            if fraction < 1.0:
+                text = _truncate(content["parts"][0]["text"], fraction)
+                content = ContentDict(role=content["role"], parts=[{"text": text}])
+                packed.truncated_history += 1
+            packed_history[item.history_index] = content
+            oldest_kept_history = item.history_index
+
+        used = min(item.tokens, remaining)
+        remaining -= used
+        packed.tokens += used
+
+    packed.segments = [packed_segments[i] for i in sorted(packed_segments)]
+    packed.history = [packed_history[i] for i in sorted(packed_history)]
+    return packed
+
+
+def _truncate(text: str, fraction: float) -> str:
+    """Keeps the leading fraction of a text, cut at a word boundary where possible."""
+    end = int(len(text) * fraction)
+    cut = text.rfind(" ", 0, end)
+    if cut > end // 2:
+        end = cut
+    return text[:end] + " ..."
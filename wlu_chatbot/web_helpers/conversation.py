@@ -1,5 +1,5 @@
 from typing import cast, Optional
-from flask import g
+from flask import g, current_app
 from flask_login import current_user  # type: ignore
 from sqlalchemy.orm import Session
 from pydantic import BaseModel as PydanticModel
@@ -11,40 +11,57 @@ from wlu_chatbot.db.models import (
     MessageType,
     ConversationState,
 )
+from wlu_chatbot.config import app_config
 from wlu_chatbot.api.language_model import LanguageModelClient, ContentDict
 from wlu_chatbot.api.context_retrieval import retriever
+from wlu_chatbot.api.context_retrieval.retriever import PREPARATION_WAIT_SECONDS
+from wlu_chatbot.api.message_embeddings import embed_message
+from wlu_chatbot.web_helpers.context_packing import pack_context, format_segment
+from wlu_chatbot.api.answer_cache import (
+    get_answer_cache_version,
+    find_cached_answer,
+    cache_answer,
+)
 
 SYSTEM_PROMPT = """# Main directive
-You are a helpful student tutor for a university statistics course. You must assist students in their learning by answering question in a didactically useful way. You should only answer questions if you are certain that you know the correct answer.
+You are a helpful student tutor for a university {subject} course. You must assist students in their learning by answering question in a didactically useful way. You should only answer questions if you are certain that you know the correct answer.
 You will be given context that may or may not be useful for answering the student's question followed by the question. Again, only answer the question if you are certain that you have a correct answer.
 Never explicitly say that you got information from the context or the references/numbers they come from, or tell students to reference document numbers. Only answer the students questions as if the information is coming from you.
 Your main priority is being a tutor, so answer pointed and direct questions but ask clarifying questions when a student asks a vague question. Lead to the student toward the correct answer in such cases.
 
 If the context is not relevant, and if it is not a follow up question, then you should tell the student, "I cannot find any relevant course materials to help answer your question."
+"""
 
-## Context
+# The system prompt comes first and the history next, since neither changes
+# between the turns of a conversation, so that backends can reuse the work for
+# that prefix of the prompt. The history therefore starts at the same message
+# for several turns and only grows at its end, rather than sliding with every
+# turn. The context retrieved for a question changes with every turn, so it
+# comes last, with the question.
+TURN_PROMPT = """## Context
 {context}
 
 ## Question
 {question}
 """
 
-CHARACTERS_PER_TOKEN = 4
 MAX_TOKENS_PER_INTERACTION = 10_000
 MAX_RESPONSE_TOKENS = 2000
-MAX_CHARACTERS_PER_REQUEST = (
-    MAX_TOKENS_PER_INTERACTION - MAX_RESPONSE_TOKENS
-) * CHARACTERS_PER_TOKEN
 
 
 def generate_response(
     client: LanguageModelClient,
     conversation_id: int,
-    history: int = 5,
+    history: int = 6,
     max_tokens: int = MAX_RESPONSE_TOKENS,
     stop_sequences: list[str] | None = None,
 ) -> Optional["GenerationResponse"]:
-    """Returns a bot message for a given conversation."""
+    """Returns a bot message for a given conversation.
+
+    :param history: The fewest earlier messages that are sent along, if there are that many.
+        The history starts at a multiple of this number, so that it stays the same while the
+        conversation grows by up to this many messages; an even number starts it with a question.
+    """
 
     if stop_sequences is None:
         stop_sequences = []
@@ -52,15 +69,19 @@ def generate_response(
     with Session(get_engine()) as session:
         conversation = session.get(Conversation, conversation_id)
 
+        earlier = (
+            session.query(Message)
+            .where(Message.conversation_id == conversation_id)
+            .count()
+            - 1
+        )
         messages = (
             session.query(Message)
             .where(Message.conversation_id == conversation_id)
-            .order_by(Message.timestamp.desc())
-            .limit(history + 1)
+            .order_by(Message.timestamp)
+            .offset(max(0, earlier // history - 1) * history)
         ).all()
 
-    messages.reverse()
-
     if conversation is None:
         raise ValueError("conversation should not be None.")
 
@@ -70,24 +91,99 @@ def generate_response(
     course_id: int = conversation.course_id  # type: ignore
     prompt = cast(str, messages[-1].body)
 
-    segments = retriever.get_segments_for(prompt, course_id=course_id, num_segments=8)
-    context = "\n".join(
-        map(lambda s: f"Reference number: {s.id}, text: {s.text}", segments)
+    # The retrieval usually ran in the background when the message was posted,
+    # and may still be running.
+    message_id = cast(int, messages[-1].id)
+    prepared = retriever.get_prepared_segments(
+        message_id,
+        course_id,
+        app_config.RETRIEVAL_NUM_SEGMENTS,
+        timeout=PREPARATION_WAIT_SECONDS,
+    )
+    prompt_embedding = (
+        embed_message(message_id, prompt)
+        if prepared is None
+        else prepared.prompt_embedding
     )
 
-    messages = list(map(message_to_history, messages[:-1]))
+    # Only first-turn questions are answered from the cache, since the answer
+    # to a follow-up question depends upon the rest of the conversation.
+    documents_version = (
+        get_answer_cache_version(course_id) if len(messages) == 1 else None
+    )
+    if documents_version is not None:
+        cached = find_cached_answer(course_id, documents_version, prompt_embedding)
+        if cached is not None:
+            return GenerationResponse(
+                text=cached.answer,
+                sources=[SegmentResponse(segment_id=i) for i in cached.segment_ids],
+            )
 
-    prompt_with_context = SYSTEM_PROMPT.format(context=context, question=prompt)
+    if prepared is not None:
+        segments = prepared.segments
+    else:
+        segments = retriever.get_segments_for(
+            prompt,
+            course_id=course_id,
+            num_segments=app_config.RETRIEVAL_NUM_SEGMENTS,
+            prompt_embedding=prompt_embedding,
+        )
+
+    # The system prompt and question are always sent; the segments and
+    # history share whatever remains of the model's context.
+    system_prompt = SYSTEM_PROMPT.format(subject=app_config.COURSE_SUBJECT)
+    budget = (
+        min(client.context_window, MAX_TOKENS_PER_INTERACTION)
+        - max_tokens
+        - client.count_tokens(system_prompt)
+        - client.count_tokens(TURN_PROMPT.format(context="", question=prompt))
+    )
+    packed = pack_context(
+        client, budget, segments, list(map(message_to_history, messages[:-1]))
+    )
+    if (
+        packed.dropped_segment_ids
+        or packed.truncated_segment_ids
+        or packed.dropped_history
+        or packed.truncated_history
+    ):
+        current_app.logger.info(
+            "Packed context for conversation %d into %d of %d tokens: dropped segments %s, truncated segments %s, dropped %d and truncated %d historical messages.",
+            conversation_id,
+            packed.tokens,
+            budget,
+            packed.dropped_segment_ids,
+            packed.truncated_segment_ids,
+            packed.dropped_history,
+            packed.truncated_history,
+        )
+
+    context = "\n".join(map(format_segment, packed.segments))
+
+    prompt_with_context = TURN_PROMPT.format(context=context, question=prompt)
 
     response = client.get_response(
-        contents=messages
+        contents=[ContentDict(role="system", parts=[{"text": system_prompt}])]
+        + packed.history
         + [ContentDict(role="user", parts=[{"text": prompt_with_context}])],
         max_tokens=max_tokens,
     )
 
-    sources = [SegmentResponse(segment_id=s.id) for s in segments]
+    segment_ids = [i for s in packed.segments for i in s.segment_ids]
+    sources = [SegmentResponse(segment_id=i) for i in segment_ids]
+
+    if documents_version is not None:
+        cache_answer(
+            course_id,
+            documents_version,
+            prompt_embedding,
+            segment_ids,
+            response.get_text(),
+        )
 
-    return GenerationResponse(text=response.get_text(), sources=sources)
+    return GenerationResponse(
+        text=response.get_text(), sources=sources, model=response.model
+    )
 
 
 class SegmentResponse(PydanticModel):
@@ -97,6 +193,8 @@ class SegmentResponse(PydanticModel):
 class GenerationResponse(PydanticModel):
     text: str
     sources: list[SegmentResponse]
+    model: Optional[str] = None
+    """The model that generated the text, or None if it was reused from the answer cache."""
 
 
 def message_to_history(message: Message) -> ContentDict:
@@ -4,10 +4,6 @@ import datetime
 from sqlalchemy.orm import Session
 from pydantic import BaseModel as PydanticModel
 
-from wlu_chatbot.api.language_model import (
-    LanguageModelClient,
-    get_language_model_client,
-)
 from wlu_chatbot.db.models import (
     get_engine,
     Limit,
@@ -88,16 +84,5 @@ class LimitUsageList(list[LimitUsage]):
         return limit_usages
 
 
-def get_language_model_client_with_limit_info(
-    email: str, course_id: int
-) -> tuple[LanguageModelClient, LimitUsageList]:
-    """Returns the language model client along with the current user's limit."""
-
-    client = get_language_model_client()
-
-    limit_usages = LimitUsageList.get(email, course_id)
-
-    return (client, limit_usages)
-
-
 TOO_MANY_REQUESTS = 429
+SERVICE_UNAVAILABLE = 503
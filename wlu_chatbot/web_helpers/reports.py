@@ -0,0 +1,140 @@
+"""Generates usage reports in the background and reuses them while they are current.
+
+A report is stored per course and range of dates. Requesting a report whose
+range has gained or lost messages since it was generated starts a new
+generation; otherwise the stored report, or the generation in progress, is
+reused.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional, cast
+
+from sqlalchemy import select, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from wlu_chatbot.background import run_in_background
+from wlu_chatbot.db.models import (
+    get_engine,
+    Conversation,
+    Message,
+    Report,
+    ReportStatus,
+)
+from wlu_chatbot.api.summary_generation import generate_usage_summary
+
+REPORT_TIMEOUT = timedelta(minutes=30)
+"""How long a report may stay pending before a request generates it again, in case its generation was lost."""
+
+
+def request_report(
+    course_id: int, time_start: Optional[datetime], time_end: Optional[datetime]
+) -> tuple[int, ReportStatus]:
+    """Gets the report of a course for a range of dates, starting its generation in the background
+    unless a current report exists or is being generated. Must be called from within a request context.
+
+    :return: The id and status of the report.
+    """
+    with Session(get_engine()) as session:
+        message_count, last_message_id = _messages_in_range(
+            session, course_id, time_start, time_end
+        )
+        row = cast(
+            Optional[tuple[Report, bool]],
+            session.execute(
+                select(  # type: ignore
+                    Report,
+                    Report.requested_at > datetime.now(timezone.utc) - REPORT_TIMEOUT,
+                ).where(
+                    Report.course_id == course_id,
+                    Report.time_start.is_not_distinct_from(time_start),
+                    Report.time_end.is_not_distinct_from(time_end),
+                )
+            ).first(),
+        )
+
+        if row is not None:
+            report, recent = row
+            unchanged = (
+                cast(int, report.message_count) == message_count
+                and cast(Optional[int], report.last_message_id) == last_message_id
+            )
+            if unchanged and (
+                report.status == ReportStatus.READY
+                or (report.status == ReportStatus.PENDING and recent)
+            ):
+                return cast(int, report.id), report.status
+        else:
+            report = Report(
+                course_id=course_id, time_start=time_start, time_end=time_end
+            )
+            session.add(report)
+
+        report.status = ReportStatus.PENDING
+        report.content = None  # type: ignore
+        report.message_count = message_count  # type: ignore
+        report.last_message_id = last_message_id  # type: ignore
+        report.requested_at = datetime.now(timezone.utc)  # type: ignore
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another request created the report first.
+            session.rollback()
+            return request_report(course_id, time_start, time_end)
+        report_id = cast(int, report.id)
+
+    run_in_background(generate_report, report_id)
+    with Session(get_engine()) as session:
+        # The report may have been generated already if it was generated inline.
+        report = session.get(Report, report_id)
+        return report_id, ReportStatus.PENDING if report is None else report.status
+
+
+def generate_report(report_id: int):
+    """Generates a requested report and stores it, unless the report was requested again meanwhile."""
+    with Session(get_engine()) as session:
+        report = session.get(Report, report_id)
+        if report is None:
+            return
+        course_id = cast(int, report.course_id)
+        time_start = cast(Optional[datetime], report.time_start)
+        time_end = cast(Optional[datetime], report.time_end)
+        requested_at = cast(datetime, report.requested_at)
+        course_name = cast(str, report.course.name)
+
+    status, content = ReportStatus.FAILED, None
+    try:
+        content = generate_usage_summary(course_id, time_start, time_end, course_name)
+        status = ReportStatus.READY
+    finally:
+        with Session(get_engine()) as session:
+            session.execute(
+                update(Report)  # type: ignore
+                .where(Report.id == report_id, Report.requested_at == requested_at)
+                .values(status=status, content=content)
+            )
+            session.commit()
+
+
+def _messages_in_range(
+    session: Session,
+    course_id: int,
+    time_start: Optional[datetime],
+    time_end: Optional[datetime],
+) -> tuple[int, Optional[int]]:
+    """Counts the messages of a course in a range of dates and finds the newest of them."""
+    conditions = [Conversation.course_id == course_id]
+    if time_start:
+        conditions.append(Message.timestamp > time_start)
+    if time_end:
+        conditions.append(Message.timestamp < time_end)
+    return cast(
+        tuple[int, Optional[int]],
+        tuple(
+            session.execute(
+                select(func.count(Message.id), func.max(Message.id))  # type: ignore
+                .join(Conversation, Message.conversation_id == Conversation.id)
+                .where(*conditions)
+            ).one()
+        ),
+    )
@@ -11,7 +11,11 @@ from . import message_routes
 from . import limit_routes
 from . import document_routes
 from . import participates_in_routes
-from flask import Blueprint
+from . import metrics_routes
+from flask import Blueprint, jsonify
+
+from wlu_chatbot.api.language_model import OverloadedError
+from wlu_chatbot.web_helpers.limit import SERVICE_UNAVAILABLE
 
 bp = Blueprint("web_interface", __name__, url_prefix="")
 bp.register_blueprint(authentication_routes.bp, url_prefix="")
@@ -25,3 +29,14 @@ bp.register_blueprint(message_routes.bp, url_prefix="")
 bp.register_blueprint(limit_routes.bp, url_prefix="")
 bp.register_blueprint(document_routes.bp, url_prefix="")
 bp.register_blueprint(participates_in_routes.bp, url_prefix="")
+bp.register_blueprint(metrics_routes.bp, url_prefix="")
+
+
+@bp.app_errorhandler(OverloadedError)
+def overloaded(error: OverloadedError):
+    """Responds that the language model is too busy, rather than failing, when a request is not admitted to it."""
+    return (
+        jsonify({"error": str(error)}),
+        SERVICE_UNAVAILABLE,
+        {"Retry-After": str(error.retry_after)},
+    )
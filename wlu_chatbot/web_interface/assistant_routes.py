@@ -1,3 +1,5 @@
+from typing import cast
+
 from flask import (
     Blueprint,
     render_template,
@@ -23,6 +25,7 @@ from wlu_chatbot.db.models import (
     ParticipatesIn,
 )
 from wlu_chatbot.api.summary_generation import generate_conversation_summary
+from wlu_chatbot.web_helpers.analytics import record_usage
 
 
 bp = Blueprint("assistant_routes", __name__)
@@ -173,6 +176,7 @@ def assistant_send_message(conversation_id: int):
         written_by=user_email,
     )
     session.add(assistant_message)
+    record_usage(session, cast(int, conversation.course_id), assistant_messages=1)
     session.commit()
 
     return jsonify({"status": "sent", "message": "Assistant message sent successfully"})
@@ -1,4 +1,4 @@
-from typing import Any, cast
+from typing import Any, Optional, cast
 
 
 from flask import (
@@ -7,35 +7,49 @@ from flask import (
     request,
     jsonify,
     abort,
+    url_for,
 )
 from flask_login import current_user, login_required  # type: ignore
 from pydantic import BaseModel as PydanticModel
-
-from wlu_chatbot.api.language_model.response import LanguageModelClient
+from sqlalchemy import select
+
+from wlu_chatbot.background import run_in_background
+from wlu_chatbot.api.language_model import (
+    get_admission_controller,
+    get_language_model_client,
+    LanguageModelClient,
+    Priority,
+)
 from wlu_chatbot.decorators import roles_required, consent_required
 from wlu_chatbot.web_helpers.limit import (
-    get_language_model_client_with_limit_info,
     LimitUsageList,
+    SERVICE_UNAVAILABLE,
     TOO_MANY_REQUESTS,
 )
-from wlu_chatbot.web_helpers.conversation import (
-    current_user_initiated_or_assists,
-    generate_response,
-)
+from wlu_chatbot.web_helpers.analytics import record_usage, record_limit_hit
+from wlu_chatbot.web_helpers.ai_responses import request_ai_response
+from wlu_chatbot.web_helpers.conversation import current_user_initiated_or_assists
 from wlu_chatbot.db.models import (
     Session,
     get_engine,
+    AiResponseJob,
+    AiResponseStatus,
     ConversationState,
     Conversation,
     ParticipatesIn,
     Message,
     MessageType,
-    Reference,
 )
 
 
 bp = Blueprint("conversation_routes", __name__)
 
+DEFAULT_TITLE = "Conversation"
+"""The title of a conversation until one is generated from its first message."""
+
+TITLE_MAX_TOKENS = 30
+"""The largest number of tokens in a generated title, which is at most 30 characters."""
+
 
 def get_course_from_url(kwargs: dict[str, Any]):
     """Gets the course id from the url"""
@@ -55,6 +69,20 @@ def get_course_from_json_body(_: dict[str, Any]):
     return request.json and int(request.json["course_id"])
 
 
+def get_course_from_job_in_url(kwargs: dict[str, Any]) -> Optional[int]:
+    """Gets the course id from the job_id of an AI response in the url."""
+    with Session(get_engine()) as session:
+        return cast(
+            Optional[int],
+            session.execute(
+                select(Conversation.course_id)  # type: ignore
+                .join(Message, Message.conversation_id == Conversation.id)
+                .join(AiResponseJob, AiResponseJob.message_id == Message.id)
+                .where(AiResponseJob.id == int(kwargs["job_id"]))
+            ).scalar_one_or_none(),
+        )
+
+
 def get_course_from_conversation_in_url(kwargs: dict[str, Any]):
     """Gets the course id from the conversation_id in the url."""
     with Session(get_engine()) as session:
@@ -102,6 +130,7 @@ def post_conversation():
     limit_usages = LimitUsageList.get(current_user.email, data.course_id)
 
     if limit_usages.reached:
+        record_limit_hit(data.course_id)
         return jsonify(
             LimitReachedResponse(
                 error="Could not create a new conversation because one of your rate limits has been violated for this course: Wait until you have available usages before submitting another request."
@@ -113,6 +142,7 @@ def post_conversation():
             course_id=data.course_id, initiated_by=current_user.email, title=data.title
         )
         session.add(new_conv)
+        record_usage(session, data.course_id, conversations=1)
         session.commit()
 
         conv_id = cast(int, new_conv.id)
@@ -216,6 +246,9 @@ def patch_conversation(conversation_id: int):
                     if number_of_assistants == 0:
                         abort(400)
                     conversation.state = ConversationState.REDIRECTED
+                    record_usage(
+                        session, cast(int, conversation.course_id), redirects=1
+                    )
                 case (ConversationState.REDIRECTED, ConversationState.RESOLVED):
                     conversation.state = ConversationState.RESOLVED
                 case _:
@@ -231,78 +264,128 @@ def patch_conversation(conversation_id: int):
     ["student", "assistant", "instructor"], get_course_from_conversation_in_url
 )
 def post_ai_response(conversation_id: int):
-    """Generates a new ai generated Message for a conversation that responds to the historical context of the conversation."""
+    """Starts generating an AI response to the newest message of a conversation.
+    Responds with the job that generates it, which is followed at its status_url until it is ready.
+    """
     with Session(get_engine()) as session:
         conv = session.get(Conversation, conversation_id)
         if conv is None:
             abort(404)
         if conv.initiated_by != current_user.email:
             abort(403)
-        client, limit_usages = get_language_model_client_with_limit_info(
-            current_user.email,
-            conv.course_id,  # type: ignore
-        )
+        limit_usages = LimitUsageList.get(current_user.email, cast(int, conv.course_id))
 
         if limit_usages.reached:
+            record_limit_hit(cast(int, conv.course_id))
             return jsonify(
                 LimitReachedResponse(
                     error="Could not generate a response from from the AI Tutor because one of your rate limits has been violated for this course: Wait until you have available usages before submitting another request."
                 ).model_dump()
             ), TOO_MANY_REQUESTS
 
-        number_of_messages = (
+        messages = (
             session.query(Message)
             .where(Message.conversation_id == conversation_id)
-            .count()
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(2)
+            .all()
         )
 
-        if number_of_messages == 0:
+        if len(messages) == 0:
             abort(
                 400,
                 "There must be at least one message in the conversation before the AI Tutor can responsd.",
             )
-        elif number_of_messages == 1:
-            first_message = (
-                session.query(Message)
-                .where(Message.conversation_id == conversation_id)
-                .one()
-            )
-            title = generate_title(client, cast(str, first_message.body))
-            conv.title = title  # type: ignore
-            session.commit()
+        if messages[0].type != MessageType.STUDENT_MESSAGE:  # type: ignore
+            abort(400, "Could not generate an AI Tutor response.")
+        message_id = cast(int, messages[0].id)
+        untitled = cast(Optional[str], conv.title) in (None, DEFAULT_TITLE)
+        first_message = (
+            cast(str, messages[0].body) if len(messages) == 1 and untitled else None
+        )
+
+    controller = get_admission_controller()
+    if controller.is_full(Priority.INTERACTIVE):
+        return (
+            jsonify(
+                LimitReachedResponse(
+                    error="The AI Tutor is answering too many questions right now. Try again in a moment."
+                ).model_dump()
+            ),
+            SERVICE_UNAVAILABLE,
+            {"Retry-After": str(controller.retry_after())},
+        )
 
-        conversation_title = str(conv.title)
+    job_id, status, created = request_ai_response(message_id, current_user.email)
+    if created and first_message is not None:
+        # The title is generated alongside the response rather than before
+        # it, so that the student waits for only one completion. It is only
+        # scheduled along with a new job, so that refused and repeated
+        # requests do not spend completions on it.
+        run_in_background(title_conversation, conversation_id, first_message)
+    return _ai_response_job_response(job_id, status)
 
-    response = generate_response(client, conversation_id=conversation_id)
-    if response is None:
-        # This would likely be because the most recent message in the chat
-        # was not a student message.
-        abort(400, "Could not generate an AI Tutor response.")
 
+@bp.get("/ai-response-jobs/<int:job_id>")
+@login_required
+@roles_required(["student", "assistant", "instructor"], get_course_from_job_in_url)
+def get_ai_response_job(job_id: int):
+    """Responds with the status of a job that generates an AI response, and with the response once it is ready."""
     with Session(get_engine()) as session:
-        bot_message = Message(
-            body=response.text,
-            type=MessageType.BOT_MESSAGE,
-            written_by=current_user.email,
-            conversation_id=conversation_id,
-        )
-        session.add(bot_message)
+        job = session.get(AiResponseJob, job_id)
+        if job is None:
+            abort(404)
+        if job.requested_by != current_user.email:
+            abort(403)
+        status = job.status
 
-        session.commit()
+    return _ai_response_job_response(job_id, status)
 
-        for source in response.sources:
-            session.add(
-                Reference(message_id=bot_message.id, segment_id=source.segment_id)
-            )
 
+def title_conversation(conversation_id: int, message: str):
+    """Generates a title for a conversation from its first message and stores it."""
+    title = generate_title(get_language_model_client(Priority.TITLE), message)
+    with Session(get_engine()) as session:
+        conv = session.get(Conversation, conversation_id)
+        if conv is None:
+            return
+        conv.title = title  # type: ignore
         session.commit()
-        return jsonify(
-            PostAiResponse(
-                text=response.text,
-                title=conversation_title,
-                message_id=cast(int, bot_message.id),
-            ).model_dump()
-        )
+
+
+def _ai_response_job_response(job_id: int, status: AiResponseStatus):
+    """Describes a job that generates an AI response, with 200 if it is ready and 202 if it is still pending."""
+    text, title, message_id, title_pending = None, None, None, False
+    if status == AiResponseStatus.READY:
+        with Session(get_engine()) as session:
+            job = session.get(AiResponseJob, job_id)
+            bot_message = (
+                session.get(Message, job.bot_message_id) if job is not None else None
+            )
+            if bot_message is not None:
+                text = cast(str, bot_message.body)
+                message_id = cast(int, bot_message.id)
+                conv = bot_message.conversation
+                title = cast(Optional[str], conv.title) or DEFAULT_TITLE
+                # A generated title may still be on its way after the first response.
+                title_pending = title == DEFAULT_TITLE and (
+                    session.query(Message)
+                    .where(Message.conversation_id == conv.id)
+                    .count()
+                    == 2
+                )
+
+    return jsonify(
+        AiResponseJobResponse(
+            job_id=job_id,
+            status=status.value,
+            status_url=url_for(".get_ai_response_job", job_id=job_id),
+            text=text,
+            title=title,
+            title_pending=title_pending,
+            message_id=message_id,
+        ).model_dump()
+    ), (200 if status != AiResponseStatus.PENDING else 202)
 
 
 def generate_title(client: LanguageModelClient, message: str):
@@ -313,7 +396,7 @@ def generate_title(client: LanguageModelClient, message: str):
     """
     prompt = f"With a user's first message in a AI chatbot conversation, {message}, generate a 30 character max title for this conversation. Do not actually answer the question, just sumarize it in 30 characters max. Do not generate anything else, only the 30 character max title"
     response = client.get_response(
-        [{"role": "user", "parts": [{"text": prompt}]}], max_tokens=30
+        [{"role": "user", "parts": [{"text": prompt}]}], max_tokens=TITLE_MAX_TOKENS
     )
 
     return response.get_text()[:30]
@@ -329,10 +412,17 @@ class ConversationListResponse(PydanticModel):
     conversations: list[ConversationResponse]
 
 
-class PostAiResponse(PydanticModel):
-    text: str
-    title: str
-    message_id: int
+class AiResponseJobResponse(PydanticModel):
+    job_id: int
+    status: str
+    status_url: str
+    text: Optional[str]
+    """The response, once the job is ready."""
+    title: Optional[str]
+    title_pending: bool
+    """Whether the conversation's title is still being generated, in which case it is to be fetched again later."""
+    message_id: Optional[int]
+    """The bot message of the response, once the job is ready."""
 
 
 class PostConversationRequest(PydanticModel):
@@ -1,4 +1,4 @@
-from typing import Optional, cast, Any
+from typing import Optional, Sequence, cast, Any
 import io
 from pathlib import PurePath
 
@@ -17,12 +17,22 @@ from werkzeug.datastructures import FileStorage
 
 from pydantic import BaseModel as PydanticModel
 
+from wlu_chatbot.config import app_config, RetrievalBackend
 from wlu_chatbot.decorators import roles_required
-from wlu_chatbot.db.models import Session, get_engine, Document, Segment, Embedding
+from wlu_chatbot.db.models import (
+    Session,
+    get_engine,
+    Document,
+    Segment,
+    Embedding,
+    bump_documents_version,
+)
 from wlu_chatbot.api.file_storage import get_storage_service
 from wlu_chatbot.api.file_parsing import parse_file, FileParsingError
 from wlu_chatbot.api.embedding import embed_text
 from wlu_chatbot.api.hashing import hash_bytes
+from wlu_chatbot.api.answer_cache import invalidate_cached_answers
+from wlu_chatbot.api.context_retrieval.vector_index import get_vector_index
 
 bp = Blueprint("document_routes", __name__)
 
@@ -105,15 +115,28 @@ def post_document():
         )
         session.add(document)
         session.flush()
+        segment_ids: list[int] = []
+        vectors: list[Sequence[float]] = []
         for seg in segments:
             segment = Segment(text=seg, document_id=document.id)
             session.add(segment)
             session.flush()
-            session.add(Embedding(vector=embed_text(seg), segment_id=segment.id))
+            vector = embed_text(seg)
+            session.add(Embedding(vector=vector, segment_id=segment.id))
+            segment_ids.append(cast(int, segment.id))
+            vectors.append(vector)
+        documents_version = bump_documents_version(session, course_id)
+        invalidate_cached_answers(session, course_id)
         session.commit()
 
+        document_id = cast(int, document.id)
         file_path = document.full_file_path
 
+    if app_config.RETRIEVAL_BACKEND == RetrievalBackend.NUMPY:
+        get_vector_index().add_document(
+            course_id, documents_version, document_id, segment_ids, vectors
+        )
+
     file_data.seek(0)
     storage_service.save_file(file_data, file_path)
 
@@ -132,9 +155,15 @@ def delete_document(document_id: int):
             abort(404)
 
         full_path = document.full_file_path
+        course_id = cast(int, document.course_id)
         session.delete(document)
+        documents_version = bump_documents_version(session, course_id)
+        invalidate_cached_answers(session, course_id)
         session.commit()
 
+    if app_config.RETRIEVAL_BACKEND == RetrievalBackend.NUMPY:
+        get_vector_index().remove_document(course_id, documents_version, document_id)
+
     storage_service = get_storage_service()
 
     storage_service.delete_file(full_path)
@@ -5,11 +5,13 @@ from flask import (
     render_template,
     request,
     abort,
+    jsonify,
+    url_for,
     Response as FlaskResponse,
 )
 
-from sqlalchemy import select
 from flask_login import login_required  # type: ignore
+from pydantic import BaseModel as PydanticModel
 from datetime import datetime
 
 from wlu_chatbot.decorators import roles_required
@@ -20,9 +22,12 @@ from wlu_chatbot.db.models import (
     ParticipatesIn,
     Document,
     User,
+    Report,
+    ReportStatus,
 )
 
-from wlu_chatbot.api.summary_generation import generate_usage_summary
+from wlu_chatbot.web_helpers.reports import request_report
+from wlu_chatbot.web_helpers.analytics import get_course_analytics
 
 bp = Blueprint("instructor_portal", __name__)
 
@@ -90,7 +95,8 @@ def conv_date(date: Optional[str]) -> Optional[datetime]:
 @login_required
 @roles_required(["instructor"], course_from_url)
 def post_summary(course_id: int):
-    """Generates a summary of student conversations for a course
+    """Requests a summary of student conversations for a course, which is generated in the background.
+    Responds with the summary's status, and with 202 Accepted while it is being generated.
     :param course_id: The course that is to be summarised.
     """
     start_date = request.form.get("start_date")
@@ -103,11 +109,51 @@ def post_summary(course_id: int):
     end_date = conv_date(end_date)
 
     with Session(get_engine()) as session:
-        stmt = select(Course.name).where(Course.id == course_id)
+        if session.get(Course, course_id) is None:
+            abort(404)
+
+    report_id, status = request_report(course_id, start_date, end_date)
+    return (
+        jsonify(_summary_response(course_id, report_id, status).model_dump()),
+        200 if status == ReportStatus.READY else 202,
+    )
+
+
+@bp.route("/courses/<int:course_id>/summaries/<int:report_id>", methods=["GET"])
+@login_required
+@roles_required(["instructor"], course_from_url)
+def get_summary(course_id: int, report_id: int):
+    """Responds with the status of a summary.
+    :param course_id: The course that is summarised.
+    :param report_id: The summary.
+    """
+    with Session(get_engine()) as session:
+        report = session.get(Report, report_id)
+        if report is None or cast(int, report.course_id) != course_id:
+            abort(404)
+        status = report.status
 
-        course_name = session.execute(stmt).scalar_one()
+    return jsonify(_summary_response(course_id, report_id, status).model_dump())
 
-    summary = generate_usage_summary(course_id, start_date, end_date, course_name)
+
+@bp.route(
+    "/courses/<int:course_id>/summaries/<int:report_id>/download", methods=["GET"]
+)
+@login_required
+@roles_required(["instructor"], course_from_url)
+def download_summary(course_id: int, report_id: int):
+    """Responds with a generated summary as a text file.
+    :param course_id: The course that is summarised.
+    :param report_id: The summary.
+    """
+    with Session(get_engine()) as session:
+        report = session.get(Report, report_id)
+        if report is None or cast(int, report.course_id) != course_id:
+            abort(404)
+        if report.status != ReportStatus.READY:
+            abort(409, "The summary has not been generated.")
+        course_name = cast(str, report.course.name)
+        summary = cast(str, report.content)
 
     return FlaskResponse(
         summary,
@@ -116,3 +162,47 @@ def post_summary(course_id: int):
             "Content-disposition": f"attachment; filename={course_name}_Report.txt"
         },
     )
+
+
+@bp.route("/courses/<int:course_id>/analytics", methods=["GET"])
+@login_required
+@roles_required(["instructor"], course_from_url)
+def get_analytics(course_id: int):
+    """Responds with the usage of a course per day and in total over a range of dates.
+    The range is given by the optional start_date and end_date query parameters, which are inclusive.
+    :param course_id: The course whose usage is responded with.
+    """
+    try:
+        start_date = conv_date(request.args.get("start_date"))
+        end_date = conv_date(request.args.get("end_date"))
+    except ValueError:
+        abort(400, "Dates must be given as YYYY-MM-DD.")
+
+    analytics = get_course_analytics(
+        course_id,
+        start_date.date() if start_date else None,
+        end_date.date() if end_date else None,
+    )
+    return jsonify(analytics.model_dump(mode="json"))
+
+
+def _summary_response(
+    course_id: int, report_id: int, status: ReportStatus
+) -> "SummaryResponse":
+    return SummaryResponse(
+        report_id=report_id,
+        status=status,
+        status_url=url_for(".get_summary", course_id=course_id, report_id=report_id),
+        download_url=url_for(
+            ".download_summary", course_id=course_id, report_id=report_id
+        )
+        if status == ReportStatus.READY
+        else None,
+    )
+
+
+class SummaryResponse(PydanticModel):
+    report_id: int
+    status: ReportStatus
+    status_url: str
+    download_url: Optional[str]
@@ -11,8 +11,11 @@ from flask import (
 from flask_login import current_user, login_required  # type: ignore
 from pydantic import BaseModel as PydanticModel
 
+from wlu_chatbot.config import app_config
 from wlu_chatbot.decorators import roles_required, consent_required
+from wlu_chatbot.api.context_retrieval import retriever
 from wlu_chatbot.web_helpers.limit import LimitUsageList, TOO_MANY_REQUESTS
+from wlu_chatbot.web_helpers.analytics import record_usage, record_limit_hit
 from wlu_chatbot.db.models import (
     Session,
     get_engine,
@@ -149,6 +152,7 @@ def post_message():
                 current_user.email, cast(int, conv.course_id)
             ).reached
         ):
+            record_limit_hit(cast(int, conv.course_id))
             abort(
                 TOO_MANY_REQUESTS,
                 "Could not send message because one of your rate limits for this course has been reached. Please wait until you have some usages before sending another request.",
@@ -163,8 +167,27 @@ def post_message():
         )
 
         session.add(message)
+        if g.role == "assistant":
+            record_usage(session, cast(int, conv.course_id), assistant_messages=1)
+        else:
+            record_usage(
+                session,
+                cast(int, conv.course_id),
+                email=current_user.email,
+                student_messages=1,
+            )
         session.commit()
 
+        if conv.state == ConversationState.CHATBOT and g.role != "assistant":
+            # Retrieval does not depend on the conversation's history, so it
+            # can run before the student requests a response.
+            retriever.start_preparing_for_message(
+                cast(int, message.id),
+                data.body,
+                cast(int, conv.course_id),
+                app_config.RETRIEVAL_NUM_SEGMENTS,
+            )
+
         if not (
             conv.initiated_by == current_user.email
             or g.role == "assistant"
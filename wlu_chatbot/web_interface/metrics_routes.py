@@ -0,0 +1,47 @@
+from flask import Blueprint, abort, jsonify
+from flask_login import current_user, login_required  # type: ignore
+
+from wlu_chatbot.api.language_model import get_admission_controller, get_backend_metrics
+from wlu_chatbot.config import app_config
+from wlu_chatbot.db.models import Session, get_engine, ParticipatesIn
+
+bp = Blueprint("metrics_routes", __name__)
+
+
+@bp.get("/metrics/llm")
+@login_required
+def get_llm_metrics():
+    """Responds with the queue depth and admission counts of the requests that this
+    process sends to the language model. Only instructors may see them.
+
+    Each of the server's worker processes admits its own requests, so the counts
+    cover only the worker that serves the request; "workers" tells how many there are.
+    """
+    _require_instructor()
+    metrics = get_admission_controller().metrics().model_dump()
+    return jsonify({**metrics, "workers": app_config.SERVER_WORKERS})
+
+
+@bp.get("/metrics/llm/backends")
+@login_required
+def get_llm_backend_metrics():
+    """Responds with the circuit state, latency and error rate of each language model
+    backend among which this process routes requests. Only instructors may see them."""
+    _require_instructor()
+    return jsonify([metrics.model_dump() for metrics in get_backend_metrics()])
+
+
+def _require_instructor():
+    """Aborts with 403 unless the current user is an instructor of some course."""
+    with Session(get_engine()) as session:
+        is_instructor = (
+            session.query(ParticipatesIn)
+            .where(
+                ParticipatesIn.email == current_user.email,
+                ParticipatesIn.role == "instructor",
+            )
+            .first()
+            is not None
+        )
+    if not is_instructor:
+        abort(403)